@@ -0,0 +1,91 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Compare a delta transfer of an artifact against a plain transfer.
+
+Generates an artifact of random data and new versions of it: with a few
+bytes changed in place, with data inserted, and with a quarter of it
+replaced. Times ``compute_delta`` for each and adds the time to send the
+literal data over a link of ``--link-mbps``. Prints that next to the
+time a plain transfer of the whole artifact takes over the same link.
+
+    python benchmarks/delta_throughput.py [--size-mb 128] [--link-mbps 100]
+"""
+
+import argparse
+import hashlib
+import random
+import time
+
+from horus_deploy import delta
+
+
+def _signature(data, block_size):
+    # What signature_command prints on a host with Python 3.
+    blocks = []
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        blocks.append((delta.weak_checksum(block), hashlib.md5(block).hexdigest()))
+    return delta.Signature(block_size, len(data), blocks)
+
+
+def _versions(old, rng):
+    size = len(old)
+    changed = bytearray(old)
+    for offset in rng.sample(range(size), 20):
+        changed[offset] ^= 0xFF
+    inserted = old[:size // 3] + rng.randbytes(4096) + old[size // 3:]
+    replaced = old[:size // 2] + rng.randbytes(size // 4) + old[size // 2 + size // 4:]
+    return {
+        "20 bytes changed": bytes(changed),
+        "4 KiB inserted": inserted,
+        "quarter replaced": replaced,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--link-mbps", type=float, default=100, help="link speed in Mbit/s")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    old = rng.randbytes(args.size_mb * 1024 * 1024)
+    block_size = delta.block_size_for(len(old))
+    signature = _signature(old, block_size)
+    bytes_per_second = args.link_mbps * 1e6 / 8
+
+    print(f"{args.size_mb} MiB artifact, {block_size // 1024} KiB blocks, "
+          f"{args.link_mbps:g} Mbit/s link")
+    print(f"{'plain transfer':<20} {len(old) / bytes_per_second:8.2f} s")
+
+    for name, new in _versions(old, rng).items():
+        start = time.perf_counter()
+        ops = delta.compute_delta(new, signature)
+        scan = time.perf_counter() - start
+        literal = sum(length for op, _, length in ops or [] if op == "literal")
+        send = literal / bytes_per_second
+        print(f"{name:<20} {scan + send:8.2f} s "
+              f"(scan {scan:.2f} s, {literal / 1e6:.1f} MB literal)")
+
+
+if __name__ == "__main__":
+    main()
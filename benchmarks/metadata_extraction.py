@@ -0,0 +1,75 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Compare the speed of the ways ``extract_metadata`` finds METADATA.
+
+Generates deploy scripts with a large embedded data structure, before
+or after METADATA, and times tokenizing up to METADATA against parsing
+the whole script. Prints the milliseconds per script for each.
+
+    python benchmarks/metadata_extraction.py [--entries 1000 10000]
+"""
+
+import argparse
+import timeit
+
+from horus_deploy import metadata
+
+
+_METADATA = '''\
+METADATA = {
+    "name": "Generated",
+    "description": "A generated deploy script.",
+    "parameters": {"install": "Path to artifact."},
+}
+'''
+
+
+def _script(entries, data_first):
+    rows = "".join(f'    {{"id": {i}, "name": "item-{i}", "tags": ["a", "b"]}},\n'
+                   for i in range(entries))
+    data = f"DATA = [\n{rows}]\n"
+    return data + _METADATA if data_first else _METADATA + data
+
+
+def _measure(name, func, source):
+    number = 3
+    seconds = min(timeit.repeat(lambda: func(source), number=number, repeat=3)) / number
+    print(f"{name:<36} {seconds * 1000:10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+
+    for entries in args.entries:
+        for data_first in [False, True]:
+            source = _script(entries, data_first)
+            where = "after" if not data_first else "before"
+            print(f"{entries} entries {where} METADATA, {len(source) / 1e6:.1f} MB:")
+            _measure("  ast.parse", metadata._extract_from_ast, source)
+            _measure("  tokenize", metadata._extract_from_tokens, source)
+            _measure("  extract_metadata", metadata.extract_metadata, source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Measure upload throughput of ``horus_deploy.transfer.sftp_put``.
+
+Starts ``sshd.py`` in a separate process, or uses ``--host``, and uploads
+a file of random data with paramiko's ``SFTPClient.put`` (what pyinfra
+uses) and with ``sftp_put``. Prints MB/s for each.
+
+The stand-in is written in Python too, so on a single machine both
+sides compete for CPU. Use ``--host`` with a device for numbers that
+reflect a deploy.
+
+    python benchmarks/sftp_throughput.py [--size-mb 256] [--host 127.0.0.1:2222]
+"""
+
+from gevent import monkey
+
+# pyinfra runs operations with gevent's monkey patching, so do the same.
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from pathlib import Path  # noqa: E402
+
+import paramiko  # noqa: E402
+
+from horus_deploy import transfer  # noqa: E402
+
+
+class _Host:
+    """Enough of pyinfra's ``Host`` for ``sftp_put``."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __str__(self):
+        return "benchmark"
+
+
+def _connect(address, attempts=50):
+    hostname, _, port = address.partition(":")
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    for _ in range(attempts):
+        try:
+            client.connect(
+                hostname,
+                int(port or 22),
+                username="root",
+                password="",
+                look_for_keys=False,
+                allow_agent=False,
+            )
+            return client
+        except OSError:
+            time.sleep(0.1)
+
+    raise SystemExit(f"cannot connect to {address}")
+
+
+def _measure(name, size, upload):
+    start = time.perf_counter()
+    upload()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {size / elapsed / 1e6:8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--host", help="host:port of an SSH server, started when omitted")
+    parser.add_argument("--dest-dir", default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    server = None
+    address = args.host
+    if not address:
+        address = "127.0.0.1:2299"
+        server = subprocess.Popen(
+            [sys.executable, str(Path(__file__).parent / "sshd.py"), "--port", "2299"],
+            stdout=subprocess.DEVNULL,
+        )
+
+    try:
+        client = _connect(address)
+        host = _Host(client)
+        size = args.size_mb * 1024 * 1024
+        dest = f"{args.dest_dir}/horus-deploy-benchmark"
+
+        with tempfile.NamedTemporaryFile() as src:
+            src.write(os.urandom(size))
+            src.flush()
+
+            sftp = client.open_sftp()
+            _measure("SFTPClient.put", size, lambda: sftp.put(src.name, dest))
+            for streams in [1, transfer.SFTP_STREAMS]:
+                _measure(
+                    f"sftp_put (streams={streams})",
+                    size,
+                    lambda: transfer.sftp_put(host, src.name, dest, streams=streams),
+                )
+
+        sftp.remove(dest)
+        client.close()
+    finally:
+        if server:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
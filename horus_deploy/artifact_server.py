@@ -0,0 +1,247 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Serve local artifacts to hosts over HTTP.
+
+Hosts download artifacts themselves, e.g. ``system.transfer`` and
+``mender install`` accept URLs, instead of each artifact being uploaded
+over SSH to each host separately.
+
+With a ``UrlCache`` the server is also a caching proxy: remote URLs in
+parameters are replaced by URLs of the server, which fetches each file
+once and serves it to all hosts.
+"""
+
+import email.utils
+import functools
+import hashlib
+import logging
+import os
+import re
+import socket
+import threading
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import ip_address
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from .url_cache import UrlCache, is_cacheable
+
+
+logger = logging.getLogger(__name__)
+
+
+_RE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+_CACHE_PREFIX = "_cache"
+
+
+class ArtifactServer:
+    """A threaded HTTP server that serves the files in a directory, and
+    the files of URLs in ``url_cache``.
+
+    Supports ``Range`` requests, and uses ``sendfile`` where the platform
+    supports it. Use it as a context manager to run it in the background.
+    """
+
+    def __init__(self, root=None, port: int = 0, url_cache: Optional[UrlCache] = None):
+        self.root = Path(root).resolve() if root else None
+        self.url_cache = url_cache
+        # Cache keys of the URLs that were replaced, see `rewrite_params`.
+        self._cached_urls: Dict[str, str] = {}
+        handler = functools.partial(
+            _RequestHandler, directory=str(self.root or ""), resolve=self._resolve
+        )
+        self._server = ThreadingHTTPServer(("", port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url_for(self, path, remote_addr: str) -> str:
+        """Return the URL of a file in the root directory for a host."""
+        if self.root is None:
+            raise ValueError("the artifact server has no root directory")
+        rel_path = Path(path).resolve().relative_to(self.root)
+        return self._base_url(remote_addr) + quote(rel_path.as_posix())
+
+    def cached_url_for(self, url: str, remote_addr: str) -> str:
+        """Return the URL of the cached file of a remote URL for a host.
+
+        The file name is kept, some tools look at it.
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        self._cached_urls[key] = url
+        name = Path(unquote(urlsplit(url).path)).name or "file"
+        return f"{self._base_url(remote_addr)}{_CACHE_PREFIX}/{key}/{quote(name)}"
+
+    def _base_url(self, remote_addr: str) -> str:
+        addr = local_address_for(remote_addr)
+        if ":" in addr:
+            addr = "[{}]".format(addr.replace("%", "%25"))
+        return f"http://{addr}:{self.port}/"
+
+    def rewrite_params(self, params: Dict[str, Any], remote_addr: str) -> Dict[str, Any]:
+        """Replace paths to files in the root directory, and remote URLs
+        when there's a URL cache, by URLs of the server.
+
+        Paths are relative to the current directory or to the root
+        directory. URLs of the local network aren't replaced.
+        """
+        new_params = dict(params)
+
+        for key, value in params.items():
+            if not isinstance(value, str) or not value:
+                continue
+            if self.url_cache and is_cacheable(value):
+                new_params[key] = self.cached_url_for(value, remote_addr)
+                continue
+            if not self.root:
+                continue
+            for path in [Path(value), self.root / value]:
+                if self._is_served(path):
+                    new_params[key] = self.url_for(path, remote_addr)
+                    break
+
+        return new_params
+
+    def _is_served(self, path: Path) -> bool:
+        path = path.resolve()
+        return path.is_file() and self.root in path.parents
+
+    def _resolve(self, url_path: str, translate_path: Callable[[str], str]) -> Optional[Path]:
+        parts = urlsplit(url_path).path.split("/")
+        if len(parts) > 2 and parts[1] == _CACHE_PREFIX:
+            url = self._cached_urls.get(parts[2])
+            return self.url_cache.get(url) if url and self.url_cache else None
+        if not self.root:
+            return None
+        return Path(translate_path(url_path))
+
+
+def local_address_for(remote_addr: str) -> str:
+    """Return the local address that is used to reach a remote address."""
+    family = socket.AF_INET
+    try:
+        if ip_address(remote_addr.split("%")[0]).version == 6:
+            family = socket.AF_INET6
+    except ValueError:
+        pass
+
+    # Connecting a UDP socket selects a route, but doesn't send anything.
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.connect((remote_addr, 9))
+        return sock.getsockname()[0]
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a ``Range`` header into the first and last byte positions.
+
+    Returns None when the whole file should be sent, i.e. without a
+    header or with an unsupported header such as multiple ranges. Raises
+    ``ValueError`` when the range can't be satisfied.
+    """
+    match = _RE_RANGE.fullmatch(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range, the last `last` bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError(f"range {header!r} not satisfiable for {size} bytes")
+    return first, last
+
+
+class _RequestHandler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, resolve, **kwargs):
+        self.resolve = resolve
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        try:
+            path = self.resolve(self.path, self.translate_path)
+        except OSError as e:
+            logger.warning(f"cannot fetch {self.path}: {e}")
+            self.send_error(HTTPStatus.BAD_GATEWAY)
+            return
+
+        if not path or not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        with open(path, "rb") as fd:
+            st = os.fstat(fd.fileno())
+            try:
+                byte_range = parse_range(self.headers.get("Range"), st.st_size)
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{st.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if byte_range is None:
+                self.send_response(HTTPStatus.OK)
+                first, last = 0, st.st_size - 1
+            else:
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                first, last = byte_range
+                self.send_header("Content-Range", f"bytes {first}-{last}/{st.st_size}")
+
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(last - first + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header(
+                "Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True)
+            )
+            self.end_headers()
+
+            if send_body and last >= first:
+                self.wfile.flush()
+                # Uses os.sendfile when available.
+                self.connection.sendfile(fd, first, last - first + 1)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
@@ -19,6 +19,7 @@
 # SOFTWARE.
 
 from pathlib import Path
+from urllib.parse import urlparse
 
 from horus_deploy.operations import package
 from pyinfra import host
@@ -28,13 +29,14 @@ METADATA = {
     "name": "Install package",
     "description": "Install package. Package name is extracted from RPM package.",
     "parameters": {
-        "file": "File name or path of RPM package.",
+        "file": "File name, path, or HTTP(S) URL of RPM package.",
     },
 }
 
 if not host.data.file:
     raise OperationError("file argument not given")
-if not Path(host.data.file).exists():
+if urlparse(host.data.file).scheme not in ["http", "https"] \
+        and not Path(host.data.file).exists():
     raise OperationError(f"file={host.data.file} does not exist")
 
-package.install([host.data.file])
+package.install([host.data.file], cache=True)
@@ -18,9 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from os.path import basename
+
 from pyinfra import host
 from pyinfra.api import OperationError
-from pyinfra.operations import server
+from pyinfra.operations import files, server
+
+from horus_deploy.operations import system
+from horus_deploy.staging import checksum_path, staged_file
 
 METADATA = {
     "name": "Mender",
@@ -30,21 +35,43 @@ METADATA = {
         "verifying the device functions correctly. A rollback is done by "
         "rebooting the device, which can be done with the reboot deploy script."
         "The path to the artifact can either be a local file path on the device "
-        "or a HTTP(S) URL."
+        "or a HTTP(S) URL. An artifact staged with the mender_stage deploy script "
+        "is installed from the device and removed afterwards, if its source and "
+        "SHA-256 digest match."
     ),
     "parameters": {
         "install": "File path or URL to mender artifact.",
+        "fanout": (
+            "Path in install is a local file. Upload it to at most this many "
+            "devices, which pass it on to the other devices."
+        ),
+        "sha256": "SHA-256 digest of the artifact, a staged artifact must match it.",
     },
 }
 
+_ARTIFACT_DIR = "/data/horus-deploy/mender"
+
 
 if not host.data.install:
     raise OperationError("install argument not given")
 
+staged = staged_file(host, host.data.install, host.data.sha256)
+artifact = staged or host.data.install
+if not staged and host.data.fanout:
+    artifact = f"{_ARTIFACT_DIR}/{basename(host.data.install)}"
+    files.directory(_ARTIFACT_DIR)
+    system.transfer(host.data.install, artifact, fanout=int(host.data.fanout))
+
 server.shell(
     [
-        f"mender install {host.data.install}",
+        f"mender install {artifact}",
     ]
 )
+system.invalidate_facts()
+
+if artifact != host.data.install:
+    files.file(artifact, present=False)
+if staged:
+    files.file(checksum_path(staged), present=False)
 
 server.reboot()
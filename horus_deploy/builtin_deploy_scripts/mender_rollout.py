@@ -0,0 +1,66 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from pyinfra import host
+from pyinfra.api import OperationError
+from pyinfra.operations import files
+
+from horus_deploy.operations import mender
+from horus_deploy.staging import checksum_path, staged_file
+
+METADATA = {
+    "name": "Mender rollout",
+    "description": (
+        "Install a Mender artifact, reboot, check the health of the device, and "
+        "commit the installation when the device is healthy. Otherwise the device "
+        "is rebooted to roll back, and fails. Use the --wave-size and "
+        "--max-fail-percent options of run to roll out to a fleet in waves. "
+        "An artifact staged with the mender_stage deploy script is installed "
+        "from the device and removed afterwards, if its source and SHA-256 digest "
+        "match."
+    ),
+    "parameters": {
+        "install": "File path on the device or URL to mender artifact.",
+        "health_command": "Shell command that succeeds when the device is healthy.",
+        "health_url": "URL the device can fetch when it's healthy.",
+        "health_timeout": "Maximum time in seconds for the health check to pass (300).",
+        "reboot_timeout": "Maximum time in seconds for the device to reboot (300).",
+        "sha256": "SHA-256 digest of the artifact, a staged artifact must match it.",
+    },
+}
+
+
+if not host.data.install:
+    raise OperationError("install argument not given")
+
+artifact = staged_file(host, host.data.install, host.data.sha256) or host.data.install
+
+mender.rollout(
+    artifact,
+    health_command=host.data.health_command and str(host.data.health_command),
+    health_url=host.data.health_url,
+    health_timeout=float(host.data.health_timeout or 300),
+    reboot_timeout=float(host.data.reboot_timeout or 300),
+)
+
+if artifact != host.data.install:
+    files.file(artifact, present=False)
+    files.file(checksum_path(artifact), present=False)
@@ -0,0 +1,51 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from pyinfra import host
+from pyinfra.api import OperationError
+
+from horus_deploy.operations import system
+
+METADATA = {
+    "name": "Mender stage",
+    "description": (
+        "Put a Mender artifact on the device ahead of an installation with the "
+        "mender deploy script, which then installs the staged artifact. URLs are "
+        "downloaded by the device in the background, and resumed when interrupted; "
+        "run this script again to check if the download is done. Local files are "
+        "uploaded."
+    ),
+    "parameters": {
+        "install": "Local file path or URL to mender artifact.",
+        "sha256": "SHA-256 digest of the artifact at the URL, checked after downloading.",
+        "bandwidth_limit": "Maximum bandwidth in bytes per second, e.g. 500K or 2M.",
+    },
+}
+
+
+if not host.data.install:
+    raise OperationError("install argument not given")
+
+system.stage(
+    host.data.install,
+    sha256=host.data.sha256,
+    rate_limit=host.data.bandwidth_limit,
+)
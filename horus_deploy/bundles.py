@@ -0,0 +1,200 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Bundles of deploy scripts in a single file.
+
+A bundle is a zip file with the ``.hdbundle`` suffix that contains deploy
+scripts in the same layout as a deploy script directory, i.e.
+``<id>.py`` and ``<id>/deploy.py``, and a ``MANIFEST.json`` with:
+
+- ``scripts``: the path in the bundle and the metadata of each script
+  by ID, so finding scripts reads nothing but the manifest;
+- ``files``: the SHA-256 digest of each source file;
+- ``magic``: the bytecode version of the precompiled ``.pyc`` files that
+  are stored next to the sources.
+
+Bundles are built with ``horus-deploy bundle build`` and are put in the
+user deploy script directory. pyinfra only runs deploy scripts from
+files, so a stub that calls ``exec_script`` is run instead.
+"""
+
+import hashlib
+import importlib.util
+import json
+import marshal
+import posixpath
+import sys
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metadata import extract_metadata
+
+
+SUFFIX = ".hdbundle"
+MANIFEST_NAME = "MANIFEST.json"
+VERSION = 1
+
+# Flags of a hash-based .pyc that is checked against its source (PEP 552).
+_CHECKED_HASH_PYC = 0b11
+
+
+def build_bundle(dest: Path, scripts: Dict[str, Path]) -> List[str]:
+    """Write the deploy scripts, by ID, to a bundle.
+
+    For a ``deploy.py`` script, all files in its directory are included.
+    Scripts without metadata are left out, like ``find_deploy_scripts``
+    does. Returns the IDs of the scripts in the bundle. Raises
+    ``ValueError`` when the metadata of a script can't be extracted.
+    """
+    manifest: Dict[str, Any] = {
+        "version": VERSION,
+        "magic": importlib.util.MAGIC_NUMBER.hex(),
+        "scripts": {},
+        "files": {},
+    }
+
+    with zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED) as zf:
+        for script_id, path in sorted(scripts.items()):
+            try:
+                metadata = extract_metadata(path.read_text())
+            except Exception as e:
+                raise ValueError(f"cannot extract metadata from {path}: {e}") from e
+            if not metadata:
+                continue
+
+            if path.name == "deploy.py":
+                member = f"{script_id}/deploy.py"
+                files = {
+                    f"{script_id}/{p.relative_to(path.parent).as_posix()}": p
+                    for p in sorted(path.parent.rglob("*"))
+                    if p.is_file() and "__pycache__" not in p.parts and p.suffix != ".pyc"
+                }
+            else:
+                member = f"{script_id}.py"
+                files = {member: path}
+
+            manifest["scripts"][script_id] = {"path": member, "metadata": metadata}
+
+            for name, file_path in files.items():
+                data = file_path.read_bytes()
+                zf.writestr(name, data)
+                manifest["files"][name] = hashlib.sha256(data).hexdigest()
+                if name.endswith(".py"):
+                    zf.writestr(name + "c", _compile(data, f"{dest.name}/{name}"))
+
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+
+    return list(manifest["scripts"])
+
+
+def read_manifest(bundle) -> Dict[str, Any]:
+    """Read the manifest of a bundle.
+
+    Raises ``ValueError`` when the file isn't a bundle.
+    """
+    try:
+        with zipfile.ZipFile(bundle) as zf:
+            return _read_manifest(zf)
+    except (OSError, zipfile.BadZipFile) as e:
+        raise ValueError(f"{bundle} is not a bundle: {e}") from e
+
+
+def split_path(path: Path) -> Optional[Tuple[Path, str]]:
+    """Split the path of a script in a bundle, e.g.
+    ``scripts.hdbundle/b/deploy.py``, in the bundle and the path in it.
+
+    Returns None for other paths.
+    """
+    for parent in path.parents:
+        if parent.suffix == SUFFIX:
+            return parent, path.relative_to(parent).as_posix()
+    return None
+
+
+def write_stub(fd, path: Path):
+    """Write a deploy script that runs a script in a bundle.
+
+    Raises ``ValueError`` when the path isn't in a bundle.
+    """
+    parts = split_path(path)
+    if parts is None:
+        raise ValueError(f"{path} is not in a bundle")
+    bundle, member = parts
+    fd.write("from horus_deploy.bundles import exec_script\n")
+    fd.write(f"exec_script({str(bundle)!r}, {member!r}, globals())\n")
+    fd.flush()
+
+
+def exec_script(bundle: str, member: str, namespace: Dict[str, Any]):
+    """Run a deploy script in a bundle in ``namespace``.
+
+    The precompiled bytecode is used when it matches the source and the
+    Python version. Modules next to a ``deploy.py`` script can be
+    imported.
+    """
+    with zipfile.ZipFile(bundle) as zf:
+        manifest = _read_manifest(zf)
+        source = zf.read(member)
+        if hashlib.sha256(source).hexdigest() != manifest["files"].get(member):
+            raise ValueError(f"{member} in {bundle} doesn't match the manifest")
+        code = _load_code(zf, bundle, member, source)
+
+    if directory := posixpath.dirname(member):
+        # zipimport imports from directories in zip files.
+        sys.path.insert(0, f"{bundle}/{directory}")
+
+    namespace["__file__"] = f"{bundle}/{member}"
+    exec(code, namespace)
+
+
+def _read_manifest(zf: zipfile.ZipFile) -> Dict[str, Any]:
+    try:
+        manifest = json.loads(zf.read(MANIFEST_NAME))
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"{zf.filename} has no valid {MANIFEST_NAME}: {e}") from e
+    if manifest.get("version") != VERSION:
+        raise ValueError(f"{zf.filename} has unsupported version {manifest.get('version')}")
+    return manifest
+
+
+def _compile(source: bytes, filename: str) -> bytes:
+    code = compile(source, filename, "exec", dont_inherit=True)
+    return (
+        importlib.util.MAGIC_NUMBER
+        + _CHECKED_HASH_PYC.to_bytes(4, "little")
+        + importlib.util.source_hash(source)
+        + marshal.dumps(code)
+    )
+
+
+def _load_code(zf: zipfile.ZipFile, bundle: str, member: str, source: bytes):
+    header = (
+        importlib.util.MAGIC_NUMBER
+        + _CHECKED_HASH_PYC.to_bytes(4, "little")
+        + importlib.util.source_hash(source)
+    )
+    try:
+        data = zf.read(member + "c")
+        if data[:16] == header:
+            return marshal.loads(data[16:])
+    except (KeyError, ValueError, EOFError):
+        pass
+    return compile(source, f"{Path(bundle).name}/{member}", "exec", dont_inherit=True)
@@ -21,31 +21,46 @@
 import dataclasses
 import fnmatch
 import logging
+import os
 import re
 import subprocess
 import sys
+import time
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import click
 from tabulate import tabulate
 
 from . import __version__
 from ._config import load_user_settings
-from .deploys import find_deploy_scripts
+from .artifact_server import ArtifactServer
+from .bundles import (
+    build_bundle,
+    split_path as split_bundle_path,
+    SUFFIX as BUNDLE_SUFFIX,
+    write_stub,
+)
+from .deploys import find_deploy_scripts, list_scripts, script_id
+from .failed_hosts import read_report, REPORT_ENV
 from .host import (
     _DEFAULT_WAIT as DEFAULT_DISCOVERY_TIMEOUT,
     AddressType,
     find_hosts_on_local_network,
     Host,
+    matches,
     resolve as resolve_host,
+    watch_hosts,
 )
+from .inventory import load_inventory, save_inventory
 from .ssh import figure_out_ssh_parameters, interactive_ssh_shell
+from .url_cache import DEFAULT_MAX_SIZE, UrlCache
 from .utils import (
     AttrDict,
     IdentifierOrKeyValue,
     multi_choice_prompt,
+    profiled,
     single_choice_prompt,
     temp_python_files,
     json_dumps,
@@ -69,6 +84,14 @@ def click_hosts_option(f):
     )(f)
 
 
+def click_inventory_option(f):
+    return click.option(
+        "--inventory", "-i", "inventory_path",
+        type=click.Path(exists=True, dir_okay=False, path_type=Path),
+        help="Use hosts from an inventory file instead of discovering them.",
+    )(f)
+
+
 @click.group()
 @click.pass_context
 @click.option(
@@ -87,6 +110,14 @@ def click_hosts_option(f):
 @click.option("--ssh-key-password", type=str)
 @click.option("--verbose", default=False, is_flag=True)
 @click.option("--pyinfra-verbose", default=False, is_flag=True)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help=(
+        "Profile the command with cProfile and write the statistics to a file. "
+        "pyinfra processes started by run are profiled to separate files."
+    ),
+)
 def main(
     ctx,
     discovery_timeout,
@@ -97,8 +128,13 @@ def main(
     ssh_key_password,
     verbose,
     pyinfra_verbose,
+    profile,
 ):
     ctx.ensure_object(AttrDict)
+    ctx.obj.profile = profile
+    if profile:
+        ctx.with_resource(profiled(profile))
+
     ctx.obj.settings = load_user_settings()
     ctx.obj.discovery_timeout = discovery_timeout
 
@@ -125,19 +161,90 @@ def main(
 @main.command(help="Run one or more deploy scripts.")
 @click.pass_obj
 @click_hosts_option
+@click_inventory_option
 @click.option("-y", "--dont-ask", default=False, is_flag=True)
 @click.option("-x", "--enable-regex", default=False, is_flag=True)
 @click.option("--dry-run", default=False, is_flag=True)
+@click.option(
+    "--fact-cache-ttl",
+    type=float,
+    metavar="<seconds>",
+    help=(
+        "Cache facts of discovered devices across runs, for at most the "
+        "given number of seconds."
+    ),
+)
+@click.option(
+    "--serve-artifacts",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    metavar="<dir>",
+    help=(
+        "Serve the files in a directory over HTTP, and replace paths to "
+        "these files in parameters by URLs, so devices download them."
+    ),
+)
+@click.option(
+    "--cache-urls",
+    default=False,
+    is_flag=True,
+    help=(
+        "Download files of remote URLs in parameters once, cache them, and "
+        "serve them to the devices over HTTP."
+    ),
+)
+@click.option(
+    "--url-cache-size",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_MAX_SIZE / 1024**3,
+    show_default=True,
+    metavar="<GiB>",
+    help="Remove the least recently used files when the URL cache is larger.",
+)
+@click.option(
+    "--wave-size",
+    type=click.IntRange(min=1),
+    metavar="<n>",
+    help="Run the deploy scripts on at most <n> devices at a time, in waves.",
+)
+@click.option(
+    "--max-fail-percent",
+    type=click.FloatRange(0, 100),
+    default=0,
+    show_default=True,
+    metavar="<percent>",
+    help=(
+        "Don't start the next wave when more than this percentage of the "
+        "devices so far failed. Above 0, the other devices in a wave carry "
+        "on when a device fails."
+    ),
+)
 @click.argument("parameters", type=IdentifierOrKeyValue(), nargs=-1)
-def run(obj, hosts, dont_ask, enable_regex, dry_run, parameters):
+def run(
+    obj,
+    hosts,
+    inventory_path,
+    dont_ask,
+    enable_regex,
+    dry_run,
+    fact_cache_ttl,
+    serve_artifacts,
+    cache_urls,
+    url_cache_size,
+    wave_size,
+    max_fail_percent,
+    parameters,
+):
     # Collect scripts and parameters.
     deploy_scripts, deploy_script_params = get_scripts_and_params(parameters)
 
-    hosts, is_discovered = get_hosts(hosts, obj.discovery_timeout, enable_regex)
-    if not dont_ask and is_discovered:
-        hosts = select_hosts(hosts)
+    if inventory_path:
+        hosts = get_inventory_hosts(inventory_path, hosts, enable_regex, obj.ssh_parameter_set)
+    else:
+        hosts, is_discovered = get_hosts(hosts, obj.discovery_timeout, enable_regex)
+        if not dont_ask and is_discovered:
+            hosts = select_hosts(hosts)
 
-    hosts = get_ssh_params_for_hosts(hosts, obj.ssh_parameter_set)
+        hosts = get_ssh_params_for_hosts(hosts, obj.ssh_parameter_set)
 
     # Find deploy scripts.
     deploy_scripts, missing_deploy_scripts = _find_deploy_scripts(deploy_scripts)
@@ -147,21 +254,116 @@ def run(obj, hosts, dont_ask, enable_regex, dry_run, parameters):
             click.echo(f"    {s}")
         return
 
+    artifact_server = None
+    if serve_artifacts or cache_urls:
+        artifact_server = start_artifact_server(serve_artifacts, cache_urls, url_cache_size)
+
+    waves = [hosts]
+    if wave_size:
+        waves = [hosts[i:i + wave_size] for i in range(0, len(hosts), wave_size)]
+
+    options = AttrDict(
+        dry_run=dry_run,
+        fact_cache_ttl=fact_cache_ttl,
+        artifact_server=artifact_server,
+        fail_percent=100 if max_fail_percent else 0,
+        report_failed_hosts=len(waves) > 1,
+    )
+    failed: List[str] = []
+    done = 0
+
+    for number, wave in enumerate(waves, 1):
+        if len(waves) > 1:
+            click.echo(f"--> Wave {number} of {len(waves)}: {len(wave)} devices")
+
+        failed += run_deploy_scripts(obj, wave, deploy_scripts, deploy_script_params, options)
+        done += len(wave)
+
+        if number < len(waves) and len(failed) * 100 / done > max_fail_percent:
+            fatal(
+                f"{len(failed)} of {done} devices failed, not starting the "
+                f"remaining {len(waves) - number} waves: {', '.join(failed)}"
+            )
+
+
+def start_artifact_server(root, cache_urls, url_cache_size) -> ArtifactServer:
+    """Serve artifacts until the current command finishes."""
+    url_cache = UrlCache(max_size=int(url_cache_size * 1024**3)) if cache_urls else None
+    artifact_server = click.get_current_context().with_resource(
+        ArtifactServer(root, url_cache=url_cache)
+    )
+    if root:
+        click.echo(f"--> Serving {root} on port {artifact_server.port}")
+    if cache_urls:
+        click.echo(f"--> Caching URLs on port {artifact_server.port}")
+    return artifact_server
+
+
+def run_deploy_scripts(obj, hosts, deploy_scripts, deploy_script_params, options) -> List[str]:
+    """Run deploy scripts on hosts with pyinfra.
+
+    Returns the names of the hosts that failed, when
+    ``options.report_failed_hosts`` is set.
+    """
+    failed = set()
+
     # Create inventory and run deploys.
     for script in deploy_scripts:
         data = deploy_script_params.get(script["id"], {})
+        setup_files = []
+
+        if options.fact_cache_ttl:
+            data = {**data, "fact_cache_ttl": options.fact_cache_ttl}
+            setup_files.append("fact_cache.py")
+        if options.report_failed_hosts:
+            setup_files.append("failed_hosts.py")
+
+        # Scripts in bundles are run by a stub, see horus_deploy.bundles.
+        script_path = script["path"]
+        stubs = [f"bundled/{script['id']}.py"] if split_bundle_path(script_path) else []
+        with temp_python_files("inventory.py", *setup_files, *stubs) as (fd, *setup_fds):
+            write_inventory(fd, hosts, data, options.artifact_server)
+            if stubs:
+                stub_fd = setup_fds.pop()
+                write_stub(stub_fd, script_path)
+                script_path = stub_fd.name
+            for setup_fd in setup_fds:
+                write_setup_script(setup_fd)
+
+            cmd = pyinfra_command(obj, script, options.dry_run, options.fail_percent)
+            cmd += [fd.name, *(f.name for f in setup_fds), script_path]
+
+            report = Path(fd.name).with_name("failed_hosts.json")
+            env = {**os.environ, REPORT_ENV: str(report)}
+            returncode = subprocess.call(cmd, env=env)
+
+            if options.report_failed_hosts:
+                names = read_report(report)
+                if names is None and returncode != 0:
+                    names = [h.addr.s for h in hosts]
+                failed.update(names or [])
+
+    return sorted(failed)
+
+
+def pyinfra_command(obj, script, dry_run: bool, fail_percent: int = 0) -> List[str]:
+    cmd = ["pyinfra"]
+    if obj.profile:
+        cmd = [
+            sys.executable, "-m", "cProfile",
+            "-o", str(pyinfra_profile_path(obj.profile, script["id"])),
+            "-m", "pyinfra",
+        ]
+    cmd += ["--fail-percent", str(fail_percent)]
+    if obj.pyinfra_verbose:
+        cmd.append("-vvv")
+    if dry_run:
+        cmd.append("--dry")
+    return cmd
 
-        with temp_python_files("inventory.py") as (fd,):
-            write_inventory(fd, hosts, data)
-
-            cmd = ["pyinfra", "--fail-percent", "0"]
-            if obj.pyinfra_verbose:
-                cmd.append("-vvv")
-            if dry_run:
-                cmd.append("--dry")
-            cmd += [fd.name, script["path"]]
 
-            subprocess.call(cmd)
+def pyinfra_profile_path(path: Path, script_id: str) -> Path:
+    return path.with_name(f"{path.stem}-pyinfra-{script_id}{path.suffix}")
 
 
 def get_scripts_and_params(parameters):
@@ -206,6 +408,65 @@ def discover(obj, hosts, enable_regex, output_json):
         list_hosts(hosts)
 
 
+@main.group(help="Build inventory files.")
+def inventory():
+    pass
+
+
+@inventory.command(
+    name="build",
+    help=(
+        "Discover and resolve hosts, figure out their SSH parameters, and "
+        "write them to an inventory file."
+    ),
+)
+@click.pass_obj
+@click_hosts_option
+@click.option("-y", "--dont-ask", default=False, is_flag=True)
+@click.option("-x", "--enable-regex", default=False, is_flag=True)
+@click.argument("output", type=click.Path(dir_okay=False, path_type=Path))
+def build_inventory(obj, hosts, dont_ask, enable_regex, output):
+    hosts, is_discovered = get_hosts(hosts, obj.discovery_timeout, enable_regex)
+    if not dont_ask and is_discovered:
+        hosts = select_hosts(hosts)
+
+    hosts = get_ssh_params_for_hosts(hosts, obj.ssh_parameter_set)
+    save_inventory(output, hosts)
+    click.echo(f"--> Wrote {len(hosts)} host(s) to {output}")
+
+
+@main.group(help="Build deploy script bundles.")
+def bundle():
+    pass
+
+
+@bundle.command(
+    name="build",
+    help=(
+        "Write the deploy scripts in a directory to a bundle, a single file "
+        "that can be put in the user deploy script directory."
+    ),
+)
+@click.argument("output", type=click.Path(dir_okay=False, path_type=Path))
+@click.argument("directory", type=click.Path(exists=True, file_okay=False, path_type=Path))
+def build_script_bundle(output, directory):
+    if output.suffix != BUNDLE_SUFFIX:
+        fatal(f"bundle {output} must have the {BUNDLE_SUFFIX} suffix")
+
+    script_paths, _ = list_scripts(directory)
+    scripts_by_id = {}
+    for path in filter(Path.exists, script_paths):
+        if other := scripts_by_id.get(script_id(path)):
+            fatal(f"deploy scripts {other} and {path} have the same ID")
+        scripts_by_id[script_id(path)] = path
+    try:
+        script_ids = build_bundle(output, scripts_by_id)
+    except ValueError as e:
+        output.unlink(missing_ok=True)
+        fatal(str(e))
+    click.echo(f"--> Wrote {len(script_ids)} deploy script(s) to {output}")
+
+
 @main.command(help="List all builtin and user deploy scripts.")
 @click.argument("deploy_scripts", type=click.Path(path_type=Path), nargs=-1)
 @click.option(
@@ -250,14 +511,19 @@ def info(deploy_scripts, details):
 @main.command(help="Interactive SSH shell.")
 @click.pass_obj
 @click_hosts_option
+@click_inventory_option
 @click.option("-x", "--enable-regex", default=False, is_flag=True)
-def shell(obj, hosts, enable_regex):
-    hosts, is_discovered = get_hosts(hosts, obj.discovery_timeout, enable_regex)
-    if is_discovered or len(hosts) > 1:
-        host = select_host(hosts)
+def shell(obj, hosts, inventory_path, enable_regex):
+    if inventory_path:
+        hosts = get_inventory_hosts(inventory_path, hosts, enable_regex, obj.ssh_parameter_set)
+        host = select_host(hosts) if len(hosts) > 1 else hosts[0]
     else:
-        host = hosts[0]
-    host = get_ssh_params_for_host(host, obj.ssh_parameter_set)
+        hosts, is_discovered = get_hosts(hosts, obj.discovery_timeout, enable_regex)
+        if is_discovered or len(hosts) > 1:
+            host = select_host(hosts)
+        else:
+            host = hosts[0]
+        host = get_ssh_params_for_host(host, obj.ssh_parameter_set)
     interactive_ssh_shell(host.ssh_host, host.ssh_params)
 
 
@@ -289,6 +555,37 @@ def resolve(host: Host, output_json: bool):
             raise ValueError(f"unexpected data: {data!r}")
 
 
+@main.command(help="Print hosts when they announce themselves over zeroconf.")
+@click.argument("names", nargs=-1)
+@click.option("-j", "--output-json", default=False, is_flag=True)
+def watch(names, output_json: bool):
+    """Watch for announcements of hosts with the given zeroconf server
+    names or hardware IDs, or of all hosts, until interrupted.
+
+    ``horus_deploy.reconnect`` uses this to find out when a rebooting
+    host is back.
+    """
+    def on_change(host):
+        if names and not any(matches(host, name) for name in names):
+            return
+        addrs = [a.s for a in host.resolved_addrs]
+        if output_json:
+            data = {"name": host.addr.s, "hardware_id": host.props.get("hardware_id")}
+            click.echo(json_dumps({**data, "addrs": addrs}))
+        else:
+            click.echo(f"{host.addr.s} {' '.join(addrs)}")
+        sys.stdout.flush()
+
+    zc = watch_hosts(on_change)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        zc.close()
+
+
 def list_hosts(hosts, showindex=False):
     """List hosts in a table."""
     headers = ["Server", "IPv4", "IPv6", "Hardware ID"]
@@ -314,24 +611,41 @@ def list_hosts(hosts, showindex=False):
     click.echo(tabulate(rows, headers=headers, **kwargs))
 
 
-def write_inventory(fd, hosts, host_data):
+def write_inventory(fd, hosts, host_data, artifact_server=None):
     fd.write("hosts = [\n")
     for host in hosts:
+        data = host_data
+        if artifact_server:
+            data = artifact_server.rewrite_params(data, host.ssh_host)
         data = {
             **host.ssh_params,
-            **host_data,
+            **data,
         }
         # If we're using a zeroconf server name to reference a host,
         # we'll pass it to pyinfra so we can use it in deploy scripts.
         # See horus_deploy.operations.system.reboot for an example.
         if host.addr.t == AddressType.ZEROCONF_SERVER_NAME:
             data["zeroconf_server_name"] = host.addr.s
+        if hardware_id := host.props.get("hardware_id"):
+            data["hardware_id"] = hardware_id
         data = {k: str(v) for k, v in data.items()}
         fd.write(f"    ({str(host.ssh_host)!r}, {data!r}),\n")
     fd.write("]\n")
     fd.flush()
 
 
+def write_setup_script(fd):
+    """Write a deploy script that prepares the pyinfra process.
+
+    It runs before the actual deploy script. The file name selects what is
+    set up, e.g. ``fact_cache.py`` enables the fact cache.
+    """
+    module = Path(fd.name).stem
+    fd.write(f"from horus_deploy.{module} import install\n")
+    fd.write("install()\n")
+    fd.flush()
+
+
 def get_ssh_params_for_hosts(hosts: List[Host], ssh_parameter_set: Dict[str, str]):
     return [get_ssh_params_for_host(h, ssh_parameter_set) for h in hosts]
 
@@ -389,6 +703,53 @@ def get_hosts(
     discovery_timeout: float = DEFAULT_DISCOVERY_TIMEOUT,
     enable_regex: bool = False,
 ) -> Tuple[List[Host], bool]:
+    filters = get_host_filters(hosts, enable_regex)
+    if hosts and not filters:
+        return (hosts, False)
+
+    hosts = filter_hosts(find_hosts_on_local_network(discovery_timeout), filters)
+
+    if not hosts:
+        fatal("no hosts found")
+
+    return (hosts, True)
+
+
+def get_inventory_hosts(
+    path: Path,
+    hosts: List[Host],
+    enable_regex: bool = False,
+    ssh_parameter_set: Optional[Dict[str, str]] = None,
+) -> List[Host]:
+    """Load hosts from an inventory file.
+
+    The ``-h`` options act as filters on the inventory. Plain addresses
+    must match exactly. The ``--ssh-*`` options override the SSH
+    parameters in the inventory.
+    """
+    try:
+        inventory_hosts = load_inventory(path)
+    except (ValueError, KeyError) as e:
+        fatal(f"cannot load inventory {path}: {e}")
+
+    filters = get_host_filters(hosts, enable_regex) or [
+        re.compile(fnmatch.translate(h.addr.s)) for h in hosts
+    ]
+    hosts = filter_hosts(inventory_hosts, filters)
+
+    if not hosts:
+        fatal("no hosts found")
+
+    if ssh_parameter_set:
+        hosts = [
+            dataclasses.replace(h, ssh_params={**h.ssh_params, **ssh_parameter_set})
+            for h in hosts
+        ]
+
+    return hosts
+
+
+def get_host_filters(hosts: List[Host], enable_regex: bool = False) -> List[re.Pattern]:
     filters = []
 
     if enable_regex:
@@ -398,26 +759,23 @@ def get_hosts(
             fatal(f"regular expression {e.pattern!r} is incorrect: {e}")
     elif is_host_glob_filter(hosts):
         filters = [re.compile(fnmatch.translate(h.addr.s)) for h in hosts]
-    elif hosts:
-        return (hosts, False)
 
-    hosts = find_hosts_on_local_network(discovery_timeout)
+    return filters
 
-    if filters:
-        hosts = [
-            h
-            for h in hosts
-            if any(
-                f.match(h.addr.s)
-                or any(f.match(ra.s) for ra in h.resolved_addrs)
-                for f in filters
-            )
-        ]
 
-    if not hosts:
-        fatal("no hosts found")
+def filter_hosts(hosts: List[Host], filters: List[re.Pattern]) -> List[Host]:
+    if not filters:
+        return hosts
 
-    return (hosts, True)
+    return [
+        h
+        for h in hosts
+        if any(
+            f.match(h.addr.s)
+            or any(f.match(ra.s) for ra in h.resolved_addrs)
+            for f in filters
+        )
+    ]
 
 
 def is_host_glob_filter(hosts: List[Host]) -> bool:
@@ -0,0 +1,379 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""rsync-style delta encoding.
+
+The host sends a signature of its old version of a file: a weak, rolling
+checksum and an MD5 digest per block. Locally, the new version is
+scanned for blocks with the same checksums, which yields a list of
+instructions to rebuild the new version on the host from blocks of the
+old version and literal data.
+
+Instructions are either ``("copy", index, count)``, copy ``count``
+blocks starting at block ``index`` of the old version, or
+``("literal", offset, length)``, copy ``length`` bytes starting at
+``offset`` of the new version. The literal data is sent along with the
+instructions.
+"""
+
+import hashlib
+import itertools
+import math
+import operator
+import shlex
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pyinfra.api import QuoteString, StringCommand
+
+
+MIN_BLOCK_SIZE = 16 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# Give up when more than this part of the file is literal data. Sending
+# the whole file is as fast then, and scanning for matches is slow.
+MAX_LITERAL_RATIO = 0.5
+
+_MASK = 0xFFFF
+
+# After a block that doesn't match, the rolling scan checks two blocks'
+# worth of offsets every this many blocks.
+_SCAN_STRIDE = 16
+# The rolling scan computes the checksums of at most this many offsets at
+# once.
+_SCAN_WINDOW = 256 * 1024
+
+# Runs on the host when it has Python 3. Must match weak_checksum.
+_SIGNATURE_SCRIPT = r"""
+import hashlib, itertools, os, sys
+path, block_size = sys.argv[1], int(sys.argv[2])
+print(os.path.getsize(path))
+with open(path, "rb") as fd:
+    while True:
+        block = fd.read(block_size)
+        if not block:
+            break
+        a = sum(block) & 0xFFFF
+        b = sum(itertools.accumulate(block)) & 0xFFFF
+        print((b << 16) | a, hashlib.md5(block).hexdigest())
+"""
+
+Op = Tuple[str, int, int]
+# (weak checksum, MD5 digest) of a block. The weak checksum is None when
+# the host could only compute digests.
+Block = Tuple[Optional[int], str]
+
+
+@dataclass
+class Signature:
+    block_size: int
+    size: int
+    blocks: List[Block]
+
+
+def block_size_for(size: int) -> int:
+    """Pick a block size for a file of ``size`` bytes."""
+    block_size = int(math.sqrt(size)) // 1024 * 1024
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+def weak_checksum(block) -> int:
+    """Return the rsync weak checksum of a block."""
+    a = sum(block) & _MASK
+    b = sum(itertools.accumulate(block)) & _MASK
+    return (b << 16) | a
+
+
+def signature_command(path: str, block_size: int) -> StringCommand:
+    """Print the size and block checksums of a file on the host.
+
+    Prints nothing when the file doesn't exist. Without Python 3 on the
+    host, only the MD5 digest of each block is printed.
+    """
+    return StringCommand(
+        "[ ! -f", QuoteString(path), "] ||",
+        "if command -v python3 >/dev/null 2>&1; then",
+        "python3 -c", QuoteString(_SIGNATURE_SCRIPT), QuoteString(path), str(block_size),
+        "; else",
+        "size=$(stat -c %s", QuoteString(path), ") && echo $size && i=0 &&",
+        f"while [ $((i * {block_size})) -lt $size ]; do",
+        "dd", QuoteString(f"if={path}"),
+        f"bs={block_size} skip=$i count=1 2>/dev/null | md5sum | cut -d ' ' -f 1;",
+        "i=$((i + 1)); done; fi",
+    )
+
+
+def parse_signature(lines: Iterable[str], block_size: int) -> Optional[Signature]:
+    """Parse the output of ``signature_command``."""
+    rows = [line.split() for line in lines if line.strip()]
+    if not rows:
+        return None
+
+    blocks: List[Block] = []
+    for fields in rows[1:]:
+        if len(fields) == 2:
+            blocks.append((int(fields[0]), fields[1]))
+        else:
+            blocks.append((None, fields[0]))
+
+    return Signature(block_size, int(rows[0][0]), blocks)
+
+
+def compute_delta(
+    data, signature: Signature, max_literal_ratio: float = MAX_LITERAL_RATIO
+) -> Optional[List[Op]]:
+    """Compute the instructions to rebuild ``data`` from the old version.
+
+    Returns None when more than ``max_literal_ratio`` of ``data`` would
+    be sent as literal data.
+    """
+    ops: List[Op] = []
+    max_literal = int(len(data) * max_literal_ratio)
+
+    if signature.blocks and signature.blocks[0][0] is None:
+        matches = _match_aligned(data, signature)
+    else:
+        matches = _match_rolling(data, signature, max_literal)
+
+    pos = 0
+    literal = 0
+    for offset, index in matches:
+        if offset is None:
+            return None
+        if offset > pos:
+            ops.append(("literal", pos, offset - pos))
+            literal += offset - pos
+        if ops and ops[-1][0] == "copy" and sum(ops[-1][1:]) == index:
+            ops[-1] = ("copy", ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append(("copy", index, 1))
+        pos = offset + _block_length(signature, index)
+
+    if pos < len(data):
+        ops.append(("literal", pos, len(data) - pos))
+        literal += len(data) - pos
+
+    return ops if literal <= max_literal else None
+
+
+def _block_length(signature: Signature, index: int) -> int:
+    if index == len(signature.blocks) - 1:
+        return signature.size - index * signature.block_size
+    return signature.block_size
+
+
+def _match_aligned(data, signature: Signature):
+    # Without weak checksums, only blocks at multiples of the block size
+    # are compared.
+    digests = {digest: i for i, (_, digest) in enumerate(signature.blocks)}
+    block_size = signature.block_size
+
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        index = digests.get(hashlib.md5(block).hexdigest())
+        if index is not None and _block_length(signature, index) == len(block):
+            yield offset, index
+
+
+def _match_rolling(data, signature: Signature, max_literal: int):
+    """Yield (offset, block index) of matching blocks.
+
+    The block at the current offset is compared first, so runs of blocks
+    that didn't move are matched a block at a time. Only after a block
+    that doesn't match, the next offsets are scanned with the rolling
+    checksum for blocks that moved. Yields (None, None) once more than
+    ``max_literal`` bytes didn't match.
+    """
+    block_size = signature.block_size
+    full_blocks = _index_full_blocks(signature)
+    digests = {
+        digest: index
+        for candidates in full_blocks.values()
+        for digest, index in candidates.items()
+    }
+    size = len(data)
+    offset = 0
+    literal = 0
+
+    while offset + block_size <= size:
+        index = digests.get(hashlib.md5(data[offset:offset + block_size]).hexdigest())
+        if index is None:
+            end = min(size - block_size + 1, offset + max_literal - literal + 1)
+            found, index = _scan(data, offset + 1, end, full_blocks, digests, block_size)
+            if index is not None:
+                found, index = _extend_back(data, signature, offset, found, index)
+            literal += found - offset
+            if literal > max_literal:
+                yield None, None
+                return
+            offset = found
+            if index is None:
+                break
+        yield offset, index
+        offset += block_size
+
+    # The last block of the old version is usually shorter.
+    last = len(signature.blocks) - 1
+    if last >= 0 and size - offset == _block_length(signature, last):
+        if hashlib.md5(data[offset:]).hexdigest() == signature.blocks[last][1]:
+            yield offset, last
+
+
+def _scan(
+    data, start: int, end: int, full_blocks, digests, block_size: int
+) -> Tuple[int, Optional[int]]:
+    """Find a full block of the old version at an offset in [start, end).
+
+    The block after the one at ``start - 1`` is compared first, which
+    finds the next block after a change in place. Otherwise, windows of
+    two blocks' worth of offsets, ``_SCAN_STRIDE`` blocks apart, are
+    checked with the rolling checksum. The first window finds blocks
+    moved by an insertion or deletion shorter than a block. A run of
+    moved blocks that covers a window has a block starting in it, so
+    longer runs are found too, and their start with ``_extend_back``.
+
+    Returns the offset and index of the block, or ``end`` and None.
+    """
+    aligned = start - 1 + block_size
+    if aligned < end:
+        index = digests.get(hashlib.md5(data[aligned:aligned + block_size]).hexdigest())
+        if index is not None:
+            return aligned, index
+
+    for window in range(start, end, _SCAN_STRIDE * block_size):
+        window_end = min(window + 2 * block_size, end)
+        for chunk in range(window, window_end, _SCAN_WINDOW):
+            count = min(_SCAN_WINDOW, window_end - chunk)
+            checksums = _weak_checksums(data, chunk, count, block_size)
+            hits = map(full_blocks.__contains__, checksums)
+            for i in itertools.compress(range(count), hits):
+                offset = chunk + i
+                digest = hashlib.md5(data[offset:offset + block_size]).hexdigest()
+                index = full_blocks[checksums[i]].get(digest)
+                if index is not None:
+                    return offset, index
+    return end, None
+
+
+def _extend_back(data, signature: Signature, start: int, offset: int, index: int):
+    """Return the first block of the run of blocks ending with ``index`` at ``offset``.
+
+    The run doesn't extend before ``start``.
+    """
+    block_size = signature.block_size
+    while index > 0 and offset - block_size >= start:
+        block = data[offset - block_size:offset]
+        if hashlib.md5(block).hexdigest() != signature.blocks[index - 1][1]:
+            break
+        offset -= block_size
+        index -= 1
+    return offset, index
+
+
+def _weak_checksums(data, start: int, count: int, block_size: int) -> List[int]:
+    """Return the weak checksums of the blocks at ``count`` offsets from ``start``.
+
+    Same as ``weak_checksum`` for each block, but computed from prefix
+    sums of the bytes, which keeps the loops over the bytes in C.
+    """
+    first = data[start:start + block_size]
+    repeat = itertools.repeat
+    # Prefix sums from start, up to the starts and the ends of the blocks.
+    starts = list(itertools.accumulate(data[start:start + count - 1], initial=0))
+    ends = list(itertools.accumulate(
+        data[start + block_size:start + block_size + count - 1], initial=sum(first)
+    ))
+    # And sums of those.
+    starts2 = itertools.accumulate(starts)
+    ends2 = itertools.accumulate(
+        itertools.islice(ends, 1, None), initial=sum(itertools.accumulate(first))
+    )
+
+    a = map(operator.sub, ends, starts)
+    b = map(
+        operator.sub,
+        map(operator.sub, ends2, starts2),
+        map(operator.mul, starts, repeat(block_size)),
+    )
+    return list(map(
+        operator.or_,
+        map(operator.lshift, map(operator.and_, b, repeat(_MASK)), repeat(16)),
+        map(operator.and_, a, repeat(_MASK)),
+    ))
+
+
+def _index_full_blocks(signature: Signature) -> Dict[int, Dict[str, int]]:
+    # weak checksum -> MD5 digest -> block index
+    full_blocks: Dict[int, Dict[str, int]] = {}
+    for i, (weak, digest) in enumerate(signature.blocks):
+        if weak is not None and _block_length(signature, i) == signature.block_size:
+            full_blocks.setdefault(weak, {}).setdefault(digest, i)
+    return full_blocks
+
+
+def literal_chunks(data, ops: List[Op]):
+    """Yield the literal data of the instructions."""
+    for op, offset, length in ops:
+        if op == "literal":
+            yield data[offset:offset + length]
+
+
+def apply_script(
+    basis: str,
+    literals: str,
+    dest: str,
+    block_size: int,
+    ops: List[Op],
+    digest: str,
+) -> str:
+    """Return a shell script that rebuilds the new version on the host.
+
+    The script writes ``dest``, from the old version at ``basis`` and the
+    literal data at ``literals``, checks its SHA-256 ``digest``, and
+    removes ``literals``.
+    """
+    q_basis = shlex.quote(basis)
+    q_literals = shlex.quote(literals)
+    q_part = shlex.quote(f"{dest}.part")
+
+    lines = [
+        "set -e",
+        f"trap 'rm -f {q_literals}' EXIT",
+        "{",
+    ]
+    literal_offset = 0
+    for op, start, length in ops:
+        if op == "copy":
+            lines.append(
+                f"dd if={q_basis} bs={block_size} skip={start} count={length} 2>/dev/null"
+            )
+        else:
+            lines.append(
+                f"tail -c +{literal_offset + 1} {q_literals} | head -c {length}"
+            )
+            literal_offset += length
+    lines += [
+        f"}} > {q_part}",
+        f'[ "$(sha256sum < {q_part} | cut -d " " -f 1)" = {digest} ]'
+        f" || {{ rm -f {q_part}; exit 1; }}",
+        f"mv {q_part} {shlex.quote(dest)}",
+        "",
+    ]
+    return "\n".join(lines)
@@ -18,16 +18,33 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import ast
+import copy
 import enum
+import hashlib
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+from . import bundles
 from ._config import user_config_dir
 from .metadata import extract_metadata
 
 
+logger = logging.getLogger(__name__)
+
+
 _BUILTIN = Path(__file__).parent / "builtin_deploy_scripts"
 _USER_DIR = user_config_dir() / "deploy_scripts"
+_INDEX_PATH = user_config_dir() / "deploy_script_index.pickle"
+_INDEX_VERSION = 5
+_EXCLUDES = ["__init__.py"]
+# Scripts are parsed by a process pool from this many changed scripts.
+_PARALLEL_THRESHOLD = 64
 
 
 class Type(enum.IntFlag):
@@ -49,42 +66,222 @@ def find_deploy_scripts(filter_by: List = None):
     ``filter_by`` limits the search in directories with a list of names.
     """
     search_dirs = [Path.cwd(), _USER_DIR, _BUILTIN]
-    excludes = ["__init__.py"]
     scripts = []
-    search_paths = []
-
-    # Build scearch paths.
-    if filter_by:
-        for f in filter_by:
-            search_paths.extend([(d / f) for d in search_dirs])
-    else:
-        for d in search_dirs:
-            if d.exists():
-                search_paths.extend(d.iterdir())
-
-    # Search for scripts in paths and extract metadata.
-    for fp in search_paths:
-        if fp.name in excludes:
-            continue
-        fp = _expand_path(fp)
-        if not fp.exists():
-            continue
+    index = MetadataIndex(_INDEX_PATH)
+
+    # Look up the paths of scripts by name, or take all of them.
+    search_paths: List[Path] = []
+    for d in search_dirs:
+        if filter_by:
+            search_paths.extend(index.find(d, f) for f in filter_by)
+        else:
+            search_paths.extend(index.scripts_in(d))
 
-        metadata = _get_metadata(fp)
+    index.update(search_paths)
+    for fp in search_paths:
+        metadata = index.metadata(fp)
         if not metadata:
             continue
 
-        metadata["id"] = fp.parent.stem if fp.name == "deploy.py" else fp.stem
+        metadata["id"] = script_id(fp)
         metadata["path"] = fp
         metadata["type"] = _get_type(fp)
 
         scripts.append(metadata)
 
+    index.save()
     scripts.sort(key=lambda e: (e["type"], e["id"]))
 
     return scripts
 
 
+class MetadataIndex:
+    """Metadata of deploy scripts, persisted across runs.
+
+    Metadata of a script is extracted again when its modification time
+    or size changed, and its SHA-256 digest doesn't match anymore. The
+    IDs of the scripts in a directory are listed again when the
+    modification time of the directory changed. Scripts in a bundle are
+    listed again from its manifest when the bundle changed, and a bundle
+    that can't be read is ignored until it changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._scripts: Dict[str, tuple] = {}
+        self._dirs: Dict[str, tuple] = {}
+        self._bundles: Dict[str, tuple] = {}
+        self._changed = False
+
+        if path.exists():
+            try:
+                with open(path, "rb") as fd:
+                    version, self._scripts, self._dirs, self._bundles = pickle.load(fd)
+                if version != _INDEX_VERSION:
+                    raise ValueError(f"unknown version {version}")
+            except Exception as e:
+                logger.debug(f"MetadataIndex: ignoring unreadable {path}: {e}")
+                self._scripts, self._dirs, self._bundles = {}, {}, {}
+
+    def scripts_in(self, directory: Path) -> List[Path]:
+        """Return the possible paths of scripts in a directory, including
+        those in bundles.
+
+        A path may not exist, e.g. ``deploy.py`` in a subdirectory. Scripts
+        outside bundles take precedence over scripts in bundles with the
+        same ID.
+        """
+        script_paths, bundle_paths = self._list(directory)
+        ids = {script_id(p) for p in script_paths}
+        bundled = self._scripts_in_bundles(bundle_paths)
+        return script_paths + [p for i, p in bundled.items() if i not in ids]
+
+    def find(self, directory: Path, name) -> Path:
+        """Return the possible path of a script in a directory by ID, or
+        by a path relative to the directory, e.g. "sub/script.py".
+
+        A directory takes precedence over a file with the same ID, and
+        scripts outside bundles over scripts in bundles.
+        """
+        path = _expand_path(directory / name)
+        if path.exists():
+            return path
+        _, bundle_paths = self._list(directory)
+        return self._scripts_in_bundles(bundle_paths).get(str(name), path)
+
+    def _list(self, directory: Path) -> Tuple[List[Path], List[Path]]:
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except OSError:
+            return [], []
+
+        cached = self._dirs.get(str(directory))
+        if not cached or cached[0] != mtime:
+            cached = (mtime, *list_scripts(directory))
+            self._dirs[str(directory)] = cached
+            self._changed = True
+        return cached[1], cached[2]
+
+    def _scripts_in_bundles(self, bundle_paths: List[Path]) -> Dict[str, Path]:
+        merged: Dict[str, Path] = {}
+        for bundle in bundle_paths:
+            merged.update(self._scripts_in_bundle(bundle))
+        return merged
+
+    def _scripts_in_bundle(self, bundle: Path) -> Dict[str, Path]:
+        try:
+            st = bundle.stat()
+        except OSError:
+            return {}
+
+        stat = (st.st_mtime_ns, st.st_size)
+        cached = self._bundles.get(str(bundle))
+        if cached and cached[0] == stat:
+            return cached[1]
+
+        scripts_by_id: Dict[str, Path] = {}
+        for key in cached[1].values() if cached else []:
+            self._scripts.pop(str(key), None)
+        self._bundles[str(bundle)] = (stat, scripts_by_id)
+        self._changed = True
+
+        try:
+            manifest = bundles.read_manifest(bundle)
+        except ValueError as e:
+            # Not logged again until the file changes.
+            logger.warning(f"ignoring {bundle}: {e}")
+            return scripts_by_id
+
+        for name, script in manifest["scripts"].items():
+            path = bundle / script["path"]
+            scripts_by_id[name] = path
+            # The manifest has the metadata, see `update`.
+            self._scripts[str(path)] = (stat, None, script["metadata"], None)
+
+        return scripts_by_id
+
+    def update(self, paths: List[Path]):
+        """Extract the metadata of scripts that are new or changed.
+
+        When there are many, they're parsed by a process pool.
+        """
+        changed = []
+        for path in paths:
+            key = str(path)
+            if bundles.split_path(path):
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                if self._scripts.pop(key, None):
+                    self._changed = True
+                continue
+
+            stat = (st.st_mtime_ns, st.st_size)
+            entry = self._scripts.get(key)
+            if entry and entry[0] == stat:
+                continue
+
+            self._changed = True
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            if entry and entry[1] == digest:
+                self._scripts[key] = (stat, *entry[1:])
+            else:
+                changed.append((path, stat, digest))
+
+        results = _read_all_metadata([path for path, _, _ in changed])
+        for (path, stat, digest), (metadata, error) in zip(changed, results):
+            self._scripts[str(path)] = (stat, digest, metadata, error)
+
+    def metadata(self, path: Path) -> Optional[Dict]:
+        """Return the metadata of a script, None when it isn't indexed,
+        or an empty dict when the metadata can't be extracted.
+
+        Call ``update`` first.
+        """
+        entry = self._scripts.get(str(path))
+        if not entry:
+            return None
+
+        _, _, metadata, error = entry
+        if error:
+            logger.warning(f"cannot extract metadata from {path}: {error}")
+
+        # Callers add keys to the metadata.
+        return copy.deepcopy(metadata)
+
+    def save(self):
+        if not self._changed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as fd:
+            pickle.dump((_INDEX_VERSION, self._scripts, self._dirs, self._bundles), fd)
+        os.replace(tmp, self.path)
+        self._changed = False
+
+
+def list_scripts(directory: Path) -> Tuple[List[Path], List[Path]]:
+    """List the possible paths of scripts in a directory, and the bundles
+    in it.
+
+    A file and a directory with the same ID, e.g. ``foo.py`` and
+    ``foo/deploy.py``, are both listed.
+    """
+    script_paths = []
+    bundle_paths = []
+
+    for p in sorted(directory.iterdir()):
+        if p.name in _EXCLUDES:
+            continue
+        if p.suffix == bundles.SUFFIX and p.is_file():
+            bundle_paths.append(p)
+        else:
+            script_paths.append(_expand_path(p))
+
+    return script_paths, bundle_paths
+
+
 def _expand_path(p):
     if p.is_dir():
         p = p / "deploy.py"
@@ -93,12 +290,36 @@ def _expand_path(p):
     return p
 
 
-def _get_metadata(fp):
+def script_id(fp) -> str:
+    """Return the ID of the script at a path."""
+    return fp.parent.stem if fp.name == "deploy.py" else fp.stem
+
+
+def _read_all_metadata(paths: List[Path]) -> List[Tuple[Dict, Optional[str]]]:
+    workers = os.cpu_count() or 1
+    if len(paths) < _PARALLEL_THRESHOLD or workers == 1:
+        return [_read_metadata(p) for p in paths]
+
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            chunksize = max(1, len(paths) // (workers * 4))
+            return list(executor.map(_read_metadata, paths, chunksize=chunksize))
+    except (OSError, NotImplementedError, BrokenProcessPool) as e:
+        logger.debug(f"cannot parse deploy scripts in parallel: {e}")
+        return [_read_metadata(p) for p in paths]
+
+
+def _read_metadata(path: Path) -> Tuple[Dict, Optional[str]]:
+    """Return the metadata of a script, and the error when it can't be
+    extracted or the script has a syntax error."""
     try:
-        metadata = extract_metadata(fp.read_text())
-    except Exception:
-        metadata = {}
-    return metadata
+        source = path.read_text()
+        metadata = extract_metadata(source)
+        # extract_metadata may stop at METADATA, so check the rest too.
+        compile(source, str(path), "exec", ast.PyCF_ONLY_AST)
+        return metadata, None
+    except Exception as e:
+        return {}, f"{type(e).__name__}: {e}"
 
 
 def _get_type(path):
@@ -0,0 +1,209 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Distribute a file across hosts in a tree.
+
+The file is uploaded to at most ``fanout`` hosts, the seeds. Every host
+that has the file serves it over HTTP to at most ``fanout`` other hosts,
+which download it from their parent. So only ``fanout`` uploads leave the
+local machine, and the number of hops grows logarithmically with the
+number of hosts.
+
+The SHA-256 digest of the file is checked on every host. When a host
+can't download the file from its parent, e.g. because the parent has no
+HTTP server (BusyBox httpd or Python 3) or failed, the file is uploaded
+to it instead.
+"""
+
+import logging
+import random
+from typing import List, Optional
+
+from gevent.event import AsyncResult
+from pyinfra.api import QuoteString, StringCommand
+
+from .transfer import put_file, sha256_file
+
+
+logger = logging.getLogger(__name__)
+
+
+PEER_DIR = "/tmp/horus-deploy-distribute"
+# Seconds to wait for a parent to get the file before uploading it.
+PARENT_TIMEOUT = 3600
+# Seconds after which a host stops serving the file, when its children
+# didn't stop it.
+SERVE_TIMEOUT = 2 * 3600
+
+
+class Tree:
+    """Distribution tree of the hosts that take part in a transfer."""
+
+    def __init__(self, hosts, fanout: int):
+        if fanout < 1:
+            raise ValueError(f"fanout must be at least 1, not {fanout}")
+        self.hosts = list(hosts)
+        self.fanout = fanout
+        self.port = random.randint(20000, 60000)
+        self._index = {host: i for i, host in enumerate(self.hosts)}
+        # True when a host serves the file, False when it can't.
+        self.serving = {host: AsyncResult() for host in self.hosts}
+        self._waiting_children = {host: len(self.children(host)) for host in self.hosts}
+        self._remaining = len(self.hosts)
+
+    def parent(self, host):
+        i = self._index[host]
+        if i < self.fanout:
+            return None
+        return self.hosts[(i - self.fanout) // self.fanout]
+
+    def children(self, host) -> List:
+        first = self.fanout * (self._index[host] + 1)
+        return self.hosts[first:first + self.fanout]
+
+    def child_done(self, parent) -> bool:
+        """Return True when the last child of ``parent`` is done."""
+        self._waiting_children[parent] -= 1
+        return self._waiting_children[parent] == 0
+
+    def host_done(self) -> bool:
+        """Return True when the last host is done."""
+        self._remaining -= 1
+        return self._remaining == 0
+
+
+def distribute_file(state, host, src, dest, fanout, op_hash, **kwargs):
+    """Upload a local file to all hosts through a distribution tree.
+
+    The tree consists of the active hosts that run the operation with
+    hash ``op_hash``. The keyword arguments are passed to ``put_file``
+    for hosts the file is uploaded to.
+    """
+    digest = sha256_file(src)
+    trees = state.__dict__.setdefault("_horus_distribute", {})
+    key = (op_hash, dest)
+    if key not in trees:
+        trees[key] = Tree(
+            [
+                h for h in state.inventory
+                if h in state.active_hosts and op_hash in state.ops[h]
+            ],
+            fanout,
+        )
+    tree = trees[key]
+
+    try:
+        status = _get_file(state, host, tree, src, dest, digest, kwargs)
+        if status and tree.children(host):
+            serving, _, _ = host.run_shell_command(
+                serve_command(dest, digest, tree.port, SERVE_TIMEOUT)
+            )
+            if not serving:
+                logger.warning(f"distribute: {host} can't serve {dest}, uploading instead")
+            tree.serving[host].set(serving)
+        return status
+    finally:
+        if not tree.serving[host].ready():
+            tree.serving[host].set(False)
+        if tree.host_done():
+            del trees[key]
+
+
+def _get_file(state, host, tree, src, dest, digest, put_file_kwargs) -> bool:
+    parent = tree.parent(host)
+
+    if parent is not None:
+        serving = tree.serving[parent].wait(PARENT_TIMEOUT)
+        status = False
+        if serving:
+            addr = parent.data.ssh_hostname or parent.name
+            status, _, stderr = host.run_shell_command(
+                fetch_command(f"http://{addr}:{tree.port}/{digest}", dest, digest)
+            )
+            if not status:
+                logger.warning(f"distribute: {host} can't download {dest} from {parent}")
+        if tree.child_done(parent) and serving:
+            parent.run_shell_command(stop_command(digest))
+        if status:
+            return True
+
+    logger.debug(f"distribute: uploading {src} to {host}")
+    if not put_file(state, host, src, dest, **put_file_kwargs):
+        return False
+
+    status, _, _ = host.run_shell_command(verify_command(dest, digest))
+    if not status:
+        logger.error(f"distribute: checksum of {dest} on {host} doesn't match")
+    return status
+
+
+def verify_command(path, digest):
+    return StringCommand(
+        '[ "$(sha256sum <', QuoteString(path), '| cut -d " " -f 1)" =', digest, "]",
+    )
+
+
+def fetch_command(url, dest, digest):
+    """Download a file with curl or wget, and check its digest."""
+    part = f"{dest}.part"
+    return StringCommand(
+        "{",
+        "if command -v curl >/dev/null 2>&1; then",
+        "curl -fsS -o", QuoteString(part), QuoteString(url), ";",
+        "else wget -q -O", QuoteString(part), QuoteString(url), "; fi",
+        "&&", verify_command(part, digest),
+        "&& mv", QuoteString(part), QuoteString(dest), ";",
+        "} || { rm -f", QuoteString(part), "; exit 1; }",
+    )
+
+
+def serve_command(path, digest, port, timeout, peer_dir: Optional[str] = None):
+    """Serve a file as ``/<digest>`` over HTTP in the background.
+
+    The server stops after ``timeout`` seconds, or with ``stop_command``.
+    Fails when neither BusyBox httpd nor Python 3 is available.
+    """
+    served_dir = f"{peer_dir or PEER_DIR}/{digest}"
+    served = f"{served_dir}/{digest}"
+    pid_file = f"{served_dir}.pid"
+    return StringCommand(
+        "mkdir -p", QuoteString(served_dir), "&&",
+        "{ ln -f", QuoteString(path), QuoteString(served), "2>/dev/null",
+        "|| cp", QuoteString(path), QuoteString(served), "; } &&",
+        "if busybox --list 2>/dev/null | grep -qx httpd; then",
+        "set -- busybox httpd -f -p", str(port), "-h", QuoteString(served_dir), ";",
+        "elif command -v python3 >/dev/null 2>&1; then",
+        "set -- python3 -m http.server", str(port),
+        "--directory", QuoteString(served_dir), ";",
+        "else exit 1; fi;",
+        'nohup "$@" >/dev/null 2>&1 </dev/null & pid=$!;',
+        "echo $pid >", QuoteString(pid_file), ";",
+        f"( sleep {int(timeout)}; kill $pid ) >/dev/null 2>&1 </dev/null &",
+        "sleep 1; kill -0 $pid",
+    )
+
+
+def stop_command(digest, peer_dir: Optional[str] = None):
+    served_dir = f"{peer_dir or PEER_DIR}/{digest}"
+    pid_file = f"{served_dir}.pid"
+    return StringCommand(
+        "kill $(cat", QuoteString(pid_file), ") 2>/dev/null;",
+        "rm -rf", QuoteString(served_dir), QuoteString(pid_file),
+    )
@@ -0,0 +1,205 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cross-run cache for pyinfra facts.
+
+Facts are cached per device, keyed by the hardware ID, and are stored in
+the user configuration directory. Only facts listed in
+``CACHEABLE_FACTS`` are cached. Operations that change the state a fact
+describes invalidate it, see ``horus_deploy.operations.system``.
+
+The cache is enabled by calling ``install`` inside the pyinfra process
+(``run --fact-cache-ttl`` takes care of this) and by setting the
+``hardware_id`` and ``fact_cache_ttl`` host data.
+"""
+
+import logging
+import os
+import pickle
+import re
+import time
+from inspect import isclass
+from typing import Any, Dict, Iterable, Optional
+
+import pyinfra.api.facts
+from pyinfra.api.operation_kwargs import get_executor_kwarg_keys
+from pyinfra.api.util import make_hash
+
+from ._config import user_config_dir
+
+
+logger = logging.getLogger(__name__)
+
+
+MOUNT_FACTS = {"mounts"}
+PACKAGE_FACTS = {"rpm_packages", "rpm_package", "installed_rpms"}
+CACHEABLE_FACTS = {"which"} | MOUNT_FACTS | PACKAGE_FACTS
+
+_CACHE_DIR = user_config_dir() / "fact_cache"
+_RE_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+_MISSING = object()
+
+_original_get_facts = pyinfra.api.facts.get_facts
+_caches: Dict[str, "FactCache"] = {}
+
+
+class FactCache:
+    """Facts of one device, persisted to a pickle file."""
+
+    def __init__(self, path, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._entries: Dict[str, Any] = {}
+
+        if path.exists():
+            try:
+                with open(path, "rb") as fd:
+                    self._entries = pickle.load(fd)
+            except Exception as e:
+                logger.debug(f"FactCache: ignoring unreadable {path}: {e}")
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+
+        _, created, data = entry
+        if time.time() - created > self.ttl:
+            return _MISSING
+
+        return data
+
+    def set(self, key: str, name: str, data: Any):
+        self._entries[key] = (name, time.time(), data)
+        self._save()
+
+    def invalidate(self, names: Optional[Iterable[str]] = None):
+        if names is None:
+            self._entries = {}
+        else:
+            names = set(names)
+            self._entries = {
+                k: v for k, v in self._entries.items() if v[0] not in names
+            }
+        self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as fd:
+            pickle.dump(self._entries, fd)
+        os.replace(tmp, self.path)
+
+
+def install():
+    """Route pyinfra's fact gathering through the cache.
+
+    Safe to call more than once.
+    """
+    pyinfra.api.facts.get_facts = _get_facts
+
+
+def invalidate(host, names: Optional[Iterable[str]] = None):
+    """Invalidate cached facts of a host, or all of them when ``names`` is None."""
+    cache = _get_cache(host)
+    if cache is not None:
+        cache.invalidate(names)
+
+
+def _get_cache(host) -> Optional[FactCache]:
+    hardware_id = host.data.get("hardware_id")
+    ttl = host.data.get("fact_cache_ttl")
+    if not hardware_id or not ttl:
+        return None
+
+    if hardware_id not in _caches:
+        path = _CACHE_DIR / f"{_RE_UNSAFE_CHARS.sub('_', hardware_id)}.pickle"
+        _caches[hardware_id] = FactCache(path, float(ttl))
+
+    return _caches[hardware_id]
+
+
+def _get_facts(state, name_or_cls, args=None, kwargs=None, ensure_hosts=None, **kw):
+    if isclass(name_or_cls):
+        name = getattr(name_or_cls, "name", None)
+    else:
+        name = name_or_cls
+
+    if name not in CACHEABLE_FACTS or not ensure_hosts:
+        return _original_get_facts(
+            state, name_or_cls, args=args, kwargs=kwargs, ensure_hosts=ensure_hosts, **kw
+        )
+
+    key = _cache_key(state, name, args, kwargs)
+
+    # Facts are shared between all lookups in this run, so changes made by
+    # `host.create_fact`/`host.delete_fact` stay visible. These changes are
+    # predictions and are never written to the cache.
+    session = state.__dict__.setdefault("_horus_fact_cache", {}).setdefault(key, {})
+
+    missing_hosts = []
+    for host in ensure_hosts:
+        if host in session:
+            continue
+        cache = _get_cache(host)
+        data = cache.get(key) if cache is not None else _MISSING
+        if data is _MISSING:
+            missing_hosts.append(host)
+        else:
+            logger.debug(f"fact cache: hit {name} for {host}")
+            session[host] = data
+
+    if not missing_hosts:
+        return session
+
+    facts = _original_get_facts(
+        state, name_or_cls, args=args, kwargs=kwargs, ensure_hosts=ensure_hosts, **kw
+    )
+
+    for host, data in facts.items():
+        if host in session:
+            continue
+        session[host] = data
+        cache = _get_cache(host)
+        if cache is not None and host not in state.failed_hosts:
+            cache.set(key, name, data)
+
+    return session
+
+
+def _cache_key(state, name, args, kwargs) -> str:
+    # Executor arguments change the result of a fact, e.g. `sudo` makes
+    # files readable. Like pyinfra, take them from the current operation,
+    # overridden by the fact's keyword arguments.
+    kwargs = dict(kwargs or {})
+    executor_kwargs = {
+        **(state.current_op_global_kwargs or {}),
+        **{k: kwargs.pop(k) for k in get_executor_kwarg_keys() if k in kwargs},
+    }
+    return make_hash((
+        name,
+        args or (),
+        kwargs,
+        executor_kwargs.get("sudo", state.config.SUDO),
+        executor_kwargs.get("sudo_user", state.config.SUDO_USER),
+        executor_kwargs.get("su_user", state.config.SU_USER),
+        executor_kwargs.get("env", state.config.ENV) or {},
+        executor_kwargs.get("shell_executable", state.config.SHELL),
+    ))
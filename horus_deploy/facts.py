@@ -0,0 +1,73 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyinfra facts used by horus-deploy operations."""
+
+from pyinfra.api import FactBase, QuoteString, StringCommand
+
+
+class InstalledRpms(FactBase):
+    """
+    Returns the set of the given packages that are installed, in a single
+    ``rpm -q`` call. Packages are given and returned as
+    ``name-version-release.arch``:
+
+    .. code:: python
+
+        {"htop-2.2.0-r0.aarch64"}
+    """
+
+    requires_command = "rpm"
+    default = set
+
+    def command(self, nevras):
+        return StringCommand(
+            "rpm -q --queryformat '%{NAME}-%{VERSION}-%{RELEASE}.%{ARCH}\\n'",
+            *[QuoteString(n) for n in nevras],
+            "2>/dev/null || true",
+        )
+
+    def process(self, output):
+        # Packages that are not installed are reported as "package ... is
+        # not installed".
+        return {line.strip() for line in output if line.strip() and " " not in line.strip()}
+
+
+class StagedFile(FactBase):
+    """
+    Returns the SHA-256 digest and the source of a staged file, from its
+    checksum file (see ``horus_deploy.staging``), or ``None`` when either
+    doesn't exist:
+
+    .. code:: python
+
+        ("9f86d08...", "https://example.com/update.mender")
+    """
+
+    def command(self, path):
+        return StringCommand(
+            "[ -f", QuoteString(path), "] &&",
+            "cat", QuoteString(f"{path}.sha256"), "2>/dev/null || true",
+        )
+
+    def process(self, output):
+        if len(output) < 2:
+            return None
+        return output[0].strip(), output[1].strip()
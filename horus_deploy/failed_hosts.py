@@ -0,0 +1,74 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Report the hosts that failed in a pyinfra process.
+
+``run`` adds this module as a setup script (see
+``cli.write_setup_script``) when it runs deploy scripts in waves, and
+reads the report after pyinfra exits to decide whether to start the
+next wave.
+"""
+
+import atexit
+import json
+import os
+from typing import List, Optional
+
+from pyinfra import pseudo_state
+
+
+REPORT_ENV = "HORUS_DEPLOY_FAILED_HOSTS"
+
+_installed = False
+
+
+def install():
+    """Write the names of the failed hosts to the file in
+    ``$HORUS_DEPLOY_FAILED_HOSTS`` when pyinfra exits.
+
+    Safe to call more than once.
+    """
+    global _installed
+    if not _installed and REPORT_ENV in os.environ:
+        atexit.register(_write_report, os.environ[REPORT_ENV])
+        _installed = True
+
+
+def read_report(path) -> Optional[List[str]]:
+    """Return the failed hosts, or None when pyinfra didn't write a report,
+    e.g. because it stopped before running the deploy scripts."""
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_report(path):
+    hosts = pseudo_state.failed_hosts if pseudo_state.isset() else []
+    with open(path, "w") as fd:
+        json.dump(sorted(_host_name(h) for h in hosts), fd)
+
+
+def _host_name(host) -> str:
+    # The name of a host changes when system.reboot reconnects to another
+    # address, so prefer its zeroconf server name.
+    return host.data.get("zeroconf_server_name") or host.name
@@ -4,7 +4,7 @@ import re
 import time
 from dataclasses import dataclass, field
 from ipaddress import ip_address
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from zeroconf import ServiceBrowser, Zeroconf, ServiceInfo, ServiceListener
 
@@ -71,6 +71,17 @@ class Host:
         new_resolved_addrs = [cls._cast_addr(a) for a in resolved_addrs]
         return cls(new_addr, new_resolved_addrs, **kwargs)
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Host":
+        """Create a host from the output of ``dataclasses.asdict``."""
+        return cls.from_str(
+            addr=data["addr"]["s"],
+            resolved_addrs=[a["s"] for a in data.get("resolved_addrs", [])],
+            props=data.get("props", {}),
+            ssh_host=data.get("ssh_host", ""),
+            ssh_params=data.get("ssh_params", {}),
+        )
+
     @staticmethod
     def _cast_addr(addr: Union[str, Address]) -> Address:
         if not isinstance(addr, Address):
@@ -86,19 +97,15 @@ def resolve(host: Host) -> Optional[Host]:
         # the same as the address types do need to be resolved.
         return dataclasses.replace(host, resolved_addrs=[host.addr])
 
-    match = _RE_ZC_SERVER_NAME.match(host.addr.s)
-    if not match:
-        raise ValueError(f"zeroconf server name is malformed: {host.addr!r}")
-    host_name = match.group(1)
+    # Raises for malformed names before waiting for discovery.
+    _server_name_prefix(host.addr.s)
 
     # TODO: Some way to pass timeout.
     discovered_hosts = find_hosts_on_local_network()
     matched_host = None
 
     for discovered_host in discovered_hosts:
-        if discovered_host.addr.s.startswith(
-            host_name
-        ) and discovered_host.addr.s.endswith(_LOCAL):
+        if matches(discovered_host, host.addr.s):
             matched_host = discovered_host
             break
 
@@ -113,6 +120,26 @@ def resolve(host: Host) -> Optional[Host]:
     return new_host
 
 
+def matches(host: Host, name: str) -> bool:
+    """Check if a discovered host has the given zeroconf server name or
+    hardware ID."""
+    if host.props.get("hardware_id") == name:
+        return True
+    if Address(name).t != AddressType.ZEROCONF_SERVER_NAME:
+        return False
+    return (
+        host.addr.s.startswith(_server_name_prefix(name))
+        and host.addr.s.endswith(_LOCAL)
+    )
+
+
+def _server_name_prefix(name: str) -> str:
+    match = _RE_ZC_SERVER_NAME.match(name)
+    if not match:
+        raise ValueError(f"zeroconf server name is malformed: {name!r}")
+    return match.group(1)
+
+
 def find_hosts_on_local_network(wait_for: float = _DEFAULT_WAIT) -> List[Host]:
     """Discover hosts on the local network using Zeroconf."""
     zc = Zeroconf()
@@ -128,9 +155,18 @@ def find_hosts_on_local_network(wait_for: float = _DEFAULT_WAIT) -> List[Host]:
     return hosts
 
 
+def watch_hosts(on_change: Callable[[Host], None]) -> Zeroconf:
+    """Call ``on_change`` with each host that announces itself, from
+    another thread, until the returned ``Zeroconf`` is closed."""
+    zc = Zeroconf()
+    ServiceBrowser(zc, _TYPE, listener=_ServiceListener(on_change))
+    return zc
+
+
 class _ServiceListener(ServiceListener):
-    def __init__(self):
+    def __init__(self, on_change: Optional[Callable[[Host], None]] = None):
         self._hosts: Dict[str, Host] = {}
+        self._on_change = on_change
 
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         info = zc.get_service_info(type_, name)
@@ -165,6 +201,8 @@ class _ServiceListener(ServiceListener):
                 "hardware_id": hwid,
             },
         )
+        if self._on_change:
+            self._on_change(self._hosts[key])
 
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         self.add_service(zc, type_, name)
@@ -0,0 +1,60 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import dataclasses
+import json
+from pathlib import Path
+from typing import List
+
+from .host import Host
+from .utils import json_dumps
+
+
+_VERSION = 1
+
+# Not written to inventory files, pass them with the --ssh-* options.
+_SECRET_SSH_PARAMS = {"ssh_password", "ssh_key_password"}
+
+
+def save_inventory(path: Path, hosts: List[Host]):
+    """Write resolved hosts, including SSH parameters, to a JSON file.
+
+    The file can be passed to ``run --inventory`` and ``shell --inventory``
+    to skip discovery, resolving, and probing SSH parameters. Passwords
+    are left out.
+    """
+    hosts = [
+        dataclasses.replace(h, ssh_params={
+            k: v for k, v in h.ssh_params.items() if k not in _SECRET_SSH_PARAMS
+        })
+        for h in hosts
+    ]
+    data = {"version": _VERSION, "hosts": hosts}
+    path.write_text(json_dumps(data, indent=2) + "\n")
+
+
+def load_inventory(path: Path) -> List[Host]:
+    """Load hosts from a JSON file written by ``save_inventory``."""
+    data = json.loads(path.read_text())
+
+    if not isinstance(data, dict) or data.get("version") != _VERSION:
+        raise ValueError(f"unsupported inventory format in {path}")
+
+    return [Host.from_dict(h) for h in data.get("hosts", [])]
@@ -19,18 +19,114 @@
 # SOFTWARE.
 
 import ast
-from typing import Dict, List, Any
+import io
+import tokenize
+from typing import Dict, List, Any, Optional, Tuple
 
 
 _VARIABLE_NAME = "METADATA"
 
+# Tokenizing is slower than parsing, so give up when METADATA isn't
+# near the top.
+_TOKENIZE_LIMIT = 8 * 1024
+_OPENING = {"(", "[", "{"}
+_CLOSING = {")", "]", "}"}
+
 
 def extract_metadata(source_code: str) -> Dict:
     """Extract metadata from deploy script.
 
     I.e. the value of a top-level variable named METADATA is extracted
     from Python source code.
+
+    Usually the source is only tokenized up to the end of a
+    ``METADATA = {...}`` statement, and the rest isn't parsed. Other
+    forms, such as ``a, METADATA = ...``, and METADATA far from the top
+    fall back to parsing all of it. So a syntax error after METADATA
+    isn't always raised.
+    """
+    metadata = _extract_from_tokens(source_code)
+    if metadata is None:
+        metadata = _extract_from_ast(source_code)
+    return metadata
+
+
+def _extract_from_tokens(source_code: str) -> Optional[Dict]:
+    """Return the value of the first top-level statement that uses
+    METADATA, if it's a ``METADATA = {...}`` statement.
+
+    Returns None when this can't be determined from the tokens, or from
+    the first ``_TOKENIZE_LIMIT`` characters.
     """
+    lines: List[str] = []
+    readline = io.StringIO(source_code).readline
+    limit = _TOKENIZE_LIMIT
+
+    def read():
+        nonlocal limit
+        if limit < 0:
+            # Tokenizing ends as if the source ended.
+            return ""
+        lines.append(readline())
+        limit -= len(lines[-1])
+        return lines[-1]
+
+    tokens = tokenize.generate_tokens(read)
+    indent = 0
+    statement_start = True
+
+    try:
+        for token in tokens:
+            if token.type in (tokenize.INDENT, tokenize.DEDENT):
+                indent += 1 if token.type == tokenize.INDENT else -1
+            elif token.type == tokenize.NEWLINE:
+                statement_start = True
+            elif token.type not in (tokenize.NL, tokenize.COMMENT):
+                if indent == 0 and token[:2] == (tokenize.NAME, _VARIABLE_NAME):
+                    limit = len(source_code)
+                    return _read_dict(tokens, lines) if statement_start else None
+                statement_start = False
+    except (tokenize.TokenError, SyntaxError):
+        pass
+
+    return None
+
+
+def _read_dict(tokens, lines: List[str]) -> Optional[Dict]:
+    # After `METADATA`, expects `= {...}` and the end of the statement.
+    if [next(tokens).string, (opening := next(tokens)).string] != ["=", "{"]:
+        return None
+
+    depth = 1
+    for token in tokens:
+        if token.type == tokenize.OP and token.string in _OPENING:
+            depth += 1
+        elif token.type == tokenize.OP and token.string in _CLOSING:
+            depth -= 1
+            if depth == 0:
+                break
+
+    following = next(tokens, None)
+    if not following or following.type not in (
+        tokenize.NEWLINE, tokenize.COMMENT, tokenize.ENDMARKER
+    ):
+        return None
+
+    return ast.literal_eval(_source_between(lines, opening.start, token.end))
+
+
+def _source_between(lines: List[str], start: Tuple[int, int], end: Tuple[int, int]) -> str:
+    (start_row, start_col), (end_row, end_col) = start, end
+    if start_row == end_row:
+        return lines[start_row - 1][start_col:end_col]
+    return (
+        lines[start_row - 1][start_col:]
+        + "".join(lines[start_row:end_row - 1])
+        + lines[end_row - 1][:end_col]
+    )
+
+
+def _extract_from_ast(source_code: str) -> Dict:
     module = ast.parse(source_code)
     metadata = {}
 
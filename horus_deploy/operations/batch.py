@@ -0,0 +1,166 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+from types import GeneratorType
+
+from pyinfra import logger
+from pyinfra.api import operation, StringCommand
+
+_MARKER = "__HORUS_DEPLOY_STEP__"
+_RE_MARKER = re.compile(rf"^{_MARKER} (\d+) (\d+)$")
+
+
+@operation
+def shell(commands, state=None, host=None):
+    """Run shell commands in a single round trip.
+
+    Like ``server.shell``, but all commands are combined into one
+    remote script. The exit status of each command is still reported,
+    and the script stops at the first command that fails.
+
+    Parameters:
+        commands: A command or a list of commands.
+    """
+    if isinstance(commands, str):
+        commands = [commands]
+    yield from coalesce(commands)
+
+
+def coalesce(*commands):
+    """Combine consecutive shell commands into batches.
+
+    Accepts commands, lists of commands, and generators returned by
+    nested operations. Consecutive ``StringCommand`` objects with the
+    same executor arguments (sudo, env, ...) are combined into a single
+    ``BatchCommand``, and batches from nested calls are merged. Other
+    commands, e.g. file uploads or Python callbacks, are passed through
+    and end the current batch.
+    """
+    pending = []
+
+    for command in _flatten(commands):
+        if isinstance(command, str):
+            command = StringCommand(command.strip())
+
+        if isinstance(command, StringCommand):
+            steps = command.steps if isinstance(command, BatchCommand) else [command]
+            for step in steps:
+                if pending and not _same_executor_kwargs(pending[0], step):
+                    yield _make_batch(pending)
+                    pending = []
+                pending.append(step)
+            continue
+
+        if pending:
+            yield _make_batch(pending)
+            pending = []
+        yield command
+
+    if pending:
+        yield _make_batch(pending)
+
+
+class BatchCommand(StringCommand):
+    """A sequence of shell commands executed as one remote script."""
+
+    def __init__(self, *steps, **kwargs):
+        self.steps = steps
+        lines = [_step_line(i, step) for i, step in enumerate(steps)]
+        super().__init__(*lines, "exit 0", _separator="\n", **kwargs)
+
+    def __repr__(self):
+        return "BatchCommand({0})".format(
+            "; ".join(step.get_masked_value() for step in self.steps)
+        )
+
+    def execute(self, state, host, executor_kwargs):
+        status, combined_output = super().execute(state, host, executor_kwargs)
+        exit_codes, combined_output = parse_step_output(combined_output)
+
+        for i, step in enumerate(self.steps):
+            if i not in exit_codes:
+                logger.info(f"{host.print_prefix}skipped: {step.get_masked_value()}")
+            elif exit_codes[i] in _allowed_exit_codes(step):
+                logger.debug(f"{host.print_prefix}success: {step.get_masked_value()}")
+            else:
+                logger.error(
+                    f"{host.print_prefix}failed (exit status {exit_codes[i]}): "
+                    f"{step.get_masked_value()}"
+                )
+
+        return status, combined_output
+
+
+def parse_step_output(combined_output):
+    """Split the exit status of each step from the command output.
+
+    Returns a 2-tuple with a dict (step index -> exit status) and the
+    remaining output lines.
+    """
+    exit_codes = {}
+    output = []
+
+    for type_, line in combined_output:
+        match = _RE_MARKER.match(line.strip()) if type_ == "stdout" else None
+        if match:
+            exit_codes[int(match.group(1))] = int(match.group(2))
+        else:
+            output.append((type_, line))
+
+    return exit_codes, output
+
+
+def _make_batch(commands):
+    if len(commands) == 1:
+        return commands[0]
+
+    kwargs = dict(commands[0].executor_kwargs)
+    kwargs.pop("success_exit_codes", None)
+    return BatchCommand(*commands, **kwargs)
+
+
+def _step_line(i, step):
+    codes = "|".join(str(c) for c in _allowed_exit_codes(step))
+    return StringCommand(
+        "(", step, ")",
+        f'; rc=$?; echo "{_MARKER} {i} $rc"; case $rc in {codes}) ;; *) exit $rc ;; esac',
+    )
+
+
+def _allowed_exit_codes(step):
+    codes = step.executor_kwargs.get("success_exit_codes") or [0]
+    # Negative exit codes are pyinfra's way of accepting a disconnect.
+    return [c for c in codes if c >= 0] or [0]
+
+
+def _same_executor_kwargs(a, b):
+    def strip(kwargs):
+        return {k: v for k, v in kwargs.items() if k != "success_exit_codes"}
+
+    return strip(a.executor_kwargs) == strip(b.executor_kwargs)
+
+
+def _flatten(commands):
+    for command in commands:
+        if isinstance(command, (GeneratorType, list, tuple)):
+            yield from _flatten(command)
+        else:
+            yield command
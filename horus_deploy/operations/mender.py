@@ -0,0 +1,117 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from time import monotonic
+
+from gevent import sleep
+from pyinfra import logger
+from pyinfra.api import operation, FunctionCommand, QuoteString, StringCommand
+
+from . import system
+
+
+_HEALTH_INTERVAL = 5
+
+
+@operation(is_idempotent=False)
+def install(artifact, state=None, host=None):
+    """Install a Mender artifact, which is booted after the next reboot.
+
+    Parameters:
+        artifact: A path on the target host or URL to a Mender artifact.
+    """
+    yield StringCommand("mender", "install", QuoteString(artifact))
+    yield system.invalidate_facts(state=state, host=host)
+
+
+@operation(is_idempotent=False)
+def rollout(
+    artifact,
+    health_command=None,
+    health_url=None,
+    health_timeout=300,
+    reboot_timeout=300,
+    state=None,
+    host=None,
+):
+    """Install a Mender artifact, reboot, and commit it when the target
+    host is healthy.
+
+    The health check runs until it passes or ``health_timeout`` seconds
+    have passed. When it doesn't pass, the target host is rebooted
+    without committing, so Mender rolls back to the previous artifact,
+    and the operation fails. Without ``health_command`` and
+    ``health_url``, reconnecting after the reboot is the health check.
+
+    Parameters:
+        artifact: A path on the target host or URL to a Mender artifact.
+        health_command: A shell command that succeeds when the target host
+            is healthy.
+        health_url: A URL that the target host can fetch when it's healthy,
+            e.g. ``http://localhost:8080/health``.
+        health_timeout: Maximum time (s) for the health check to pass.
+        reboot_timeout: See ``system.reboot``.
+    """
+    kw = {"state": state, "host": host}
+    executor_kwargs = system._executor_kwargs(state)
+
+    yield install(artifact, **kw)
+    yield system.reboot(reboot_timeout=reboot_timeout, **kw)
+    yield FunctionCommand(
+        _check_health_or_roll_back,
+        (health_check_command(health_command, health_url), health_timeout),
+        {"executor_kwargs": executor_kwargs},
+    )
+    yield StringCommand("mender", "commit")
+    yield system.invalidate_facts(**kw)
+
+
+def health_check_command(command=None, url=None):
+    """Return a command that succeeds when ``command`` succeeds and
+    ``url`` can be fetched."""
+    checks = []
+    if command:
+        checks.append(StringCommand("{", command, "; }"))
+    if url:
+        q_url = QuoteString(url)
+        checks.append(StringCommand(
+            "{ curl -fsS -o /dev/null", q_url, "|| wget -q -O /dev/null", q_url, "; }",
+        ))
+    if not checks:
+        return StringCommand("true")
+    return StringCommand(*[bit for check in checks for bit in ["&&", check]][1:])
+
+
+def _check_health_or_roll_back(state, host, command, timeout, executor_kwargs=None):
+    executor_kwargs = executor_kwargs or {}
+    deadline = monotonic() + timeout
+
+    while True:
+        status, _, stderr = host.run_shell_command(command, **executor_kwargs)
+        if status:
+            return True
+        if monotonic() >= deadline:
+            break
+        sleep(_HEALTH_INTERVAL)
+
+    logger.error(f"{host.name}: health check failed, rolling back: {' '.join(stderr)}")
+    host.run_shell_command(StringCommand("reboot"), **executor_kwargs)
+    return False
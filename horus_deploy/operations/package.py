@@ -21,11 +21,16 @@
 import re
 from os.path import basename
 from time import time
+from urllib.parse import urlparse
 
-from pyinfra.api import operation
-from pyinfra.operations import files, dnf
+from pyinfra.api import operation, OperationError, QuoteString, StringCommand
+from pyinfra.facts.rpm import RpmPackages
+from pyinfra.operations import files
 
-from . import system
+from .. import fact_cache
+from ..facts import InstalledRpms
+from ..rpm import Nevra, read_nevra
+from . import batch, system
 
 
 _OVERLAYS = ["/lib", "/usr"]
@@ -33,34 +38,67 @@ _RE_RPM_FILENAME = re.compile(r"(.*/)*(.*)-(.*)-(.*?)\.(.*)\.rpm")
 
 
 @operation
-def install(packages, state=None, host=None):
+def install(packages, cache=False, state=None, host=None):
     """Install RPM package on target host.
 
+    All packages are transferred concurrently and installed in a single
+    RPM transaction, so dependencies between the given packages are
+    resolved. Packages that are already installed are skipped, without
+    transferring them. Nothing is done when all packages are installed.
+
+    The overlays are remounted read-write while installing, unless this
+    is done between ``system.begin_remount`` and ``system.end_remount``.
+
     Paramaters:
         packages: A list of local paths or URLs to RPM packages.
+        cache: Keep uploaded packages in the artifact cache on the target
+            host, so installing them again doesn't upload them again.
     """
     tmp = _tmpdir()
     kw = {"state": state, "host": host}
 
+    nevras = {src: _get_nevra(src) for src in packages}
+    installed = set()
+    if known := sorted(str(n) for n in nevras.values() if n):
+        installed = host.get_fact(InstalledRpms, known)
+    # Facts are gathered before anything runs, so they don't show packages
+    # that are uninstalled earlier in the deploy.
+    changes = _package_changes(state, host)
+    packages = [
+        src for src in packages
+        if not nevras[src]
+        or str(nevras[src]) not in installed
+        or changes.get(nevras[src].name) == "removed"
+    ]
+    if not packages:
+        return
+    for src in packages:
+        if nevras[src]:
+            changes[nevras[src].name] = "installed"
+
     packages = [(src, f"{tmp}/{basename(src)}") for src in packages]
 
     yield files.directory(tmp, **kw)
-    yield system.remount(_OVERLAYS, "rw", **kw)
+    yield system.transfer_many(packages, cache=cache, **kw)
+    yield system.begin_remount(_OVERLAYS, "rw", **kw)
 
     try:
-        for src, dest in packages:
-            yield system.transfer(src, dest, **kw)
-            yield dnf.rpm(dest, **kw)
-            yield files.file(dest, present=False, **kw)
+        yield _install_command([dest for _, dest in packages])
+        yield system.invalidate_facts(fact_cache.PACKAGE_FACTS, **kw)
     finally:
-        yield system.remount(_OVERLAYS, "ro", **kw)
-        yield files.directory(tmp, present=False, **kw)
+        yield batch.coalesce(
+            system.end_remount(_OVERLAYS, "rw", **kw),
+            files.directory(tmp, present=False, **kw),
+        )
 
 
 @operation
 def uninstall(packages, state=None, host=None):
     """Uninstall RPM package from target host.
 
+    All packages are removed in a single dnf transaction. Packages that
+    are not installed are skipped.
+
     Paramaters:
         packages: A list of paths or urls to RPM packages. The package
             name is extracted from the given paths/urls, which is then
@@ -68,14 +106,67 @@ def uninstall(packages, state=None, host=None):
     """
     kw = {"state": state, "host": host}
 
-    yield system.remount(_OVERLAYS, "rw", **kw)
+    names = {package: _get_name_from_rpm_path(package) for package in packages}
+    if invalid := [package for package, name in names.items() if name is None]:
+        raise OperationError(
+            f"cannot get package name from: {', '.join(map(str, invalid))}"
+        )
+
+    installed = host.get_fact(RpmPackages)
+    changes = _package_changes(state, host)
+    names = [
+        name for name in sorted(set(names.values()))
+        if name in installed or changes.get(name) == "installed"
+    ]
+    if not names:
+        return
+    for name in names:
+        changes[name] = "removed"
+
+    yield system.begin_remount(_OVERLAYS, "rw", **kw)
 
     try:
-        for package in packages:
-            name = _get_name_from_rpm_path(package)
-            yield dnf.packages(name, present=False, **kw)
+        yield StringCommand("dnf", "remove", "-y", *[QuoteString(n) for n in names])
+        yield system.invalidate_facts(fact_cache.PACKAGE_FACTS, **kw)
     finally:
-        yield system.remount(_OVERLAYS, "ro", **kw)
+        yield system.end_remount(_OVERLAYS, "rw", **kw)
+
+
+def _install_command(paths):
+    # Only pass packages to rpm that are not installed yet, rpm fails when
+    # all packages in a transaction are installed already.
+    return StringCommand(
+        "set --; for f in", *[QuoteString(p) for p in paths], "; do",
+        'rpm -q "$(rpm -qp "$f")" >/dev/null 2>&1 || set -- "$@" "$f";',
+        "done;",
+        '[ $# -eq 0 ] || rpm -Uvh "$@"',
+    )
+
+
+def _get_nevra(package):
+    """Return the NEVRA of a package, or None when it's unknown.
+
+    It's read from the header of local files, and from the file name of
+    URLs.
+    """
+    if urlparse(package).scheme in ["http", "https"]:
+        match = _RE_RPM_FILENAME.match(urlparse(package).path)
+        if not match:
+            return None
+        (_, name, version, release, arch) = match.groups()
+        return Nevra(name, None, version, release, arch)
+
+    try:
+        return read_nevra(package)
+    except (OSError, ValueError) as e:
+        raise OperationError(f"cannot read RPM package {package}: {e}")
+
+
+def _package_changes(state, host):
+    """Packages that are "installed" or "removed" earlier in the deploy,
+    by name."""
+    changes = state.__dict__.setdefault("_horus_package_changes", {})
+    return changes.setdefault(host, {})
 
 
 def _get_name_from_rpm_path(package_path):
@@ -20,9 +20,10 @@
 
 
 import json
+import posixpath
+import re
 import subprocess
 from datetime import datetime, date, time
-from time import sleep
 from typing import List
 from urllib.parse import urlparse
 
@@ -33,58 +34,289 @@ from pyinfra.api import (
     StringCommand,
 )
 from pyinfra.api.connectors.util import remove_any_sudo_askpass_file
+from pyinfra.api.operation_kwargs import get_executor_kwarg_keys
+from pyinfra.facts.files import Sha256File
 from pyinfra.operations import files, server
 
+from .. import (
+    distribute as _distribute,
+    fact_cache,
+    reconnect as _reconnect,
+    staging as _staging,
+    transfer as _transfer,
+)
+from ..facts import StagedFile
+from . import batch
+
 
 @operation
 def remount(paths, mode, state=None, host=None):
     """Remount mount points in rw or ro mode.
 
+    All mount points are remounted in a single round trip.
+
     Parameters:
         paths: A list of paths to moint points.
         mode: rw (read-write) or ro (read-only).
     """
-    for path in paths:
-        yield server.mount(
+    yield _invalidate_facts_command(fact_cache.MOUNT_FACTS)
+    yield batch.coalesce(
+        server.mount(
             path,
             mounted=True,
             options=["remount", mode],
             state=state,
             host=host,
         )
+        for path in paths
+    )
+
+
+_OPPOSITE_MODES = {"rw": "ro", "ro": "rw"}
+
+
+@operation
+def begin_remount(paths, mode="rw", state=None, host=None):
+    """Remount mount points until the matching ``end_remount``.
+
+    Mount points are only remounted by the outermost ``begin_remount``,
+    and remounted in the opposite mode by the outermost ``end_remount``.
+    The ``package`` operations use these too, so a deploy script that
+    installs and uninstalls several packages only remounts once:
+
+    .. code:: python
+
+        system.begin_remount(["/lib", "/usr"], "rw")
+        package.install(["htop-2.2.0-r0.aarch64.rpm"])
+        package.uninstall(["nano-5.0-r0.aarch64.rpm"])
+        system.end_remount(["/lib", "/usr"], "rw")
+
+    Parameters:
+        paths: A list of paths to mount points.
+        mode: rw (read-write) or ro (read-only).
+    """
+    depth = _remount_depth(state, host)
+    first = [p for p in paths if depth.get(p, 0) == 0]
+    for path in paths:
+        depth[path] = depth.get(path, 0) + 1
+    if first:
+        yield remount(first, mode, state=state, host=host)
+
+
+@operation
+def end_remount(paths, mode="rw", state=None, host=None):
+    """End a ``begin_remount`` with the same parameters."""
+    depth = _remount_depth(state, host)
+    if any(depth.get(p, 0) == 0 for p in paths):
+        raise OperationError(f"end_remount of {paths} without begin_remount")
+
+    last = []
+    for path in paths:
+        depth[path] -= 1
+        if depth[path] == 0:
+            last.append(path)
+    if last:
+        yield remount(last, _OPPOSITE_MODES[mode], state=state, host=host)
+
+
+def _remount_depth(state, host):
+    # Operations are prepared one host at a time, in the order they run,
+    # so the nesting is tracked while preparing.
+    scopes = state.__dict__.setdefault("_horus_remount_scopes", {})
+    return scopes.setdefault(host, {})
 
 
 @operation
-def transfer(src, dest, state=None, host=None):
+def transfer(
+    src,
+    dest,
+    cache=False,
+    compress=None,
+    delta=False,
+    fanout=None,
+    resumable=False,
+    state=None,
+    host=None,
+):
     """Transfer a file to the target host.
 
     Parameters:
         src: A local path or url (HTTP(S)) to a file.
         dest: A destination path on the target host.
+        cache: Keep local files in the artifact cache on the target host
+            and skip the upload when the file is in the cache already.
+            See ``horus_deploy.transfer.put_file``.
+        compress: Compress local files while uploading them, either
+            ``"zstd"`` or ``"gzip"``. Falls back to another method, or to
+            no compression, when the target host can't decompress them.
+        delta: Only send the differences with the file at ``dest`` on the
+            target host, like rsync. Useful for large files that change
+            little between builds.
+        fanout: Upload a local file to at most this many target hosts,
+            which pass it on over HTTP to the other target hosts, each to
+            at most this many. See ``horus_deploy.distribute``.
+        resumable: Continue an interrupted upload of a local file where
+            it stopped, after reconnecting or in a next run.
     """
     kw = {"state": state, "host": host}
     scheme = urlparse(src).scheme
+    _check_compression_method(compress)
+    put_file_kwargs = {"cache": cache, "compress": compress, "delta": delta, "resumable": resumable}
+    executor_kwargs = _executor_kwargs(state)
 
     if scheme in ["http", "https"]:
         yield files.download(src=src, dest=dest, **kw)
+    elif fanout:
+        yield FunctionCommand(
+            _distribute.distribute_file,
+            (src, dest, fanout, state.current_op_hash),
+            {**put_file_kwargs, "executor_kwargs": executor_kwargs},
+        )
+    elif any(put_file_kwargs.values()):
+        yield FunctionCommand(
+            _transfer.put_file,
+            (src, dest),
+            {**put_file_kwargs, "executor_kwargs": executor_kwargs},
+        )
     else:
         yield files.put(src=src, dest=dest, **kw)
 
 
+@operation
+def transfer_many(
+    transfers,
+    max_concurrency=4,
+    cache=False,
+    compress=None,
+    delta=False,
+    resumable=False,
+    state=None,
+    host=None,
+):
+    """Transfer multiple files to the target host concurrently.
+
+    Local files are uploaded concurrently, each over its own SFTP
+    channels, all multiplexed over the one SSH connection to the host.
+    URLs are downloaded by the target host in a single round trip.
+
+    Parameters:
+        transfers: A list of (src, dest) tuples. See ``transfer``.
+        max_concurrency: Maximum number of concurrent uploads.
+        cache: Use the artifact cache on the target host. See ``transfer``.
+        compress: Compress local files while uploading. See ``transfer``.
+        delta: Only send the differences of local files. See ``transfer``.
+        resumable: Continue interrupted uploads. See ``transfer``.
+    """
+    kw = {"state": state, "host": host}
+    _check_compression_method(compress)
+    executor_kwargs = _executor_kwargs(state)
+    uploads = []
+    downloads = []
+
+    for src, dest in transfers:
+        if urlparse(src).scheme in ["http", "https"]:
+            downloads.append(files.download(src=src, dest=dest, **kw))
+        else:
+            uploads.append((src, dest))
+
+    if uploads:
+        yield FunctionCommand(
+            _transfer.put_files,
+            (uploads, max_concurrency),
+            {
+                "cache": cache,
+                "compress": compress,
+                "delta": delta,
+                "resumable": resumable,
+                "executor_kwargs": executor_kwargs,
+            },
+        )
+    yield batch.coalesce(downloads)
+
+
+@operation
+def stage(src, dest=None, sha256=None, rate_limit=None, state=None, host=None):
+    """Stage a file on the target host ahead of time.
+
+    URLs are downloaded by the target host in the background, so the
+    operation returns right away and the download continues after the
+    deploy. Run it again to check on, or to resume, the download. Local
+    files are uploaded with ``transfer(resumable=True)``, unless the
+    file at ``dest`` is the same. A checksum file records the digest and
+    the source of the staged file, see ``horus_deploy.staging``.
+
+    Parameters:
+        src: A local path or url (HTTP(S)) to a file.
+        dest: A destination path on the target host. Defaults to
+            ``horus_deploy.staging.staged_path(src)``.
+        sha256: Expected SHA-256 digest of the file. A downloaded file
+            with another digest is removed instead of staged.
+        rate_limit: Maximum bandwidth, in bytes per second or with a
+            ``K``, ``M``, or ``G`` suffix (e.g. ``"2M"``).
+    """
+    dest = dest or _staging.staged_path(src)
+    executor_kwargs = _executor_kwargs(state)
+    if sha256 is not None and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        raise OperationError(f"sha256 is not a SHA-256 digest: {sha256!r}")
+    try:
+        rate_limit = _staging.parse_rate(rate_limit) if rate_limit else None
+    except ValueError as e:
+        raise OperationError(str(e))
+
+    if urlparse(src).scheme in ["http", "https"]:
+        yield _staging.stage_command(src, dest, sha256, rate_limit)
+        return
+
+    digest = _transfer.sha256_file(src)
+    if sha256 is not None and sha256 != digest:
+        raise OperationError(f"{src} doesn't have SHA-256 digest {sha256}")
+    if _staging.is_staged(host.get_fact(StagedFile, path=dest), src, digest):
+        return
+    if host.get_fact(Sha256File, path=dest) != digest:
+        yield files.directory(posixpath.dirname(dest), state=state, host=host)
+        yield FunctionCommand(
+            _transfer.put_file,
+            (src, dest),
+            {"resumable": True, "rate_limit": rate_limit, "executor_kwargs": executor_kwargs},
+        )
+    yield _staging.checksum_command(dest, src, digest)
+
+
+def _executor_kwargs(state):
+    # Function commands don't receive the operation's executor arguments
+    # (sudo, su_user, ...), so they're passed along explicitly. Read them
+    # before yielding other operations, which reset them.
+    global_kwargs = state.current_op_global_kwargs or {}
+    return {
+        key: value
+        for key, value in global_kwargs.items()
+        if key in get_executor_kwarg_keys()
+    }
+
+
+def _check_compression_method(method):
+    if method is not None and method not in _transfer.COMPRESSION_METHODS:
+        raise OperationError(
+            f"compress must be one of {list(_transfer.COMPRESSION_METHODS)}, "
+            f"not {method!r}"
+        )
+
+
 # NOTE: Based on pyinfra.operations.server.reboot.
 @operation(is_idempotent=False)
 def reboot(delay=10, interval=1, reboot_timeout=300, state=None, host=None):
     """
     Reboot the server and wait for reconnection.
 
-    When using a Zeroconf server name (e.g. ``imx6qdl-variscite-som-4F2D7-2.local.``)
-    this operation resolves it to an IP address on each connect attempt.
-    This allows for devices changing their IP address (e.g. changed network
-    configuration) and still reconnect and continue the deploy script.
+    The host is reconnected as soon as its SSH port opens. When the host
+    has a Zeroconf server name (e.g. ``imx6qdl-variscite-som-4F2D7-2.local.``)
+    or hardware ID, its announcements are watched, so a host that comes
+    back with another IP address (e.g. changed network configuration) is
+    found as well. See ``horus_deploy.reconnect``.
 
     Parameters:
-        delay: Number of seconds to wait before attempting reconnect.
-        interval: Interval (s) between reconnect attempts.
+        delay: Maximum number of seconds to wait for the host to go down.
+        interval: Maximum interval (s) between reconnect attempts.
         reboot_timeout: Total time before giving up reconnecting.
 
     Example:
@@ -110,37 +342,38 @@ def reboot(delay=10, interval=1, reboot_timeout=300, state=None, host=None):
     )  # -1 being error/disconnected
 
     def wait_and_reconnect(state, host):  # pragma: no cover
-        sleep(delay)
-        max_retries = round(reboot_timeout / interval)
         server_name = host.data.zeroconf_server_name
-
-        host.connection = None  # remove the connection object
-        retries = 0
-
-        while True:
-            if server_name:
-                addrs = _resolve(server_name)
-            else:
-                addrs = [host.data.ssh_hostname or host.name]
-
-            if _try_to_connect(host, addrs):
-                break
-
-            if retries > max_retries:
-                raise Exception(
-                    ("Server did not reboot in time (reboot_timeout={0}s)").format(
-                        reboot_timeout
-                    )
+        names = [server_name, host.data.hardware_id]
+
+        watcher = _reconnect.watcher_for(state)
+        with _reconnect.Announcements(host.name, names, watcher) as announcements:
+            _reconnect.wait_until_down(host, delay)
+            host.connection = None  # remove the connection object
+            reconnected = _reconnect.wait_for_host(
+                [host.data.ssh_hostname or host.name],
+                lambda addrs: _try_to_connect(host, addrs),
+                announcements,
+                reboot_timeout,
+                interval,
+                resolve=(lambda: _resolve(server_name)) if server_name else None,
+            )
+
+        if not reconnected:
+            raise Exception(
+                ("Server did not reboot in time (reboot_timeout={0}s)").format(
+                    reboot_timeout
                 )
-
-            sleep(interval)
-            retries += 1
+            )
 
     yield FunctionCommand(wait_and_reconnect, (), {})
+    yield _invalidate_facts_command()
 
 
 def _try_to_connect(host, addrs):
-    for addr in addrs:
+    # A full connect (key exchange, authentication) takes seconds and logs
+    # errors while the host boots, so first check which addresses have an
+    # SSH server.
+    for addr in _reconnect.ready_addrs(addrs, host.data.ssh_port or 22):
         host.name = addr
         host.data.ssh_hostname = addr
         host.connect(show_errors=False)
@@ -173,6 +406,28 @@ def _resolve(name: str) -> List[str]:
     return data
 
 
+@operation(is_idempotent=False)
+def invalidate_facts(names=None, state=None, host=None):
+    """Invalidate facts that are cached across runs.
+
+    Use this after commands that change the state of the host in ways
+    horus-deploy's operations don't know about, e.g. installing a
+    Mender artifact.
+
+    Parameters:
+        names: A list of fact names (e.g. ``["mounts"]``). All cached
+            facts are invalidated when omitted.
+    """
+    yield _invalidate_facts_command(names)
+
+
+def _invalidate_facts_command(names=None):
+    def invalidate_facts(state, host):
+        fact_cache.invalidate(host, names)
+
+    return FunctionCommand(invalidate_facts, (), {})
+
+
 @operation
 def set_time(date_and_or_time, state=None, host=None):
     if isinstance(date_and_or_time, str):
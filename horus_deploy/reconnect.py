@@ -0,0 +1,258 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Reconnect to hosts after a reboot.
+
+Instead of waiting a fixed time, ``wait_for_host`` tries to connect to a
+host with a short, growing interval, and immediately when the host
+announces itself over zeroconf. ``ready_addrs`` checks cheaply whether
+an SSH server is up, before connecting. Like the functions in
+``horus_deploy.transfer``, these run inside ``FunctionCommand``
+callbacks.
+
+All hosts that reboot in a pyinfra run share a single ``Watcher``, so
+rebooting many hosts doesn't start a zeroconf browser per host.
+"""
+
+import json
+import logging
+import random
+import statistics
+from time import monotonic
+from typing import Callable, List, Optional, Set
+
+import gevent
+from gevent import socket, subprocess
+from gevent.event import Event
+from gevent.pool import Group
+
+from .host import Host, matches
+
+
+logger = logging.getLogger(__name__)
+
+
+PROBE_TIMEOUT = 1.0
+
+_MIN_INTERVAL = 0.1
+_WATCH_COMMAND = ["horus-deploy", "watch", "--output-json"]
+_REPORT_INTERVAL = 30
+# Hosts that take this many times the median time of the hosts that are
+# back are reported as stragglers.
+_STRAGGLER_FACTOR = 2
+
+
+class Watcher:
+    """Zeroconf announcements of all rebooting hosts.
+
+    Zeroconf runs in a ``horus-deploy watch`` subprocess, because it
+    doesn't work with the gevent used by pyinfra (see
+    ``horus_deploy.operations.system._resolve``). The subprocess runs
+    while hosts with names are watched. Every ``_REPORT_INTERVAL``
+    seconds, hosts that take much longer than the others to come back
+    are logged.
+    """
+
+    def __init__(self):
+        self.durations: List[float] = []
+        self._watched: Set["Announcements"] = set()
+        self._process = None
+        self._reader: Optional[gevent.Greenlet] = None
+        self._reporter: Optional[gevent.Greenlet] = None
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def watch(self, announcements: "Announcements"):
+        self._watched.add(announcements)
+        if not self._reporter:
+            self._reporter = gevent.spawn(self._report)
+        if announcements.names and not self.running:
+            self._start()
+
+    def unwatch(self, announcements: "Announcements"):
+        self._watched.discard(announcements)
+        if announcements.returned:
+            self.durations.append(monotonic() - announcements.started)
+        if not self._watched:
+            self._stop()
+
+    def stragglers(self) -> List["Announcements"]:
+        if not self.durations:
+            return []
+        limit = _STRAGGLER_FACTOR * statistics.median(self.durations)
+        now = monotonic()
+        return [a for a in self._watched if now - a.started > limit]
+
+    def _start(self):
+        try:
+            self._process = subprocess.Popen(
+                _WATCH_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            logger.warning(f"cannot watch zeroconf announcements: {e}")
+            return
+        self._reader = gevent.spawn(self._read)
+
+    def _stop(self):
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+        gevent.killall([g for g in [self._reader, self._reporter] if g])
+        self._reader = self._reporter = None
+
+    def _read(self):
+        for line in self._process.stdout:
+            try:
+                data = json.loads(line)
+                host = Host.from_str(
+                    data["name"], data["addrs"], props={"hardware_id": data["hardware_id"]}
+                )
+            except (ValueError, KeyError):
+                continue
+            for announcements in list(self._watched):
+                if any(matches(host, name) for name in announcements.names):
+                    announcements.announce(data["addrs"])
+
+    def _report(self):
+        while True:
+            gevent.sleep(_REPORT_INTERVAL)
+            if stragglers := self.stragglers():
+                names = ", ".join(sorted(a.label for a in stragglers))
+                logger.warning(
+                    f"reboot: {len(stragglers)} hosts are not back after "
+                    f"{_STRAGGLER_FACTOR}x the median time of {len(self.durations)} "
+                    f"other hosts: {names}"
+                )
+
+
+def watcher_for(state) -> Watcher:
+    """Return the ``Watcher`` shared by all hosts of a pyinfra run."""
+    return state.__dict__.setdefault("_horus_reboot_watcher", Watcher())
+
+
+class Announcements:
+    """Addresses that a host announces over zeroconf, under any of
+    ``names`` (zeroconf server names or hardware IDs)."""
+
+    def __init__(self, label: str, names: List[str], watcher: Watcher):
+        self.label = label
+        self.names = [n for n in names if n]
+        self.addrs: List[str] = []
+        self.started = monotonic()
+        self.returned = False
+        self._watcher = watcher
+        self._announced = Event()
+
+    def __enter__(self):
+        self.started = monotonic()
+        self._watcher.watch(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._watcher.unwatch(self)
+
+    @property
+    def watching(self) -> bool:
+        return bool(self.names) and self._watcher.running
+
+    def announce(self, addrs: List[str]):
+        logger.debug(f"reconnect: {self.label} announced {addrs}")
+        self.addrs = addrs
+        self._announced.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait at most ``timeout`` seconds for an announcement.
+
+        Returns whether there was one.
+        """
+        announced = self._announced.wait(timeout)
+        self._announced.clear()
+        return announced
+
+
+def wait_until_down(host, timeout: float):
+    """Wait until the connection to a rebooting host is closed, at most
+    ``timeout`` seconds."""
+    transport = host.connection and host.connection.get_transport()
+    deadline = monotonic() + timeout
+    while transport and transport.is_active() and monotonic() < deadline:
+        gevent.sleep(_MIN_INTERVAL)
+
+
+def wait_for_host(
+    addrs: List[str],
+    connect: Callable[[List[str]], bool],
+    announcements: Announcements,
+    timeout: float,
+    max_interval: float,
+    resolve: Optional[Callable[[], List[str]]] = None,
+) -> bool:
+    """Call ``connect`` with announced addresses and ``addrs`` until it
+    succeeds.
+
+    The interval between attempts grows exponentially, with jitter, up to
+    ``max_interval``, and starts over after an announcement. When
+    announcements aren't watched, ``resolve`` is called before each
+    attempt to look up the addresses instead. Returns False after
+    ``timeout`` seconds.
+    """
+    deadline = monotonic() + timeout
+    interval = _MIN_INTERVAL
+
+    while monotonic() < deadline:
+        if resolve and not announcements.watching:
+            addrs = resolve() or addrs
+        if connect(announcements.addrs + [a for a in addrs if a not in announcements.addrs]):
+            announcements.returned = True
+            return True
+
+        # Jitter keeps hosts that were rebooted together from probing in
+        # lockstep.
+        wait = random.uniform(interval / 2, interval)
+        if announcements.wait(min(wait, max(0, deadline - monotonic()))):
+            interval = _MIN_INTERVAL
+        else:
+            interval = min(interval * 2, max_interval)
+
+    return False
+
+
+def ready_addrs(addrs: List[str], port: int) -> List[str]:
+    """Return the addresses where an SSH server listens on ``port``.
+
+    The addresses are probed concurrently by connecting and reading the
+    SSH banner, without key exchange or authentication.
+    """
+    results = Group().map(lambda addr: _has_ssh_banner(addr, port), addrs)
+    return [addr for addr, ready in zip(addrs, results) if ready]
+
+
+def _has_ssh_banner(addr: str, port: int) -> bool:
+    try:
+        with socket.create_connection((addr, port), timeout=PROBE_TIMEOUT) as sock:
+            # The server may send other lines before its identification.
+            data = sock.recv(1024)
+    except OSError:
+        return False
+    return data.startswith(b"SSH-") or b"\nSSH-" in data
@@ -0,0 +1,115 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Read package information from RPM files without the rpm library."""
+
+import struct
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+
+_LEAD_SIZE = 96
+_LEAD_MAGIC = b"\xed\xab\xee\xdb"
+_HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+
+_TAG_NAME = 1000
+_TAG_VERSION = 1001
+_TAG_RELEASE = 1002
+_TAG_EPOCH = 1003
+_TAG_ARCH = 1022
+
+_TYPE_INT32 = 4
+_TYPE_STRING = 6
+
+
+@dataclass(frozen=True)
+class Nevra:
+    name: str
+    epoch: Optional[int]
+    version: str
+    release: str
+    arch: str
+
+    def __str__(self):
+        # The format `rpm -q` accepts and prints by default.
+        return f"{self.name}-{self.version}-{self.release}.{self.arch}"
+
+
+def read_nevra(path) -> Nevra:
+    """Read the name, epoch, version, release, and architecture of an
+    RPM package from its header.
+
+    Raises ``ValueError`` when the file is not an RPM package.
+    """
+    with open(path, "rb") as fd:
+        lead = fd.read(_LEAD_SIZE)
+        if len(lead) != _LEAD_SIZE or not lead.startswith(_LEAD_MAGIC):
+            raise ValueError(f"{path} is not an RPM package")
+
+        # The signature header is padded to a multiple of 8 bytes.
+        size = _read_header(fd, path)[2]
+        fd.seek((8 - size % 8) % 8, 1)
+
+        index, store, _ = _read_header(fd, path)
+
+    def get(tag, default=None):
+        try:
+            typ, offset = index[tag]
+        except KeyError:
+            if default is not None:
+                return default
+            raise ValueError(f"{path} has no tag {tag}")
+        if typ == _TYPE_INT32:
+            return struct.unpack_from(">i", store, offset)[0]
+        end = store.index(b"\0", offset)
+        return store[offset:end].decode("utf-8")
+
+    epoch = get(_TAG_EPOCH, default=-1)
+    return Nevra(
+        name=get(_TAG_NAME),
+        epoch=None if epoch == -1 else epoch,
+        version=get(_TAG_VERSION),
+        release=get(_TAG_RELEASE),
+        arch=get(_TAG_ARCH),
+    )
+
+
+def _read_header(fd, path) -> Tuple[Dict[int, Tuple[int, int]], bytes, int]:
+    """Read a header structure.
+
+    Returns the index (tag -> (type, offset)), the data store, and the
+    size of the structure.
+    """
+    intro = fd.read(16)
+    if len(intro) != 16 or not intro.startswith(_HEADER_MAGIC):
+        raise ValueError(f"{path} has no valid RPM header")
+    count, store_size = struct.unpack(">II", intro[8:])
+
+    entries = fd.read(16 * count)
+    store = fd.read(store_size)
+    if len(entries) != 16 * count or len(store) != store_size:
+        raise ValueError(f"{path} is truncated")
+
+    index = {}
+    for tag, typ, offset, _ in struct.iter_unpack(">IIII", entries):
+        if typ in (_TYPE_INT32, _TYPE_STRING):
+            index[tag] = (typ, offset)
+
+    return index, store, 16 + len(entries) + store_size
@@ -0,0 +1,178 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Stage files on hosts ahead of time.
+
+Large files, like Mender artifacts, can be put on a host before a
+maintenance window, so only installing them happens during the window.
+URLs are downloaded by the host in the background, so the download
+continues after horus-deploy is done. Interrupted downloads are resumed
+by a next attempt, or by staging the file again.
+
+A staged file is named after a hash of its source, and comes with a
+``<path>.sha256`` file with its SHA-256 digest and its source on two
+lines. A staged file is only used when both match, see ``is_staged``.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shlex
+from typing import Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from pyinfra.api import QuoteString, StringCommand
+
+from .facts import StagedFile
+from .transfer import sha256_file
+
+
+logger = logging.getLogger(__name__)
+
+
+STAGE_DIR = "/data/horus-deploy/staged"
+
+DOWNLOAD_ATTEMPTS = 10
+_RETRY_DELAY = 30
+
+_RE_RATE = re.compile(r"(\d+)([KMG]?)", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def staged_path(src: str) -> str:
+    """Return where a local file or URL is staged on the host.
+
+    The file name is kept, behind a hash of ``src``, so files with the
+    same name from different sources don't replace each other.
+    """
+    key = hashlib.sha256(src.encode()).hexdigest()[:16]
+    return f"{STAGE_DIR}/{key}-{os.path.basename(urlparse(src).path)}"
+
+
+def staged_file(host, src: str, digest: Optional[str] = None) -> Optional[str]:
+    """Return the path of the staged file of ``src`` on the host, or None
+    when it isn't staged.
+
+    A staged file with another source or digest is ignored, with a
+    warning. The digest of a local file is computed when it isn't given.
+    """
+    path = staged_path(src)
+    staged = host.get_fact(StagedFile, path=path)
+    if staged is None:
+        return None
+    if digest is None and urlparse(src).scheme not in ["http", "https"] and os.path.isfile(src):
+        digest = sha256_file(src)
+    if not is_staged(staged, src, digest):
+        logger.warning(f"{host}: ignoring {path}, it isn't the staged file of {src}")
+        return None
+    return path
+
+
+def checksum_path(path: str) -> str:
+    """Return the path of the file with the digest and source of a staged file."""
+    return f"{path}.sha256"
+
+
+def is_staged(staged: Optional[Tuple[str, str]], src: str, digest: Optional[str]) -> bool:
+    """Whether a staged file, as returned by the ``StagedFile`` fact, is
+    the file of ``src`` with SHA-256 ``digest`` (if given)."""
+    if staged is None:
+        return False
+    staged_digest, staged_src = staged
+    return staged_src == src and digest in (None, staged_digest)
+
+
+def checksum_command(path: str, src: str, digest: str) -> StringCommand:
+    """Write the checksum file of a staged file."""
+    return StringCommand(
+        "printf '%s\\n%s\\n'", QuoteString(digest), QuoteString(src),
+        ">", QuoteString(checksum_path(path)),
+    )
+
+
+def parse_rate(value: Union[int, str]) -> int:
+    """Parse a bandwidth like ``500K`` or ``2M`` to bytes per second."""
+    match = _RE_RATE.fullmatch(str(value).strip())
+    if not match:
+        raise ValueError(f"invalid bandwidth: {value!r}")
+    return int(match.group(1)) * _RATE_UNITS[match.group(2).lower()]
+
+
+def stage_command(url: str, dest: str, digest: Optional[str] = None, rate_limit=None):
+    """Download a URL to ``dest`` in the background.
+
+    Prints ``done`` when ``dest`` is the staged file of ``url`` with
+    SHA-256 ``digest`` (if given), ``running`` when the download is in
+    progress, and ``started`` otherwise. Another file at ``dest`` is
+    removed. The download is written to ``<dest>.part``, resumed after
+    errors, and moved to ``dest`` when its digest matches. The output of
+    the last attempt is kept in ``<dest>.log``.
+    """
+    pid_file = f"{dest}.pid"
+    log_file = f"{dest}.log"
+    checksum_file = checksum_path(dest)
+    staged = [
+        "[ -f", QuoteString(dest), "] &&",
+        "[ \"$(sed -n 2p", QuoteString(checksum_file), "2>/dev/null)\" =", QuoteString(url), "]",
+    ]
+    if digest:
+        staged += [
+            "&& [ \"$(sed -n 1p", QuoteString(checksum_file), ")\" =", QuoteString(digest), "]",
+        ]
+    return StringCommand(
+        "if", *staged, "; then echo done;",
+        "elif kill -0 \"$(cat", QuoteString(pid_file), "2>/dev/null)\" 2>/dev/null;",
+        "then echo running;",
+        "else rm -f", QuoteString(dest), QuoteString(checksum_file), "&&",
+        "mkdir -p", QuoteString(os.path.dirname(dest)), "&&",
+        "{ nohup sh -c", QuoteString(_download_script(url, dest, digest, rate_limit)),
+        ">", QuoteString(log_file), "2>&1 </dev/null & echo $! >", QuoteString(pid_file), "; }",
+        "&& echo started; fi",
+    )
+
+
+def _download_script(url, dest, digest, rate_limit):
+    q_url = shlex.quote(url)
+    q_part = shlex.quote(f"{dest}.part")
+    q_dest = shlex.quote(dest)
+    q_checksum = shlex.quote(checksum_path(dest))
+    curl_limit = f"--limit-rate {rate_limit}" if rate_limit else ""
+    wget_limit = f"--limit-rate={rate_limit}" if rate_limit else ""
+
+    script = (
+        "n=0; "
+        "if command -v curl >/dev/null 2>&1; "
+        f"then set -- curl -fsS -C - {curl_limit} -o {q_part} {q_url}; "
+        f"else set -- wget -q -c {wget_limit} -O {q_part} {q_url}; fi; "
+        'until "$@"; do '
+        f"n=$((n + 1)); [ $n -lt {DOWNLOAD_ATTEMPTS} ] || exit 1; sleep {_RETRY_DELAY}; "
+        "done; "
+    )
+    script += f'digest=$(sha256sum < {q_part} | cut -d " " -f 1); '
+    if digest:
+        script += (
+            f'[ "$digest" = {digest} ] '
+            f"|| {{ echo checksum mismatch; rm -f {q_part}; exit 1; }}; "
+        )
+    return script + (
+        f"printf '%s\\n%s\\n' \"$digest\" {q_url} > {q_checksum} && mv {q_part} {q_dest}"
+    )
@@ -0,0 +1,637 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Transfer files to hosts.
+
+The functions in this module run while operations execute, i.e. inside
+``FunctionCommand`` callbacks of the operations in
+``horus_deploy.operations.system``. They take pyinfra's ``state`` and
+``host`` as their first arguments and return ``True`` on success.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from gevent import sleep
+from gevent.pool import Pool
+from paramiko import SFTPClient, SSHException
+from pyinfra.api import QuoteString, StringCommand
+
+from . import delta as _delta
+from ._config import user_config_dir
+
+
+logger = logging.getLogger(__name__)
+
+
+ARTIFACT_CACHE_DIR = "/data/horus-deploy/artifacts"
+ARTIFACT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+ARTIFACT_CACHE_MAX_AGE_DAYS = 30
+
+RESUME_CHUNK_SIZE = 4 * 1024 * 1024
+RESUME_ATTEMPTS = 5
+
+SFTP_STREAMS = 4
+SFTP_WINDOW_SIZE = 16 * 1024 * 1024
+
+_HASH_CACHE_PATH = user_config_dir() / "sha256_cache.json"
+_HASH_CACHE_MAX_ENTRIES = 1000
+_CHUNK_SIZE = 1024 * 1024
+_RESUME_RETRY_DELAY = 5
+# Files are only split into ranges of at least this size, smaller files
+# don't gain from extra channels.
+_SFTP_MIN_RANGE_SIZE = 16 * 1024 * 1024
+
+# Compression methods in order of preference, with the command that
+# decompresses stdin on the host.
+COMPRESSION_METHODS = {
+    "zstd": "zstd -d -q -c",
+    "gzip": "gzip -d -c",
+}
+
+_hash_cache: Dict[str, list] = {}
+
+
+def sha256_file(path) -> str:
+    """Return the SHA-256 hex digest of a local file.
+
+    Digests are cached across runs by path, modification time, and size,
+    so large files are only hashed again after they change.
+    """
+    path = Path(path).resolve()
+    st = path.stat()
+    key = str(path)
+
+    if not _hash_cache and _HASH_CACHE_PATH.exists():
+        try:
+            _hash_cache.update(json.loads(_HASH_CACHE_PATH.read_text()))
+        except ValueError:
+            pass
+
+    entry = _hash_cache.get(key)
+    if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        return entry[2]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        while chunk := fd.read(_CHUNK_SIZE):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    _hash_cache.pop(key, None)
+    _hash_cache[key] = [st.st_mtime_ns, st.st_size, digest]
+    while len(_hash_cache) > _HASH_CACHE_MAX_ENTRIES:
+        del _hash_cache[next(iter(_hash_cache))]
+
+    tmp = _HASH_CACHE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(_hash_cache))
+    os.replace(tmp, _HASH_CACHE_PATH)
+
+    return digest
+
+
+def put_file(
+    state,
+    host,
+    src,
+    dest,
+    cache=False,
+    compress=None,
+    delta=False,
+    resumable=False,
+    rate_limit=None,
+    executor_kwargs=None,
+):
+    """Upload a local file to the host.
+
+    With ``compress`` (one of ``COMPRESSION_METHODS``) the file is
+    compressed while it is streamed to the host and decompressed on the
+    host. Another method, or no compression, is used when the host lacks
+    the decompressor.
+
+    With ``delta`` only the differences with the file that is at ``dest``
+    already are sent. ``rsync`` is used when it is available locally and
+    on the host, and the host is accessed with a key. Otherwise the
+    differences are computed by ``horus_deploy.delta``.
+
+    With ``resumable`` the file is uploaded to ``<dest>.part``, without
+    compression. When the upload is interrupted, the host is reconnected
+    and the upload continues after the last chunk of
+    ``RESUME_CHUNK_SIZE`` bytes with the right SHA-256 digest, also when
+    an earlier run was interrupted. At most ``RESUME_ATTEMPTS`` attempts
+    are made. ``rate_limit`` limits resumable uploads to that many bytes
+    per second.
+
+    With ``cache`` the file is stored in the artifact cache on the host
+    (``ARTIFACT_CACHE_DIR``) under its SHA-256 digest, and ``dest`` is a
+    hard link to (or, on another file system, a copy of) the cached file,
+    so it must not be modified in place. Files that are in the cache
+    already are not uploaded again. The cache is kept below
+    ``ARTIFACT_CACHE_MAX_SIZE`` bytes by removing the least recently used
+    files, and files older than ``ARTIFACT_CACHE_MAX_AGE_DAYS`` are
+    removed.
+
+    ``executor_kwargs`` are the pyinfra arguments of the operation that
+    apply to commands, e.g. ``sudo`` and ``su_user``. With ``sudo`` or
+    ``su_user``, the file is uploaded to a temporary path as the SSH user
+    and then moved to ``dest``, like pyinfra's ``files.put`` does.
+    """
+    executor_kwargs = executor_kwargs or {}
+    if not (executor_kwargs.get("sudo") or executor_kwargs.get("su_user")):
+        return _put_file(host, src, dest, cache, compress, delta, resumable, rate_limit)
+
+    # A path derived from dest, so resumable uploads find it again.
+    temp = state.get_temp_filename(dest)
+    return (
+        _put_file(host, src, temp, cache, compress, delta, resumable, rate_limit, basis=dest)
+        and _move_privileged(host, temp, dest, executor_kwargs)
+    )
+
+
+def _put_file(host, src, dest, cache, compress, delta, resumable, rate_limit, basis=None):
+    basis = (basis or dest) if delta else None
+
+    if not cache:
+        return _send(host, src, dest, compress, basis, resumable, rate_limit)
+
+    digest = sha256_file(src)
+
+    status, stdout, _ = host.run_shell_command(
+        cache_lookup_command(ARTIFACT_CACHE_DIR, digest, dest)
+    )
+    if not status:
+        logger.debug(f"put_file: artifact cache unavailable on {host}, uploading")
+        return _send(host, src, dest, compress, basis, resumable, rate_limit)
+    if stdout and stdout[-1] == "hit":
+        logger.debug(f"put_file: {src} found in artifact cache on {host}")
+        return True
+
+    part = f"{ARTIFACT_CACHE_DIR}/{digest}.part"
+    if not _send(host, src, part, compress, basis, resumable, rate_limit):
+        return False
+
+    status, _, stderr = host.run_shell_command(
+        cache_store_command(ARTIFACT_CACHE_DIR, digest, dest)
+    )
+    if not status:
+        logger.error(f"put_file: cannot store {src} on {host}: {stderr}")
+    return status
+
+
+def _move_privileged(host, temp, dest, executor_kwargs) -> bool:
+    sudo_user = executor_kwargs.get("sudo_user")
+    su_user = executor_kwargs.get("su_user")
+
+    if sudo_user or su_user:
+        # Another user can't move a file out of the sticky temporary
+        # directory, so it's copied.
+        status, _, stderr = host.run_shell_command(StringCommand(
+            "setfacl", "-m", f"u:{su_user or sudo_user}:r", QuoteString(temp),
+        ))
+        if not status:
+            logger.error(f"put_file: cannot hand {temp} over on {host}: {stderr}")
+            return False
+        command = StringCommand("cp", QuoteString(temp), QuoteString(dest))
+    else:
+        command = StringCommand("mv", QuoteString(temp), QuoteString(dest))
+
+    status, _, stderr = host.run_shell_command(command, **executor_kwargs)
+    host.run_shell_command(StringCommand("rm", "-f", QuoteString(temp)))
+    if not status:
+        logger.error(f"put_file: cannot move {temp} to {dest} on {host}: {stderr}")
+    return status
+
+
+def put_files(state, host, uploads, max_concurrency, **kwargs):
+    """Upload a list of (src, dest) tuples concurrently.
+
+    Each upload opens its own SFTP sessions on the host's SSH connection.
+    The keyword arguments are passed to ``put_file``.
+    """
+    pool = Pool(max_concurrency)
+    greenlets = [
+        pool.spawn(put_file, state, host, src, dest, **kwargs)
+        for src, dest in uploads
+    ]
+    pool.join()
+
+    status = True
+
+    for (src, dest), greenlet in zip(uploads, greenlets):
+        if not greenlet.successful() or greenlet.value is False:
+            logger.error(f"put_files: upload to {host} failed: {src} -> {dest}")
+            status = False
+
+    return status
+
+
+def compressed_chunks(path, method: str) -> Iterator[bytes]:
+    """Read and compress a local file in chunks."""
+    if method == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(path, "rb") as fd:
+            while chunk := fd.read(_CHUNK_SIZE):
+                if data := compressor.compress(chunk):
+                    yield data
+        yield compressor.flush()
+    elif method == "zstd":
+        with subprocess.Popen(
+            ["zstd", "-q", "-c", str(path)], stdout=subprocess.PIPE
+        ) as p:
+            assert p.stdout is not None
+            while chunk := p.stdout.read(_CHUNK_SIZE):
+                yield chunk
+            if p.wait() != 0:
+                raise IOError(f"zstd failed to compress {path}: exit status {p.returncode}")
+    else:
+        raise ValueError(f"unknown compression method: {method!r}")
+
+
+def _send(host, src, dest, compress=None, basis=None, resumable=False, rate_limit=None):
+    if basis is not None:
+        status = _rsync(host, src, dest, basis, compress)
+        if status is None:
+            status = _delta_upload(host, src, dest, basis, compress)
+        if status is not None:
+            return status
+
+    return _upload(host, src, dest, compress, resumable, rate_limit)
+
+
+def _upload(host, src, dest, compress=None, resumable=False, rate_limit=None):
+    if resumable:
+        return _resumable_upload(host, src, dest, rate_limit)
+
+    method = _select_compression_method(host, compress) if compress else None
+    if not method:
+        return sftp_put(host, src, dest)
+
+    logger.debug(f"put_file: uploading {src} to {host} with {method} compression")
+
+    q_dest = shlex.quote(dest)
+    q_part = shlex.quote(f"{dest}.part")
+    command = f"{COMPRESSION_METHODS[method]} > {q_part} && mv {q_part} {q_dest}"
+
+    exit_status, stderr = _exec(host, command, compressed_chunks(src, method))
+    if exit_status != 0:
+        logger.error(f"put_file: decompressing {dest} on {host} failed: {stderr}")
+        return False
+
+    return True
+
+
+def _rsync(host, src, dest, basis, compress):
+    """Upload with rsync, using ``basis`` as the old version of ``dest``.
+
+    Returns None when rsync can't be used.
+    """
+    try:
+        host.check_can_rsync()
+    except NotImplementedError:
+        return None
+    if not _has_command(host, "rsync"):
+        return None
+
+    if basis != dest:
+        # rsync replaces dest instead of writing to it, so basis is kept.
+        host.run_shell_command(StringCommand(
+            "[ ! -f", QuoteString(basis), "] ||", _link(basis, dest),
+        ))
+
+    flags = ["--ignore-times"]
+    if compress:
+        flags.append("--compress")
+
+    logger.debug(f"put_file: uploading {src} to {host} with rsync")
+    try:
+        return host.rsync(shlex.quote(str(src)), shlex.quote(dest), flags)
+    except IOError as e:
+        logger.warning(f"put_file: rsync to {host} failed, retrying without: {e}")
+        return None
+
+
+def _delta_upload(host, src, dest, basis, compress):
+    """Upload the differences with ``basis``.
+
+    Returns None when there's no ``basis`` or it differs too much.
+    """
+    size = os.path.getsize(src)
+    block_size = _delta.block_size_for(size)
+
+    status, stdout, _ = host.run_shell_command(
+        _delta.signature_command(basis, block_size)
+    )
+    signature = _delta.parse_signature(stdout, block_size) if status else None
+    if signature is None or size == 0:
+        return None
+
+    with open(src, "rb") as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        ops = _delta.compute_delta(data, signature)
+        if ops is None:
+            logger.debug(f"put_file: {src} differs too much from {basis} on {host}")
+            return None
+
+        literal_size = sum(length for op, _, length in ops if op == "literal")
+        logger.debug(
+            f"put_file: sending {literal_size} of {size} bytes of {src} to {host}"
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            literals_path = os.path.join(tmp, "literals")
+            with open(literals_path, "wb") as literals:
+                for chunk in _delta.literal_chunks(data, ops):
+                    literals.write(chunk)
+
+            literals_dest = f"{dest}.delta"
+            if not _upload(host, literals_path, literals_dest, compress):
+                return False
+
+    script = _delta.apply_script(
+        basis, literals_dest, dest, block_size, ops, sha256_file(src)
+    )
+    exit_status, stderr = _exec(host, "sh -s", [script.encode("utf-8")])
+    if exit_status != 0:
+        logger.error(f"put_file: rebuilding {dest} on {host} failed: {stderr}")
+        return False
+
+    return True
+
+
+def _resumable_upload(host, src, dest, rate_limit=None):
+    part = f"{dest}.part"
+
+    for attempt in range(RESUME_ATTEMPTS):
+        if attempt:
+            sleep(_RESUME_RETRY_DELAY)
+            if not _reconnect(host):
+                continue
+        try:
+            offset = _resume_offset(host, src, part)
+            if offset:
+                logger.info(f"put_file: resuming upload of {src} to {host} at byte {offset}")
+            _write_from(host, src, part, offset, rate_limit)
+            break
+        except (OSError, EOFError, SSHException) as e:
+            logger.warning(f"put_file: upload of {src} to {host} interrupted: {e}")
+    else:
+        logger.error(f"put_file: giving up uploading {src} to {host}")
+        return False
+
+    status, _, _ = host.run_shell_command(StringCommand(
+        '[ "$(sha256sum <', QuoteString(part), '| cut -d " " -f 1)" =', sha256_file(src), "]",
+        "&& mv", QuoteString(part), QuoteString(dest),
+        "|| { rm -f", QuoteString(part), "; false; }",
+    ))
+    if not status:
+        logger.error(f"put_file: checksum of {dest} on {host} doesn't match")
+    return status
+
+
+def _resume_offset(host, src, part) -> int:
+    """Return the size of the part of ``part`` that matches ``src``."""
+    status, stdout, stderr = host.run_shell_command(
+        chunk_digests_command(part, RESUME_CHUNK_SIZE)
+    )
+    if not status:
+        raise IOError(f"cannot check {part}: {stderr}")
+
+    offset = 0
+    with open(src, "rb") as fd:
+        for digest in (line.strip() for line in stdout if line.strip()):
+            chunk = fd.read(RESUME_CHUNK_SIZE)
+            if len(chunk) < RESUME_CHUNK_SIZE or hashlib.sha256(chunk).hexdigest() != digest:
+                break
+            offset += len(chunk)
+    return offset
+
+
+def _write_from(host, src, part, offset, rate_limit=None):
+    sftp = _open_sftp(host.connection.get_transport())
+    started = time.monotonic()
+    written = 0
+    try:
+        with sftp.open(part, "r+b" if offset else "wb") as remote, open(src, "rb") as local:
+            remote.truncate(offset)
+            remote.seek(offset)
+            local.seek(offset)
+            remote.set_pipelined(True)
+            while chunk := local.read(_CHUNK_SIZE):
+                remote.write(chunk)
+                written += len(chunk)
+                if rate_limit:
+                    sleep(max(0, written / rate_limit - (time.monotonic() - started)))
+    finally:
+        sftp.close()
+
+
+def _reconnect(host) -> bool:
+    transport = host.connection and host.connection.get_transport()
+    if transport and transport.is_active():
+        return True
+
+    host.connection = None
+    host.connect(show_errors=False)
+    return host.connection is not None
+
+
+def chunk_digests_command(path, chunk_size):
+    """Print the SHA-256 digests of the complete chunks of a file."""
+    return StringCommand(
+        "[ ! -f", QuoteString(path), "] ||",
+        "{ size=$(stat -c %s", QuoteString(path), ") && i=0 &&",
+        f"while [ $(((i + 1) * {chunk_size})) -le $size ]; do",
+        "dd", QuoteString(f"if={path}"),
+        f"bs={chunk_size} skip=$i count=1 2>/dev/null | sha256sum | cut -d ' ' -f 1;",
+        "i=$((i + 1)); done; }",
+    )
+
+
+def sftp_put(host, src, dest, streams=SFTP_STREAMS) -> bool:
+    """Upload a file over pipelined SFTP channels.
+
+    Files of at least twice ``_SFTP_MIN_RANGE_SIZE`` bytes are split in
+    at most ``streams`` ranges, which are written concurrently, each over
+    its own SFTP session. The sessions are channels on the host's one SSH
+    connection. Writes don't wait for acknowledgements, and the local
+    file is memory-mapped instead of read into buffers.
+    """
+    transport = host.connection.get_transport()
+    size = os.path.getsize(src)
+    count = max(1, min(streams, size // _SFTP_MIN_RANGE_SIZE))
+    bounds = [size * i // count for i in range(count + 1)]
+
+    sftp = _open_sftp(transport)
+    try:
+        sftp.open(dest, "wb").close()
+    finally:
+        sftp.close()
+    if size == 0:
+        return True
+
+    with open(src, "rb") as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        pool = Pool(count)
+        greenlets = [
+            pool.spawn(_write_range, transport, dest, data, start, end)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        pool.join()
+
+    if errors := [g.exception for g in greenlets if not g.successful()]:
+        logger.error(f"put_file: upload of {src} to {host} failed: {errors[0]}")
+        return False
+    return True
+
+
+def _write_range(transport, dest, data, start, end):
+    sftp = _open_sftp(transport)
+    try:
+        with sftp.open(dest, "r+b") as remote:
+            remote.seek(start)
+            remote.set_pipelined(True)
+            for pos in range(start, end, _CHUNK_SIZE):
+                remote.write(data[pos:min(pos + _CHUNK_SIZE, end)])
+    finally:
+        sftp.close()
+
+
+def _open_sftp(transport):
+    # A larger window than paramiko's default (2 MiB) keeps acknowledgements
+    # of pipelined writes flowing on high-latency links.
+    return SFTPClient.from_transport(transport, window_size=SFTP_WINDOW_SIZE)
+
+
+def _exec(host, command, chunks):
+    """Run a command on the host with ``chunks`` as its standard input.
+
+    Returns the exit status and standard error.
+    """
+    channel = host.connection.get_transport().open_session()
+    try:
+        channel.exec_command(command)
+        for chunk in chunks:
+            channel.sendall(chunk)
+        channel.shutdown_write()
+        exit_status = channel.recv_exit_status()
+        stderr = channel.makefile_stderr().read().decode("utf-8", "replace")
+    finally:
+        channel.close()
+
+    return exit_status, stderr
+
+
+def _select_compression_method(host, preferred: str) -> Optional[str]:
+    """Find a compression method that works locally and on the host.
+
+    ``preferred`` is tried first, then the other methods.
+    """
+    methods = [preferred] + [m for m in COMPRESSION_METHODS if m != preferred]
+
+    for method in methods:
+        if method == "zstd" and not shutil.which("zstd"):
+            continue
+        if _has_command(host, method):
+            return method
+
+    return None
+
+
+def _has_command(host, name: str) -> bool:
+    """Check if a command is available on the host.
+
+    Results are remembered for the lifetime of the connection.
+    """
+    available = host.connector_data.setdefault("horus_deploy_commands", {})
+    if name not in available:
+        status, _, _ = host.run_shell_command(
+            StringCommand("command", "-v", name, ">/dev/null")
+        )
+        available[name] = status
+    return available[name]
+
+
+def cache_lookup_command(cache_dir, digest, dest):
+    """Link a cached file to ``dest`` and print ``hit``, or print ``miss``."""
+    cached = f"{cache_dir}/{digest}"
+    return StringCommand(
+        "mkdir", "-p", QuoteString(cache_dir), "&&",
+        "if [ -f", QuoteString(cached), "]; then",
+        "touch", QuoteString(cached), "&&", _link(cached, dest), "&& echo hit;",
+        "else echo miss; fi",
+    )
+
+
+def cache_store_command(
+    cache_dir,
+    digest,
+    dest,
+    max_size=ARTIFACT_CACHE_MAX_SIZE,
+    max_age_days=ARTIFACT_CACHE_MAX_AGE_DAYS,
+):
+    """Verify an uploaded ``<digest>.part`` file, move it into the cache,
+    link it to ``dest``, and evict old files."""
+    cached = f"{cache_dir}/{digest}"
+    part = f"{cached}.part"
+    return StringCommand(
+        '[ "$(sha256sum <', QuoteString(part), '| cut -d " " -f 1)" =', digest, "]",
+        "&& mv", QuoteString(part), QuoteString(cached),
+        "&&", _link(cached, dest),
+        "&&", _evict_command(cache_dir, cached, max_size, max_age_days),
+    )
+
+
+def _link(cached, dest):
+    return StringCommand(
+        "{",
+        "ln", "-f", QuoteString(cached), QuoteString(dest), "2>/dev/null",
+        "||", "cp", QuoteString(cached), QuoteString(dest),
+        "; }",
+    )
+
+
+def _evict_command(cache_dir, keep, max_size, max_age_days):
+    # Remove files that are too old, then remove the least recently used
+    # files until the cache is small enough. `keep` and uploads still in
+    # progress (`*.part`) are neither counted nor removed.
+    q_keep = shlex.quote(keep)
+    return StringCommand(
+        "{",
+        "find", QuoteString(cache_dir), "-type f", "-mtime", f"+{max_age_days}",
+        "! -name '*.part'", "! -path", QuoteString(keep), "-exec rm -f {} \\;;",
+        "total=0;",
+        f"stat -c '%Y %s %n' {shlex.quote(cache_dir)}/* 2>/dev/null | sort -rn |",
+        "while read -r _ size f; do",
+        f'case "$f" in *.part|{q_keep}) continue;; esac;',
+        "total=$((total + size));",
+        f'[ $total -le {max_size} ] || rm -f "$f";',
+        "done;",
+        "true;",
+        "}",
+    )
@@ -0,0 +1,231 @@
+# Copyright (C) 2021-2022 Horus View and Explore B.V.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Operator-side cache for files that devices download from URLs.
+
+``ArtifactServer`` serves cached files, so a file behind a (remote) URL
+is fetched once per site instead of once per device. Files are stored by
+their SHA-256 digest in the user configuration directory, next to an
+index of URLs. A cached URL is revalidated with ``ETag`` and
+``Last-Modified`` the first time it's requested by a process, and the
+least recently used files are removed when the cache grows too large.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from ipaddress import ip_address
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from ._config import user_config_dir
+
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_DIR = user_config_dir() / "url_cache"
+DEFAULT_MAX_SIZE = 10 * 1024**3
+FETCH_TIMEOUT = 60
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class UrlCache:
+    """Files fetched from URLs, at most ``max_size`` bytes in total.
+
+    Safe to use from multiple threads. Concurrent requests for the same
+    URL wait for a single fetch.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self._objects = self.directory / "objects"
+        self._index_path = self.directory / "index.json"
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._validated: Set[str] = set()
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+
+    def get(self, url: str) -> Path:
+        """Return the path to the cached file of a URL, fetching it first
+        when needed.
+
+        A file is fetched completely before its path is returned, so the
+        first request of a URL waits for the whole download.
+
+        Raises ``OSError`` (e.g. ``urllib.error.HTTPError``) when the URL
+        can't be fetched and isn't cached.
+        """
+        with self._lock:
+            url_lock = self._url_locks[url]
+
+        with url_lock:
+            if url not in self._validated or self._cached_entry(url) is None:
+                self._fetch(url)
+                self._validated.add(url)
+
+            path = self._use(url)
+            if path is None:
+                # Evicted by a fetch of another URL in the meantime.
+                self._fetch(url)
+                path = self._use(url)
+            if path is None:
+                raise FileNotFoundError(f"{url} was evicted from the cache")
+            return path
+
+    def _use(self, url: str) -> Optional[Path]:
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None or not (self._objects / entry["sha256"]).is_file():
+                return None
+            entry["used"] = time.time()
+            self._save_index()
+            return self._objects / entry["sha256"]
+
+    def _cached_entry(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._index.get(url)
+        if entry is None or not (self._objects / entry["sha256"]).is_file():
+            return None
+        return entry
+
+    def _fetch(self, url: str):
+        headers = {}
+        entry = self._cached_entry(url)
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=FETCH_TIMEOUT)
+        except HTTPError as e:
+            if e.code == 304 and headers:
+                logger.debug(f"UrlCache: {url} not modified")
+                return
+            if entry is None:
+                raise
+            logger.warning(f"UrlCache: using cached {url}, can't revalidate: HTTP {e.code}")
+            return
+        except OSError as e:
+            if entry is None:
+                raise
+            logger.warning(f"UrlCache: using cached {url}, can't revalidate: {e}")
+            return
+
+        with response:
+            logger.info(f"UrlCache: fetching {url}")
+            digest, size = self._store(response)
+
+        with self._lock:
+            self._index[url] = {
+                "sha256": digest,
+                "size": size,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "used": time.time(),
+            }
+            self._evict(keep=url)
+            self._save_index()
+
+    def _store(self, response):
+        self._objects.mkdir(parents=True, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+
+        with tempfile.NamedTemporaryFile(dir=self._objects, suffix=".part", delete=False) as fd:
+            try:
+                while chunk := response.read(_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    fd.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(fd.name)
+                raise
+
+        os.replace(fd.name, self._objects / sha256.hexdigest())
+        return sha256.hexdigest(), size
+
+    def _evict(self, keep: str):
+        # Different URLs can point to the same file.
+        sizes = {e["sha256"]: e["size"] for e in self._index.values()}
+        total = sum(sizes.values())
+
+        for url, entry in sorted(self._index.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_size:
+                break
+            if url == keep:
+                continue
+
+            del self._index[url]
+            self._validated.discard(url)
+            digest = entry["sha256"]
+            if all(e["sha256"] != digest for e in self._index.values()):
+                logger.debug(f"UrlCache: evicting {url}")
+                (self._objects / digest).unlink(missing_ok=True)
+                total -= sizes[digest]
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._index_path) as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.debug(f"UrlCache: ignoring unreadable {self._index_path}: {e}")
+            return {}
+
+    def _save_index(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self._index_path.with_suffix(".tmp")
+        with open(tmp, "w") as fd:
+            json.dump(self._index, fd)
+        os.replace(tmp, self._index_path)
+
+
+def is_cacheable(url: str) -> bool:
+    """Whether a URL is worth caching, i.e. an HTTP(S) URL of a host
+    outside the local network.
+
+    This leaves, e.g., health check URLs of devices alone.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname
+    if parts.scheme not in ("http", "https") or not host:
+        return False
+    if host == "localhost" or host.endswith(".local"):
+        return False
+    try:
+        addr = ip_address(host)
+    except ValueError:
+        return True
+    return addr.is_global
@@ -18,6 +18,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import cProfile
 import dataclasses
 import json
 import re
@@ -61,6 +62,23 @@ def temp_python_files(*files):
                 fd.close()
 
 
+@contextmanager
+def profiled(path):
+    """Profile the code inside the with-statement with cProfile.
+
+    The statistics are written to ``path`` in pstats format, which can be
+    inspected with ``python -m pstats`` or tools such as snakeviz.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
 def multi_choice_prompt(text, menu):
     def _parse_choice(v):
         return list(map(int, re.split("[, ]+", v)))
@@ -143,12 +161,14 @@ class IdentifierOrKeyValue(click.ParamType):
         return (key, value)
 
 
-def json_dumps(obj):
-    return json.dumps(obj, cls=JSONEncoder)
+def json_dumps(obj, **kwargs):
+    return json.dumps(obj, cls=JSONEncoder, **kwargs)
 
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if dataclasses.is_dataclass(obj):
             return dataclasses.asdict(obj)
+        if isinstance(obj, Path):
+            return str(obj)
         return super().default(obj)
@@ -0,0 +1,120 @@
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from horus_deploy.artifact_server import ArtifactServer, parse_range
+from horus_deploy.url_cache import UrlCache
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "pkgs").mkdir()
+    (tmp_path / "pkgs" / "a b.rpm").write_bytes(b"0123456789")
+    with ArtifactServer(tmp_path / "pkgs") as server:
+        yield server
+
+
+def get(url, **headers):
+    with urlopen(Request(url, headers=headers)) as response:
+        return response.status, response.headers, response.read()
+
+
+@pytest.mark.parametrize("header,expected", [
+    (None, None),
+    ("bytes=2-5", (2, 5)),
+    ("bytes=2-", (2, 9)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=5-100", (5, 9)),
+    ("bytes=0-1,4-5", None),
+    ("items=0-1", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10-", "bytes=5-2", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 10)
+
+
+def test_get(server, tmp_path):
+    url = server.url_for(tmp_path / "pkgs" / "a b.rpm", "127.0.0.1")
+    assert url == f"http://127.0.0.1:{server.port}/a%20b.rpm"
+
+    status, headers, body = get(url)
+    assert status == 200
+    assert headers["Accept-Ranges"] == "bytes"
+    assert body == b"0123456789"
+
+    status, headers, body = get(url, Range="bytes=3-4")
+    assert status == 206
+    assert headers["Content-Range"] == "bytes 3-4/10"
+    assert body == b"34"
+
+    with pytest.raises(HTTPError) as e:
+        get(url, Range="bytes=20-")
+    assert e.value.code == 416
+
+
+def test_get_outside_root(server, tmp_path):
+    (tmp_path / "secret").write_bytes(b"")
+
+    for path in ["/missing.rpm", "/../secret", "/"]:
+        with pytest.raises(HTTPError) as e:
+            get(f"http://127.0.0.1:{server.port}{path}")
+        assert e.value.code == 404
+
+
+def test_rewrite_params(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "other.rpm").write_bytes(b"")
+    url = f"http://127.0.0.1:{server.port}/a%20b.rpm"
+
+    params = {
+        "file": "pkgs/a b.rpm",
+        "install": "a b.rpm",
+        "other": "other.rpm",
+        "n": 1,
+    }
+
+    assert server.rewrite_params(params, "127.0.0.1") == {
+        "file": url,
+        "install": url,
+        "other": "other.rpm",
+        "n": 1,
+    }
+
+
+def test_cached_urls(server, tmp_path):
+    upstream_url = server.url_for(tmp_path / "pkgs" / "a b.rpm", "127.0.0.1")
+
+    with ArtifactServer(url_cache=UrlCache(tmp_path / "cache")) as proxy:
+        params = {
+            "install": "https://example.com/images/a.mender?token=1",
+            "health_url": "http://127.0.0.1/health",
+            "file": "pkgs/a b.rpm",
+        }
+        new_params = proxy.rewrite_params(params, "127.0.0.1")
+        assert new_params["install"].startswith(f"http://127.0.0.1:{proxy.port}/_cache/")
+        assert new_params["install"].endswith("/a.mender")
+        assert new_params["health_url"] == params["health_url"]
+        assert new_params["file"] == params["file"]
+
+        url = proxy.cached_url_for(upstream_url, "127.0.0.1")
+        assert url.endswith("/a%20b.rpm")
+        assert get(url)[2] == b"0123456789"
+        assert get(url, Range="bytes=3-4")[2] == b"34"
+
+        for path in ["/_cache/0123/a.rpm", "/pkgs/a%20b.rpm"]:
+            with pytest.raises(HTTPError) as e:
+                get(f"http://127.0.0.1:{proxy.port}{path}")
+            assert e.value.code == 404
+
+        with pytest.raises(HTTPError) as e:
+            get(proxy.cached_url_for(upstream_url + ".missing", "127.0.0.1"))
+        assert e.value.code == 502
+
+        with pytest.raises(ValueError):
+            proxy.url_for(tmp_path / "pkgs" / "a b.rpm", "127.0.0.1")
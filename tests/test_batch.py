@@ -0,0 +1,59 @@
+import subprocess
+
+from pyinfra.api import FunctionCommand, StringCommand
+
+from horus_deploy.operations.batch import BatchCommand, coalesce, parse_step_output
+
+
+def run_locally(command):
+    p = subprocess.run(
+        ["sh", "-c", command.get_raw_value()], capture_output=True, text=True
+    )
+    combined_output = [("stdout", line) for line in p.stdout.splitlines()]
+    return p.returncode, parse_step_output(combined_output)
+
+
+def test_coalesce():
+    def callback(state, host):
+        pass
+
+    function_command = FunctionCommand(callback, (), {})
+    commands = list(coalesce(
+        "echo a",
+        (c for c in [StringCommand("echo", "b")]),
+        function_command,
+        ["echo c"],
+    ))
+
+    assert len(commands) == 3
+    assert isinstance(commands[0], BatchCommand)
+    assert [s.get_raw_value() for s in commands[0].steps] == ["echo a", "echo b"]
+    assert commands[1] is function_command
+    assert commands[2] == StringCommand("echo c")
+
+
+def test_coalesce_merges_batches():
+    commands = list(coalesce(coalesce("echo a", "echo b"), "echo c"))
+
+    assert len(commands) == 1
+    assert len(commands[0].steps) == 3
+
+
+def test_coalesce_splits_on_executor_kwargs():
+    commands = list(coalesce("echo a", StringCommand("echo b", sudo=True)))
+    assert len(commands) == 2
+
+
+def test_batch_command_exit_codes():
+    command = BatchCommand(
+        StringCommand("echo a"),
+        StringCommand("exit 3", success_exit_codes=[0, 3]),
+        StringCommand("echo b; exit 1"),
+        StringCommand("echo c"),
+    )
+
+    returncode, (exit_codes, output) = run_locally(command)
+
+    assert returncode == 1
+    assert exit_codes == {0: 0, 1: 3, 2: 1}
+    assert output == [("stdout", "a"), ("stdout", "b")]
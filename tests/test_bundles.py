@@ -0,0 +1,125 @@
+import sys
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from horus_deploy import bundles, deploys
+
+
+@pytest.fixture
+def scripts(tmp_path):
+    scripts = tmp_path / "scripts"
+    (scripts / "b").mkdir(parents=True)
+    (scripts / "a.py").write_text(
+        "METADATA = {'name': 'a'}\n"
+        "RESULT = __file__\n"
+    )
+    (scripts / "b" / "deploy.py").write_text(
+        "from helper import VALUE\n"
+        "METADATA = {'name': 'b', 'parameters': {'x': 'X'}}\n"
+        "RESULT = VALUE\n"
+    )
+    (scripts / "b" / "helper.py").write_text("VALUE = 42\n")
+    (scripts / "helper.py").write_text("VALUE = 1\n")
+    return scripts
+
+
+@pytest.fixture
+def bundle(tmp_path, scripts):
+    script_paths, _ = deploys.list_scripts(scripts)
+    scripts_by_id = {deploys.script_id(p): p for p in script_paths if p.exists()}
+    path = tmp_path / "user" / "scripts.hdbundle"
+    path.parent.mkdir()
+    assert bundles.build_bundle(path, scripts_by_id) == ["a", "b"]
+    return path
+
+
+def test_build_bundle(bundle):
+    with zipfile.ZipFile(bundle) as zf:
+        assert sorted(zf.namelist()) == [
+            "MANIFEST.json", "a.py", "a.pyc",
+            "b/deploy.py", "b/deploy.pyc", "b/helper.py", "b/helper.pyc",
+        ]
+
+    manifest = bundles.read_manifest(bundle)
+    assert manifest["scripts"]["b"] == {
+        "path": "b/deploy.py",
+        "metadata": {"name": "b", "parameters": {"x": "X"}},
+    }
+    assert set(manifest["files"]) == {"a.py", "b/deploy.py", "b/helper.py"}
+
+
+def test_read_manifest_not_a_bundle(tmp_path):
+    (tmp_path / "other.hdbundle").write_bytes(b"")
+    with pytest.raises(ValueError):
+        bundles.read_manifest(tmp_path / "other.hdbundle")
+
+
+def test_find_deploy_scripts(tmp_path, bundle):
+    with patch("horus_deploy.deploys._BUILTIN", tmp_path / "builtin"), \
+            patch("horus_deploy.deploys._USER_DIR", bundle.parent), \
+            patch("horus_deploy.deploys._INDEX_PATH", tmp_path / "index.pickle"), \
+            patch("horus_deploy.deploys.Path.cwd", return_value=tmp_path / "local"):
+        assert [(s["id"], s["path"], s["type"]) for s in deploys.find_deploy_scripts()] == [
+            ("a", bundle / "a.py", deploys.Type.USER),
+            ("b", bundle / "b" / "deploy.py", deploys.Type.USER),
+        ]
+        assert deploys.find_deploy_scripts(["b"])[0]["name"] == "b"
+
+        # Scripts outside bundles take precedence.
+        (bundle.parent / "a.py").write_text("METADATA = {'name': 'local a'}\n")
+        assert deploys.find_deploy_scripts(["a"])[0]["name"] == "local a"
+
+
+def test_find_deploy_scripts_ignores_other_files(tmp_path, bundle, caplog):
+    (bundle.parent / "other.hdbundle").write_bytes(b"")
+    (bundle.parent / "archive.zip").write_bytes(b"")
+    with patch("horus_deploy.deploys._BUILTIN", tmp_path / "builtin"), \
+            patch("horus_deploy.deploys._USER_DIR", bundle.parent), \
+            patch("horus_deploy.deploys._INDEX_PATH", tmp_path / "index.pickle"), \
+            patch("horus_deploy.deploys.Path.cwd", return_value=tmp_path / "local"):
+        for _ in range(2):
+            assert [s["id"] for s in deploys.find_deploy_scripts()] == ["a", "b"]
+
+    assert [r.getMessage().split(":")[0] for r in caplog.records] == [
+        f"ignoring {bundle.parent / 'other.hdbundle'}"
+    ]
+
+
+def test_exec_script(bundle, monkeypatch):
+    monkeypatch.setattr("sys.path", list(sys.path))
+
+    with patch.dict(sys.modules), \
+            patch("horus_deploy.bundles.compile", create=True) as compile:
+        namespace = {}
+        bundles.exec_script(str(bundle), "a.py", namespace)
+        assert namespace["RESULT"] == f"{bundle}/a.py"
+
+        namespace = {}
+        bundles.exec_script(str(bundle), "b/deploy.py", namespace)
+        assert namespace["RESULT"] == 42
+
+        compile.assert_not_called()
+
+
+def test_exec_script_modified(bundle, tmp_path):
+    modified = tmp_path / "modified.hdbundle"
+    with zipfile.ZipFile(bundle) as src, zipfile.ZipFile(modified, "w") as dest:
+        for name in src.namelist():
+            dest.writestr(name, src.read(name) + b"\n" if name == "a.py" else src.read(name))
+
+    with pytest.raises(ValueError):
+        bundles.exec_script(str(modified), "a.py", {})
+
+
+def test_write_stub(bundle, tmp_path):
+    with open(tmp_path / "stub.py", "w") as fd:
+        bundles.write_stub(fd, bundle / "a.py")
+
+    namespace = {"__file__": str(tmp_path / "stub.py")}
+    exec((tmp_path / "stub.py").read_text(), namespace)
+    assert namespace["RESULT"] == f"{bundle}/a.py"
+
+    with pytest.raises(ValueError):
+        bundles.write_stub(fd, tmp_path / "a.py")
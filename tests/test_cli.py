@@ -1,7 +1,13 @@
-from unittest.mock import patch
+import json
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from click.testing import CliRunner
 
 from horus_deploy import cli
+from horus_deploy.failed_hosts import REPORT_ENV
 from horus_deploy.host import Host
+from horus_deploy.inventory import save_inventory
 
 
 def test_get_hosts():
@@ -50,3 +56,87 @@ def test_get_hosts_with_regex_filter(find_hosts_on_local_network):
         Host.from_str("x-y-z.local."),
     ]
     assert is_discovered
+
+
+def test_get_inventory_hosts(tmp_path):
+    hosts = [
+        Host.from_str("a-b-c.local.", resolved_addrs=["192.168.178.125"]),
+        Host.from_str("x-y-z.local.", resolved_addrs=["192.168.178.60"]),
+    ]
+    path = tmp_path / "inventory.json"
+    save_inventory(path, hosts)
+
+    assert cli.get_inventory_hosts(path, []) == hosts
+    assert cli.get_inventory_hosts(path, [Host.from_str("x*")]) == hosts[1:]
+    assert cli.get_inventory_hosts(path, [Host.from_str("192.168.178.125")]) == hosts[:1]
+
+
+def test_get_inventory_hosts_ssh_parameters(tmp_path):
+    hosts = [Host.from_str("a-b-c.local.", ssh_params={"ssh_user": "root", "ssh_port": 22})]
+    path = tmp_path / "inventory.json"
+    save_inventory(path, hosts)
+
+    loaded_hosts = cli.get_inventory_hosts(path, [], ssh_parameter_set={"ssh_port": 2222})
+    assert loaded_hosts[0].ssh_params == {"ssh_user": "root", "ssh_port": 2222}
+
+
+def test_watch():
+    hosts = [
+        Host.from_str(
+            "som-4F2D7.local.", resolved_addrs=["192.168.178.60"], props={"hardware_id": "a"}
+        ),
+        Host.from_str(
+            "som-8C1A2.local.", resolved_addrs=["192.168.178.61"], props={"hardware_id": "b"}
+        ),
+    ]
+
+    def watch_hosts(on_change):
+        for host in hosts:
+            on_change(host)
+        return Mock()
+
+    with patch("horus_deploy.cli.watch_hosts", watch_hosts), \
+            patch("horus_deploy.cli.time.sleep", side_effect=KeyboardInterrupt):
+        result = CliRunner().invoke(cli.watch, ["-j", "som-4F2D7-2.local.", "b"])
+
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [
+        {"name": "som-4F2D7.local.", "hardware_id": "a", "addrs": ["192.168.178.60"]},
+        {"name": "som-8C1A2.local.", "hardware_id": "b", "addrs": ["192.168.178.61"]},
+    ]
+
+    with patch("horus_deploy.cli.watch_hosts", watch_hosts), \
+            patch("horus_deploy.cli.time.sleep", side_effect=KeyboardInterrupt):
+        result = CliRunner().invoke(cli.watch, ["a"])
+
+    assert result.output == "som-4F2D7.local. 192.168.178.60\n"
+
+
+def test_run_waves(tmp_path):
+    hosts = [
+        Host.from_str(f"som-{i}.local.", ssh_host=f"192.168.178.{i}", ssh_params={"ssh_port": 22})
+        for i in range(5)
+    ]
+    path = tmp_path / "inventory.json"
+    save_inventory(path, hosts)
+    waves = []
+
+    def pyinfra(cmd, env):
+        inventory = Path(cmd[-3]).read_text()
+        wave = [h.addr.s for h in hosts if repr(h.ssh_host) in inventory]
+        waves.append((wave, cmd[cmd.index("--fail-percent") + 1]))
+        Path(env[REPORT_ENV]).write_text(json.dumps(wave[:1] if len(waves) == 2 else []))
+        return 0
+
+    with patch("horus_deploy.cli.subprocess.call", pyinfra), \
+            patch("horus_deploy.deploys._INDEX_PATH", tmp_path / "index.pickle"):
+        result = CliRunner().invoke(cli.main, [
+            "run", "-i", str(path), "--wave-size", "2", "--max-fail-percent", "20", "uname",
+        ])
+
+    assert result.exit_code == 1
+    assert waves == [
+        (["som-0.local.", "som-1.local."], "100"),
+        (["som-2.local.", "som-3.local."], "100"),
+    ]
+    assert "1 of 4 devices failed, not starting the remaining 1 waves" in result.output
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from horus_deploy import delta
+
+
+BLOCK_SIZE = delta.MIN_BLOCK_SIZE
+
+
+def sh(script, path=None):
+    env = dict(os.environ, PATH=path) if path else None
+    return subprocess.run(
+        [shutil.which("sh"), "-c", script], capture_output=True, text=True, env=env
+    )
+
+
+def signature(path, env_path=None):
+    command = delta.signature_command(str(path), BLOCK_SIZE).get_raw_value()
+    p = sh(command, env_path)
+    assert p.returncode == 0, p.stderr
+    return delta.parse_signature(p.stdout.splitlines(), BLOCK_SIZE)
+
+
+def rebuild(tmp_path, old, new, env_path=None):
+    basis = tmp_path / "basis"
+    basis.write_bytes(old)
+    sig = signature(basis, env_path)
+
+    ops = delta.compute_delta(new, sig)
+    assert ops is not None
+
+    literals = tmp_path / "literals"
+    literals.write_bytes(b"".join(delta.literal_chunks(new, ops)))
+    dest = tmp_path / "dest"
+    script = delta.apply_script(
+        str(basis), str(literals), str(dest), BLOCK_SIZE, ops,
+        hashlib.sha256(new).hexdigest(),
+    )
+    p = sh(script)
+    assert p.returncode == 0, p.stderr
+    assert dest.read_bytes() == new
+    assert not literals.exists()
+    return ops
+
+
+@pytest.fixture
+def old():
+    return random.Random(0).randbytes(10 * BLOCK_SIZE + 123)
+
+
+def literal_size(ops):
+    return sum(length for op, _, length in ops if op == "literal")
+
+
+def test_weak_checksum_matches_host(tmp_path, old):
+    path = tmp_path / "basis"
+    path.write_bytes(old)
+
+    sig = signature(path)
+
+    assert sig.size == len(old)
+    assert len(sig.blocks) == 11
+    for i, (weak, digest) in enumerate(sig.blocks):
+        block = old[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]
+        assert weak == delta.weak_checksum(block)
+        assert digest == hashlib.md5(block).hexdigest()
+
+
+def test_signature_of_missing_file(tmp_path):
+    assert signature(tmp_path / "missing") is None
+
+
+def test_delta_insertion(tmp_path, old):
+    new = old[:3 * BLOCK_SIZE + 10] + b"inserted" + old[3 * BLOCK_SIZE + 10:]
+
+    ops = rebuild(tmp_path, old, new)
+
+    assert literal_size(ops) <= BLOCK_SIZE + len(b"inserted")
+    assert ops[0] == ("copy", 0, 3)
+
+
+def test_delta_unchanged(tmp_path, old):
+    ops = rebuild(tmp_path, old, old)
+
+    assert ops == [("copy", 0, 11)]
+
+
+def test_delta_without_python_on_host(tmp_path, old):
+    # Only blocks at the same offsets are found without weak checksums.
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for tool in ["stat", "dd", "md5sum", "cut"]:
+        os.symlink(shutil.which(tool), bin_dir / tool)
+
+    new = bytearray(old)
+    new[5 * BLOCK_SIZE] ^= 0xFF
+    new = bytes(new)
+
+    ops = rebuild(tmp_path, old, new, env_path=str(bin_dir))
+
+    assert literal_size(ops) == BLOCK_SIZE
+
+
+def test_delta_too_different(tmp_path, old):
+    basis = tmp_path / "basis"
+    basis.write_bytes(old)
+    new = random.Random(1).randbytes(len(old))
+
+    assert delta.compute_delta(new, signature(basis)) is None
+
+
+def test_weak_checksums(old):
+    checksums = delta._weak_checksums(old, 100, 3000, BLOCK_SIZE)
+
+    assert checksums == [
+        delta.weak_checksum(old[offset:offset + BLOCK_SIZE]) for offset in range(100, 3100)
+    ]
+
+
+def test_delta_moved_and_changed_blocks(tmp_path, old):
+    changed = bytearray(old[6 * BLOCK_SIZE:7 * BLOCK_SIZE])
+    changed[100] ^= 0xFF
+    new = (
+        old[:2 * BLOCK_SIZE]
+        + old[4 * BLOCK_SIZE:6 * BLOCK_SIZE]
+        + b"x" * 1000
+        + old[2 * BLOCK_SIZE:4 * BLOCK_SIZE]
+        + bytes(changed)
+        + old[7 * BLOCK_SIZE:]
+    )
+
+    ops = rebuild(tmp_path, old, new)
+
+    assert literal_size(ops) == 1000 + BLOCK_SIZE
@@ -1,6 +1,9 @@
+import os
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
 from horus_deploy import deploys
 
 SCRIPT_BASE_PATH = Path(__file__).parent / "testdata" / "deploy_scripts"
@@ -9,6 +12,12 @@ USER_SCRIPTS = SCRIPT_BASE_PATH / "user"
 LOCAL_SCRIPTS = SCRIPT_BASE_PATH / "local"
 
 
+@pytest.fixture(autouse=True)
+def index_path(tmp_path):
+    with patch("horus_deploy.deploys._INDEX_PATH", tmp_path / "index.pickle"):
+        yield tmp_path / "index.pickle"
+
+
 @patch("horus_deploy.deploys._BUILTIN", BUILTIN_SCRIPTS)
 @patch("horus_deploy.deploys._USER_DIR", USER_SCRIPTS)
 @patch("horus_deploy.deploys.Path.cwd")
@@ -57,6 +66,82 @@ def test_find_deploy_scripts_with_filter(path_cwd):
     actual_result = deploys.find_deploy_scripts("a")
 
     assert actual_result == expected_result
+    assert deploys.find_deploy_scripts([Path("a.py")]) == expected_result
+
+
+def test_metadata_index(tmp_path, index_path):
+    (tmp_path / "scripts").mkdir()
+    script = tmp_path / "scripts" / "d.py"
+    script.write_text("METADATA = {'name': 'd'}\n")
+
+    index = deploys.MetadataIndex(index_path)
+    assert index.scripts_in(tmp_path / "scripts") == [script]
+    index.update([script])
+    assert index.metadata(script) == {"name": "d"}
+    index.save()
+
+    with patch("horus_deploy.deploys.extract_metadata") as extract_metadata:
+        index = deploys.MetadataIndex(index_path)
+        assert index.scripts_in(tmp_path / "scripts") == [script]
+        assert index.metadata(script) == {"name": "d"}
+
+        # Touched, but unchanged.
+        os.utime(script, ns=(0, 0))
+        index.update([script])
+        assert index.metadata(script) == {"name": "d"}
+        extract_metadata.assert_not_called()
+
+    script.write_text("METADATA = {'name': 'e'}\n")
+    (tmp_path / "scripts" / "e").mkdir()
+    index.update([script])
+    assert index.metadata(script) == {"name": "e"}
+    assert index.scripts_in(tmp_path / "scripts") == [
+        script, tmp_path / "scripts" / "e" / "deploy.py"
+    ]
+
+    script.unlink()
+    index.update([script])
+    assert index.metadata(script) is None
+
+
+def test_metadata_index_file_and_directory(tmp_path, index_path):
+    # Both are listed, a directory is found by ID.
+    (tmp_path / "f").mkdir()
+    (tmp_path / "f" / "deploy.py").write_text("METADATA = {'name': 'dir'}\n")
+    (tmp_path / "f.py").write_text("METADATA = {'name': 'file'}\n")
+
+    index = deploys.MetadataIndex(index_path)
+
+    assert index.scripts_in(tmp_path) == [tmp_path / "f" / "deploy.py", tmp_path / "f.py"]
+    assert index.find(tmp_path, "f") == tmp_path / "f" / "deploy.py"
+    assert index.find(tmp_path, "f.py") == tmp_path / "f.py"
+
+
+@pytest.mark.parametrize("threshold", [1, 1000])
+def test_metadata_index_errors(tmp_path, index_path, caplog, threshold):
+    scripts = []
+    for i in range(10):
+        scripts.append(tmp_path / f"{i}.py")
+        scripts[-1].write_text(f"METADATA = {{'name': '{i}'}}\n")
+    scripts[3].write_text("METADATA = {'name': name}\n")
+    scripts[5].write_text("METADATA = {\n")
+    scripts[7].write_text("METADATA = {'name': '7'}\nif:\n")
+
+    index = deploys.MetadataIndex(index_path)
+    with patch("horus_deploy.deploys._PARALLEL_THRESHOLD", threshold), \
+            patch("horus_deploy.deploys.os.cpu_count", return_value=2):
+        index.update(scripts)
+
+    assert [index.metadata(s) for s in scripts] == [
+        {"name": str(i)} if i not in (3, 5, 7) else {} for i in range(10)
+    ]
+    assert [r.getMessage().split(":")[0] for r in caplog.records] == [
+        f"cannot extract metadata from {scripts[3]}",
+        f"cannot extract metadata from {scripts[5]}",
+        f"cannot extract metadata from {scripts[7]}",
+    ]
+    assert "ValueError" in caplog.records[0].getMessage()
+    assert "SyntaxError" in caplog.records[2].getMessage()
 
 
 def test_is_relative_to():
@@ -0,0 +1,104 @@
+import hashlib
+import shutil
+import socket
+import subprocess
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import gevent
+
+from horus_deploy import distribute
+
+
+class FakeHost:
+    def __init__(self, name, serve=True):
+        self.name = name
+        self.data = SimpleNamespace(ssh_hostname=None)
+        self.serve = serve
+        self.commands = []
+
+    def run_shell_command(self, command):
+        command = command.get_raw_value()
+        self.commands.append(command)
+        if "http.server" in command:
+            return self.serve, [], []
+        return True, [], []
+
+    def __repr__(self):
+        return self.name
+
+
+def sh(command):
+    return subprocess.run(
+        [shutil.which("sh"), "-c", command.get_raw_value()],
+        capture_output=True,
+        text=True,
+    )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_tree():
+    tree = distribute.Tree(range(7), fanout=2)
+
+    assert [tree.parent(h) for h in range(7)] == [None, None, 0, 0, 1, 1, 2]
+    assert tree.children(0) == [2, 3]
+    assert tree.children(2) == [6]
+    assert tree.children(3) == []
+
+
+def test_serve_and_fetch(tmp_path):
+    src = tmp_path / "artifact.mender"
+    src.write_bytes(b"abc" * 1000)
+    digest = hashlib.sha256(src.read_bytes()).hexdigest()
+    dest = tmp_path / "dest.mender"
+    peer_dir = tmp_path / "peer"
+    port = free_port()
+
+    p = sh(distribute.serve_command(str(src), digest, port, 60, str(peer_dir)))
+    assert p.returncode == 0, p.stderr
+    try:
+        url = f"http://127.0.0.1:{port}/{digest}"
+        p = sh(distribute.fetch_command(url, str(dest), digest))
+        assert p.returncode == 0, p.stderr
+        assert dest.read_bytes() == src.read_bytes()
+
+        p = sh(distribute.fetch_command(url, str(dest), "0" * 64))
+        assert p.returncode != 0
+        assert not (tmp_path / "dest.mender.part").exists()
+    finally:
+        sh(distribute.stop_command(digest, str(peer_dir)))
+
+    assert not peer_dir.joinpath(digest).exists()
+
+
+@patch("horus_deploy.distribute.put_file", return_value=True)
+def test_distribute_file(put_file, tmp_path):
+    src = tmp_path / "artifact.mender"
+    src.write_bytes(b"abc")
+    hosts = [FakeHost("a"), FakeHost("b", serve=False), FakeHost("c"), FakeHost("d")]
+    state = SimpleNamespace(
+        inventory=hosts,
+        active_hosts=set(hosts),
+        ops={h: {"op"} for h in hosts},
+    )
+
+    greenlets = [
+        gevent.spawn(
+            distribute.distribute_file, state, h, str(src), "/data/a.mender", 1, "op"
+        )
+        for h in hosts
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert all(g.value for g in greenlets)
+    # a is the seed, b downloads from a, but can't serve, so c is
+    # uploaded to, and d downloads from c.
+    assert [c.args[1] for c in put_file.call_args_list] == [hosts[0], hosts[2]]
+    assert any("curl" in c and "//a:" in c for c in hosts[1].commands)
+    assert any("curl" in c and "//c:" in c for c in hosts[3].commands)
+    assert state._horus_distribute == {}
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from horus_deploy import fact_cache
+
+
+class FakeHost:
+    def __init__(self, name, **data):
+        self.name = name
+        self.data = data
+
+
+def make_state():
+    return SimpleNamespace(
+        current_op_global_kwargs=None,
+        config=SimpleNamespace(SUDO=False, SUDO_USER=None, SU_USER=None, ENV={}, SHELL="sh"),
+        failed_hosts=set(),
+    )
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path):
+    with patch("horus_deploy.fact_cache._CACHE_DIR", tmp_path):
+        with patch.dict("horus_deploy.fact_cache._caches", clear=True):
+            yield tmp_path
+
+
+def test_fact_cache_ttl(tmp_path):
+    cache = fact_cache.FactCache(tmp_path / "a.pickle", ttl=60)
+    cache.set("key", "mounts", {"/": {}})
+
+    assert fact_cache.FactCache(tmp_path / "a.pickle", ttl=60).get("key") == {"/": {}}
+
+    with patch("horus_deploy.fact_cache.time.time", return_value=10 ** 10):
+        assert cache.get("key") is fact_cache._MISSING
+
+
+def test_fact_cache_invalidate(tmp_path):
+    cache = fact_cache.FactCache(tmp_path / "a.pickle", ttl=60)
+    cache.set("a", "mounts", 1)
+    cache.set("b", "rpm_packages", 2)
+
+    cache.invalidate(["mounts"])
+    assert cache.get("a") is fact_cache._MISSING
+    assert cache.get("b") == 2
+
+    cache.invalidate()
+    assert cache.get("b") is fact_cache._MISSING
+
+
+@patch("horus_deploy.fact_cache._original_get_facts")
+def test_get_facts_cached_across_runs(original_get_facts):
+    host = FakeHost("a", hardware_id="4F2D7", fact_cache_ttl="60")
+    original_get_facts.return_value = {host: {"/usr": {"options": ["ro"]}}}
+
+    facts = fact_cache._get_facts(make_state(), "mounts", ensure_hosts=(host,))
+    assert facts[host] == {"/usr": {"options": ["ro"]}}
+
+    # A new run, i.e. a new state and cache objects loaded from disk.
+    fact_cache._caches.clear()
+    facts = fact_cache._get_facts(make_state(), "mounts", ensure_hosts=(host,))
+    assert facts[host] == {"/usr": {"options": ["ro"]}}
+    original_get_facts.assert_called_once()
+
+    fact_cache.invalidate(host, fact_cache.MOUNT_FACTS)
+    fact_cache._get_facts(make_state(), "mounts", ensure_hosts=(host,))
+    assert original_get_facts.call_count == 2
+
+
+@patch("horus_deploy.fact_cache._original_get_facts")
+def test_get_facts_without_hardware_id(original_get_facts):
+    host = FakeHost("a", fact_cache_ttl="60")
+    original_get_facts.return_value = {host: {}}
+
+    fact_cache._get_facts(make_state(), "mounts", ensure_hosts=(host,))
+    fact_cache._get_facts(make_state(), "mounts", ensure_hosts=(host,))
+
+    assert original_get_facts.call_count == 2
+
+
+@pytest.mark.parametrize("global_kwargs,kwargs", [
+    ({"sudo": True}, {}),
+    ({"su_user": "mender"}, {}),
+    ({"env": {"LANG": "C"}}, {}),
+    ({}, {"sudo": True}),
+])
+def test_cache_key_executor_kwargs(global_kwargs, kwargs):
+    state = make_state()
+    key = fact_cache._cache_key(state, "which", ("mender",), {})
+
+    state.current_op_global_kwargs = global_kwargs
+    assert fact_cache._cache_key(state, "which", ("mender",), kwargs) != key
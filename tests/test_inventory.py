@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pytest
+
+from horus_deploy.host import Host
+from horus_deploy.inventory import load_inventory, save_inventory
+
+
+def test_save_and_load_inventory(tmp_path):
+    hosts = [
+        Host.from_str(
+            "imx6qdl-variscite-som-4F2D7-2.local.",
+            resolved_addrs=["192.168.178.125"],
+            props={"hardware_id": "4F2D7"},
+            ssh_host="192.168.178.125",
+            ssh_params={"ssh_user": "root", "ssh_key": Path("/tmp/id_ed25519")},
+        ),
+        Host.from_str("192.168.178.60", ssh_host="192.168.178.60"),
+    ]
+    path = tmp_path / "inventory.json"
+
+    save_inventory(path, hosts)
+    loaded_hosts = load_inventory(path)
+
+    assert loaded_hosts[0].ssh_params["ssh_key"] == "/tmp/id_ed25519"
+    loaded_hosts[0].ssh_params["ssh_key"] = Path("/tmp/id_ed25519")
+    assert loaded_hosts == hosts
+
+
+def test_load_inventory_unsupported_version(tmp_path):
+    path = tmp_path / "inventory.json"
+    path.write_text('{"version": 0, "hosts": []}')
+
+    with pytest.raises(ValueError):
+        load_inventory(path)
+
+
+def test_save_inventory_without_passwords(tmp_path):
+    hosts = [Host.from_str("192.168.178.60", ssh_params={
+        "ssh_user": "root", "ssh_password": "secret", "ssh_key_password": "secret",
+    })]
+    path = tmp_path / "inventory.json"
+
+    save_inventory(path, hosts)
+
+    assert "secret" not in path.read_text()
+    assert load_inventory(path)[0].ssh_params == {"ssh_user": "root"}
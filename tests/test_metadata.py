@@ -28,3 +28,42 @@ METADATA = {'id': s}
 """
     with pytest.raises(ValueError):
         extract_metadata(data)
+
+
+def test_metadata_rest_not_parsed():
+    data = """\
+import os
+
+METADATA = {
+    "id": "test",  # }
+    "parameters": {"a": "}"},
+}  # done
+
+this isn't parsed (
+"""
+    assert extract_metadata(data) == {"id": "test", "parameters": {"a": "}"}}
+
+
+@pytest.mark.parametrize("data,expected", [
+    ("a = METADATA = {'id': 'test'}", {"id": "test"}),
+    ("a = 1; METADATA = {'id': 'test'}", {"id": "test"}),
+    ("METADATA: dict = {}\nMETADATA = {'id': 'test'}", {"id": "test"}),
+    ("if a:\n    METADATA = {}\nMETADATA = {'id': 'test'}", {"id": "test"}),
+    ("print(METADATA)", {}),
+])
+def test_metadata_other_forms(data, expected):
+    assert extract_metadata(data) == expected
+
+
+@pytest.mark.parametrize("data", [
+    "a, METADATA = 1, {}",
+    "METADATA = {} | {}",
+])
+def test_metadata_other_forms_not_a_dict(data):
+    with pytest.raises(TypeError):
+        extract_metadata(data)
+
+
+def test_metadata_far_from_top():
+    data = "DATA = [\n" + "    'METADATA = {}',\n" * 1000 + "]\nMETADATA = {'id': 'test'}\n"
+    assert extract_metadata(data) == {"id": "test"}
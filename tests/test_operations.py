@@ -1,5 +1,18 @@
+import os
+import subprocess
+
 import pytest
-from horus_deploy.operations.package import _get_name_from_rpm_path
+from pyinfra.api import Config, FunctionCommand, Inventory, OperationError, State
+from pyinfra.api.connect import connect_all
+from pyinfra.api.operation import add_op
+
+from horus_deploy.facts import InstalledRpms
+from horus_deploy.operations import mender, package, system
+from horus_deploy.operations.package import (
+    _get_name_from_rpm_path,
+    _get_nevra,
+    _install_command,
+)
 
 
 @pytest.mark.parametrize(
@@ -29,3 +42,202 @@ from horus_deploy.operations.package import _get_name_from_rpm_path
 )
 def test_get_name_from_rpm_path(test_input, expected):
     assert _get_name_from_rpm_path(test_input) == expected
+
+
+FAKE_RPM = """\
+#!/bin/sh
+case "$1" in
+    -qp) basename "$2" .rpm ;;
+    -q) [ "$2" = "htop-2.2.0-r0.aarch64" ] ;;
+    -Uvh) shift; echo "installing $*" ;;
+esac
+"""
+
+
+def test_install_command(tmp_path):
+    rpm = tmp_path / "rpm"
+    rpm.write_text(FAKE_RPM)
+    rpm.chmod(0o755)
+    env = {**os.environ, "PATH": f"{tmp_path}:{os.environ['PATH']}"}
+
+    command = _install_command([
+        "/tmp/deploy/htop-2.2.0-r0.aarch64.rpm",
+        "/tmp/deploy/nano-5.0-r0.aarch64.rpm",
+    ])
+    p = subprocess.run(
+        ["sh", "-c", command.get_raw_value()], env=env, capture_output=True, text=True
+    )
+    assert p.returncode == 0
+    assert p.stdout == "installing /tmp/deploy/nano-5.0-r0.aarch64.rpm\n"
+
+    command = _install_command(["/tmp/deploy/htop-2.2.0-r0.aarch64.rpm"])
+    p = subprocess.run(
+        ["sh", "-c", command.get_raw_value()], env=env, capture_output=True, text=True
+    )
+    assert p.returncode == 0
+    assert p.stdout == ""
+
+
+FAKE_RPM_QUERY = """\
+#!/bin/sh
+shift 3
+for p in "$@"; do
+    case "$p" in
+        htop-*) echo "$p" ;;
+        *) echo "package $p is not installed" ;;
+    esac
+done
+exit 1
+"""
+
+
+def test_installed_rpms_fact(tmp_path):
+    rpm = tmp_path / "rpm"
+    rpm.write_text(FAKE_RPM_QUERY)
+    rpm.chmod(0o755)
+    env = {**os.environ, "PATH": f"{tmp_path}:{os.environ['PATH']}"}
+
+    fact = InstalledRpms()
+    command = fact.command(["htop-2.2.0-r0.aarch64", "nano-5.0-r0.aarch64"])
+    p = subprocess.run(
+        ["sh", "-c", command.get_raw_value()], env=env, capture_output=True, text=True
+    )
+    assert p.returncode == 0
+    assert fact.process(p.stdout.splitlines()) == {"htop-2.2.0-r0.aarch64"}
+
+
+def test_get_nevra_from_url():
+    assert str(_get_nevra("http://10.0.0.1:8000/htop-2.2.0-r0.aarch64.rpm")) == (
+        "htop-2.2.0-r0.aarch64"
+    )
+    assert _get_nevra("http://10.0.0.1:8000/htop.rpm") is None
+
+
+def test_remount_scope():
+    inventory = Inventory((["@local"], {}))
+    state = State(inventory, Config())
+    connect_all(state)
+    host = inventory.get_host("@local")
+
+    add_op(state, system.begin_remount, ["/"], "rw")
+    add_op(state, system.begin_remount, ["/"], "rw")
+    add_op(state, system.end_remount, ["/"], "rw")
+    add_op(state, system.end_remount, ["/"], "rw")
+
+    commands = [
+        [str(c) for c in state.ops[host][op_hash]["commands"]]
+        for op_hash in state.get_op_order()
+    ]
+    assert "remount,rw" in commands[0][-1]
+    assert commands[1:3] == [[], []]
+    assert commands[3][-1].endswith("ro /")
+
+    with pytest.raises(OperationError):
+        add_op(state, system.end_remount, ["/"], "rw")
+
+
+FAKE_RPM_QUERY_ALL = """\
+#!/bin/sh
+echo "htop 2.2.0-r0"
+"""
+
+
+def test_uninstall(tmp_path, monkeypatch):
+    rpm = tmp_path / "rpm"
+    rpm.write_text(FAKE_RPM_QUERY_ALL)
+    rpm.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+
+    inventory = Inventory((["@local"], {}))
+    state = State(inventory, Config())
+    connect_all(state)
+    host = inventory.get_host("@local")
+
+    add_op(state, package.uninstall, [
+        "/tmp/deploy/htop-2.2.0-r0.aarch64.rpm",
+        "/tmp/deploy/nano-5.0-r0.aarch64.rpm",
+    ])
+
+    commands = [
+        str(c)
+        for op_hash in state.get_op_order()
+        for c in state.ops[host][op_hash]["commands"]
+    ]
+    assert [c for c in commands if "dnf" in c] == ["dnf remove -y htop"]
+
+    with pytest.raises(OperationError, match="this-is-not-correct"):
+        add_op(state, package.uninstall, ["this-is-not-correct"])
+
+
+def test_mender_rollout():
+    inventory = Inventory((["@local"], {}))
+    state = State(inventory, Config())
+    connect_all(state)
+    host = inventory.get_host("@local")
+
+    add_op(state, mender.rollout, "/data/a b.mender", health_command="true")
+
+    commands = [
+        str(c)
+        for op_hash in state.get_op_order()
+        for c in state.ops[host][op_hash]["commands"]
+    ]
+    string_commands = [c for c in commands if not c.startswith("Function")]
+    assert string_commands == [
+        "mender install '/data/a b.mender'",
+        "reboot",
+        "mender commit",
+    ]
+
+
+def test_mender_rollout_sudo():
+    inventory = Inventory((["@local"], {}))
+    state = State(inventory, Config())
+    connect_all(state)
+    host = inventory.get_host("@local")
+
+    add_op(state, mender.rollout, "/data/a.mender", sudo=True)
+
+    health_checks = [
+        c
+        for op_hash in state.get_op_order()
+        for c in state.ops[host][op_hash]["commands"]
+        if isinstance(c, FunctionCommand) and c.function == mender._check_health_or_roll_back
+    ]
+    assert [c.kwargs["executor_kwargs"]["sudo"] for c in health_checks] == [True]
+
+
+@pytest.mark.parametrize("command,url,healthy", [
+    (None, None, True),
+    ("true", None, True),
+    ("false", None, False),
+    ("true", "http://127.0.0.1:1/health", False),
+])
+def test_mender_health_check_command(command, url, healthy):
+    check = mender.health_check_command(command, url)
+    p = subprocess.run(["sh", "-c", check.get_raw_value()], capture_output=True)
+    assert (p.returncode == 0) == healthy
+
+
+class FakeHost:
+    name = "som-4F2D7.local."
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.commands = []
+
+    def run_shell_command(self, command, **kwargs):
+        self.commands.append((str(command), kwargs))
+        return self.statuses.pop(0), [], ["not healthy"]
+
+
+def test_mender_check_health(monkeypatch):
+    monkeypatch.setattr(mender, "_HEALTH_INTERVAL", 0)
+
+    host = FakeHost([False, True])
+    assert mender._check_health_or_roll_back(None, host, "check", 10)
+    assert host.commands == [("check", {}), ("check", {})]
+
+    host = FakeHost([False, False, True])
+    assert not mender._check_health_or_roll_back(None, host, "check", 0, {"sudo": True})
+    assert host.commands == [("check", {"sudo": True}), ("reboot", {"sudo": True})]
@@ -0,0 +1,162 @@
+import sys
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import gevent
+import pytest
+from gevent import socket
+
+from horus_deploy import reconnect
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def listen_later(port, seconds, banner=b"SSH-2.0-OpenSSH_8.9\r\n"):
+    """Run a fake SSH server that starts after some seconds."""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def serve():
+        sock.bind(("127.0.0.1", port))
+        sock.listen()
+        while True:
+            conn, _ = sock.accept()
+            conn.sendall(banner)
+            conn.close()
+
+    server = gevent.spawn_later(seconds, serve)
+    try:
+        yield
+    finally:
+        server.kill()
+        sock.close()
+
+
+def ssh_connect(port, connected):
+    def connect(addrs):
+        if ready := reconnect.ready_addrs(addrs, port):
+            connected.append(ready)
+        return bool(ready)
+
+    return connect
+
+
+def test_wait_for_host():
+    port = free_port()
+    connected = []
+
+    announcements = reconnect.Announcements("a", [], reconnect.Watcher())
+    start = time.monotonic()
+    with listen_later(port, 0.3), announcements:
+        assert reconnect.wait_for_host(
+            ["127.0.0.1"], ssh_connect(port, connected),
+            announcements, timeout=5, max_interval=0.2,
+        )
+
+    assert connected == [["127.0.0.1"]]
+    assert time.monotonic() - start < 1
+
+
+def test_wait_for_host_timeout():
+    connected = []
+
+    with reconnect.Announcements("a", [], reconnect.Watcher()) as announcements:
+        assert not reconnect.wait_for_host(
+            ["127.0.0.1"], ssh_connect(free_port(), connected),
+            announcements, timeout=0.3, max_interval=0.1,
+        )
+
+    assert connected == []
+
+
+def test_wait_for_host_resolve():
+    port = free_port()
+    resolved = []
+
+    def resolve():
+        resolved.append(True)
+        return ["127.0.0.1"]
+
+    announcements = reconnect.Announcements("a", [], reconnect.Watcher())
+    with listen_later(port, 0), announcements:
+        assert reconnect.wait_for_host(
+            ["192.0.2.1"], lambda addrs: addrs == ["127.0.0.1"],
+            announcements, timeout=5, max_interval=0.1, resolve=resolve,
+        )
+
+    assert resolved
+
+
+@pytest.fixture
+def watch_command():
+    script = (
+        "import json, time; time.sleep(0.2); print('not json');"
+        "print(json.dumps({'name': 'som-8C1A2.local.', 'hardware_id': 'b', 'addrs': ['::1']}));"
+        "print(json.dumps({'name': 'som-4F2D7.local.', 'hardware_id': 'a',"
+        " 'addrs': ['127.0.0.1']}), flush=True);"
+        "time.sleep(60)"
+    )
+    with patch("horus_deploy.reconnect._WATCH_COMMAND", [sys.executable, "-c", script]):
+        yield
+
+
+def test_announcements(watch_command):
+    watcher = reconnect.Watcher()
+    a = reconnect.Announcements("a", ["som-4F2D7-2.local.", None], watcher)
+    b = reconnect.Announcements("b", ["b"], watcher)
+
+    with a, b:
+        assert a.watching and b.watching
+        assert a.wait(10)
+        assert a.addrs == ["127.0.0.1"]
+        assert not a.wait(0.1)
+        assert b.addrs == ["::1"]
+
+    assert not watcher.running
+    assert not a.watching
+
+
+def test_stragglers():
+    watcher = reconnect.Watcher()
+    a = reconnect.Announcements("a", [], watcher)
+    b = reconnect.Announcements("b", [], watcher)
+
+    with a:
+        with b:
+            assert watcher.stragglers() == []
+            b.returned = True
+        assert watcher.durations
+        a.started -= 10
+        assert watcher.stragglers() == [a]
+
+
+def test_wait_for_host_announced(watch_command):
+    port = free_port()
+    connected = []
+
+    announcements = reconnect.Announcements("a", ["a"], reconnect.Watcher())
+    with listen_later(port, 0), announcements:
+        assert reconnect.wait_for_host(
+            ["192.0.2.1"], ssh_connect(port, connected),
+            announcements, timeout=10, max_interval=5,
+        )
+
+    assert connected == [["127.0.0.1"]]
+
+
+def test_ready_addrs():
+    port = free_port()
+
+    with listen_later(port, 0):
+        gevent.sleep(0.1)
+        assert reconnect.ready_addrs(["127.0.0.1"], port) == ["127.0.0.1"]
+
+    with listen_later(port, 0, banner=b"HTTP/1.1 400 Bad Request\r\n"):
+        gevent.sleep(0.1)
+        assert reconnect.ready_addrs(["127.0.0.1"], port) == []
@@ -0,0 +1,52 @@
+import struct
+
+import pytest
+
+from horus_deploy.rpm import Nevra, read_nevra
+
+
+def header(tags):
+    index = b""
+    store = b""
+    for tag, value in tags.items():
+        if isinstance(value, int):
+            store += b"\0" * (-len(store) % 4)
+            index += struct.pack(">IIII", tag, 4, len(store), 1)
+            store += struct.pack(">i", value)
+        else:
+            index += struct.pack(">IIII", tag, 6, len(store), 1)
+            store += value.encode() + b"\0"
+    intro = b"\x8e\xad\xe8\x01\0\0\0\0" + struct.pack(">II", len(tags), len(store))
+    return intro + index + store
+
+
+def write_rpm(path, tags):
+    lead = b"\xed\xab\xee\xdb" + b"\0" * 92
+    signature = header({1000: "abc"})
+    padding = b"\0" * (-len(signature) % 8)
+    path.write_bytes(lead + signature + padding + header(tags) + b"payload")
+
+
+def test_read_nevra(tmp_path):
+    path = tmp_path / "htop.rpm"
+    write_rpm(path, {1000: "htop", 1001: "2.2.0", 1002: "r0", 1022: "aarch64"})
+
+    nevra = read_nevra(path)
+
+    assert nevra == Nevra("htop", None, "2.2.0", "r0", "aarch64")
+    assert str(nevra) == "htop-2.2.0-r0.aarch64"
+
+
+def test_read_nevra_with_epoch(tmp_path):
+    path = tmp_path / "nano.rpm"
+    write_rpm(path, {1000: "nano", 1001: "5.0", 1002: "r0", 1003: 2, 1022: "noarch"})
+
+    assert read_nevra(path).epoch == 2
+
+
+def test_read_nevra_not_an_rpm(tmp_path):
+    path = tmp_path / "a.rpm"
+    path.write_bytes(b"not an rpm" * 20)
+
+    with pytest.raises(ValueError):
+        read_nevra(path)
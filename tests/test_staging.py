@@ -0,0 +1,151 @@
+import hashlib
+import subprocess
+import time
+
+import pytest
+
+from horus_deploy import staging
+from horus_deploy.artifact_server import ArtifactServer
+from horus_deploy.facts import StagedFile
+
+
+def sh(command):
+    return subprocess.run(
+        ["sh", "-c", command.get_raw_value()], capture_output=True, text=True
+    )
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "srv").mkdir()
+    (tmp_path / "srv" / "update.mender").write_bytes(b"0123456789" * 1000)
+    with ArtifactServer(tmp_path / "srv") as server:
+        yield server
+
+
+def wait_for(command, expected="done"):
+    for _ in range(100):
+        if (output := sh(command).stdout.strip()) == expected:
+            return output
+        time.sleep(0.05)
+    return output
+
+
+@pytest.mark.parametrize("value,expected", [
+    (100, 100),
+    ("100", 100),
+    ("500K", 500 * 1024),
+    ("2m", 2 * 1024 * 1024),
+])
+def test_parse_rate(value, expected):
+    assert staging.parse_rate(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "2 MB", "-1", "1.5M"])
+def test_parse_rate_invalid(value):
+    with pytest.raises(ValueError):
+        staging.parse_rate(value)
+
+
+def test_staged_path():
+    local = staging.staged_path("/tmp/a/update.mender")
+    url = staging.staged_path("http://192.168.1.2:8000/a/update.mender?x=1")
+
+    assert local.startswith(f"{staging.STAGE_DIR}/")
+    assert local.endswith("-update.mender")
+    assert url.endswith("-update.mender")
+    assert local != url
+
+
+def test_is_staged():
+    staged = ("0" * 64, "http://example.com/update.mender")
+
+    assert staging.is_staged(staged, "http://example.com/update.mender", None)
+    assert staging.is_staged(staged, "http://example.com/update.mender", "0" * 64)
+    assert not staging.is_staged(staged, "http://example.com/update.mender", "1" * 64)
+    assert not staging.is_staged(staged, "http://example.com/other/update.mender", None)
+    assert not staging.is_staged(None, "http://example.com/update.mender", None)
+
+
+def test_stage_command(tmp_path, server):
+    url = server.url_for(tmp_path / "srv" / "update.mender", "127.0.0.1")
+    dest = tmp_path / "staged" / "update.mender"
+    # A partial download of an earlier attempt is resumed.
+    (tmp_path / "staged").mkdir()
+    (tmp_path / "staged" / "update.mender.part").write_bytes(b"0123")
+    digest = hashlib.sha256(b"0123456789" * 1000).hexdigest()
+    command = staging.stage_command(url, str(dest), digest, rate_limit=1024 * 1024)
+
+    assert sh(command).stdout.strip() == "started"
+    assert wait_for(command) == "done"
+    assert dest.read_bytes() == b"0123456789" * 1000
+    assert not (tmp_path / "staged" / "update.mender.part").exists()
+    assert (tmp_path / "staged" / "update.mender.sha256").read_text() == f"{digest}\n{url}\n"
+
+
+def test_stage_command_replaces_other_file(tmp_path, server):
+    # A file of another source, or with another digest, isn't staged.
+    url = server.url_for(tmp_path / "srv" / "update.mender", "127.0.0.1")
+    dest = tmp_path / "update.mender"
+    dest.write_bytes(b"old")
+    (tmp_path / "update.mender.sha256").write_text(f"{'0' * 64}\n{url}\n")
+    digest = hashlib.sha256(b"0123456789" * 1000).hexdigest()
+    command = staging.stage_command(url, str(dest), digest)
+
+    assert sh(command).stdout.strip() == "started"
+    assert wait_for(command) == "done"
+    assert dest.read_bytes() == b"0123456789" * 1000
+
+
+def test_stage_command_checksum_mismatch(tmp_path, server):
+    url = server.url_for(tmp_path / "srv" / "update.mender", "127.0.0.1")
+    dest = tmp_path / "update.mender"
+    command = staging.stage_command(url, str(dest), "0" * 64)
+
+    assert sh(command).stdout.strip() == "started"
+    pid = int((tmp_path / "update.mender.pid").read_text())
+    for _ in range(100):
+        if subprocess.run(["kill", "-0", str(pid)], capture_output=True).returncode:
+            break
+        time.sleep(0.05)
+
+    assert not dest.exists()
+    assert not (tmp_path / "update.mender.part").exists()
+    assert "checksum mismatch" in (tmp_path / "update.mender.log").read_text()
+
+
+class FakeHost:
+    def __init__(self, staged):
+        self.staged = staged
+
+    def get_fact(self, fact, path):
+        assert fact is StagedFile
+        return self.staged.get(path)
+
+
+def test_staged_file(tmp_path, caplog):
+    src = tmp_path / "update.mender"
+    src.write_bytes(b"new")
+    path = staging.staged_path(str(src))
+    digest = hashlib.sha256(b"new").hexdigest()
+
+    assert staging.staged_file(FakeHost({}), str(src)) is None
+    assert staging.staged_file(FakeHost({path: (digest, str(src))}), str(src)) == path
+
+    # A staged file of an earlier version isn't installed.
+    stale = FakeHost({path: (hashlib.sha256(b"old").hexdigest(), str(src))})
+    assert staging.staged_file(stale, str(src)) is None
+    assert "ignoring" in caplog.text
+
+    url = "https://example.com/update.mender"
+    host = FakeHost({staging.staged_path(url): (digest, url)})
+    assert staging.staged_file(host, url) == staging.staged_path(url)
+    assert staging.staged_file(host, url, "0" * 64) is None
+
+
+def test_staged_file_fact():
+    fact = StagedFile()
+    assert fact.process(["0" * 64, "https://example.com/a.mender"]) == (
+        "0" * 64, "https://example.com/a.mender"
+    )
+    assert fact.process([]) is None
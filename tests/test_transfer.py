@@ -0,0 +1,339 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import time
+from unittest.mock import patch
+
+import pytest
+
+from horus_deploy import transfer
+
+
+def sh(command):
+    return subprocess.run(
+        ["sh", "-c", command.get_raw_value()], capture_output=True, text=True
+    )
+
+
+@pytest.fixture(autouse=True)
+def hash_cache(tmp_path):
+    with patch("horus_deploy.transfer._HASH_CACHE_PATH", tmp_path / "sha256_cache.json"):
+        with patch.dict("horus_deploy.transfer._hash_cache", clear=True):
+            yield
+
+
+def test_sha256_file(tmp_path):
+    path = tmp_path / "a.rpm"
+    path.write_bytes(b"abc")
+    expected = hashlib.sha256(b"abc").hexdigest()
+
+    assert transfer.sha256_file(path) == expected
+
+    with patch("horus_deploy.transfer.hashlib.sha256") as sha256:
+        assert transfer.sha256_file(path) == expected
+        sha256.assert_not_called()
+
+    path.write_bytes(b"abcd")
+    os.utime(path, ns=(0, 0))
+    assert transfer.sha256_file(path) == hashlib.sha256(b"abcd").hexdigest()
+
+
+def test_artifact_cache_commands(tmp_path):
+    cache_dir = tmp_path / "cache"
+    dest = tmp_path / "dest.rpm"
+    digest = hashlib.sha256(b"abc").hexdigest()
+
+    p = sh(transfer.cache_lookup_command(str(cache_dir), digest, str(dest)))
+    assert p.stdout == "miss\n"
+
+    (cache_dir / f"{digest}.part").write_bytes(b"abc")
+    p = sh(transfer.cache_store_command(str(cache_dir), digest, str(dest)))
+    assert p.returncode == 0
+    assert dest.read_bytes() == b"abc"
+
+    dest.unlink()
+    p = sh(transfer.cache_lookup_command(str(cache_dir), digest, str(dest)))
+    assert p.stdout == "hit\n"
+    assert dest.read_bytes() == b"abc"
+
+
+def test_artifact_cache_store_bad_checksum(tmp_path):
+    digest = hashlib.sha256(b"abc").hexdigest()
+    (tmp_path / f"{digest}.part").write_bytes(b"abd")
+
+    p = sh(transfer.cache_store_command(str(tmp_path), digest, str(tmp_path / "dest")))
+
+    assert p.returncode != 0
+    assert not (tmp_path / digest).exists()
+
+
+def test_artifact_cache_eviction(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    old = cache_dir / ("0" * 64)
+    old.write_bytes(b"x" * 10)
+    os.utime(old, (0, 0))
+    digest = hashlib.sha256(b"abc").hexdigest()
+    (cache_dir / f"{digest}.part").write_bytes(b"abc")
+    uploading = cache_dir / f"{'1' * 64}.part"
+    uploading.write_bytes(b"x" * 10)
+    os.utime(uploading, (0, 0))
+    recent = cache_dir / ("2" * 64)
+    recent.write_bytes(b"x" * 4)
+    older = cache_dir / ("3" * 64)
+    older.write_bytes(b"x" * 4)
+    os.utime(older, (time.time() - 60,) * 2)
+
+    p = sh(transfer.cache_store_command(
+        str(cache_dir), digest, str(tmp_path / "dest"), max_size=5
+    ))
+
+    # In-flight uploads and the stored file are neither counted nor removed.
+    assert p.returncode == 0
+    assert not old.exists()
+    assert not older.exists()
+    assert recent.exists()
+    assert uploading.exists()
+    assert (cache_dir / digest).exists()
+    assert (tmp_path / "dest").read_bytes() == b"abc"
+
+
+@pytest.mark.parametrize("method", ["gzip", "zstd"])
+def test_compressed_chunks(tmp_path, method):
+    if not shutil.which(method):
+        pytest.skip(f"{method} is not installed")
+
+    path = tmp_path / "a.rpm"
+    data = os.urandom(1024) * 4096
+    path.write_bytes(data)
+
+    compressed = b"".join(transfer.compressed_chunks(path, method))
+    p = subprocess.run(
+        transfer.COMPRESSION_METHODS[method].split(), input=compressed, capture_output=True
+    )
+
+    assert len(compressed) < len(data)
+    assert p.stdout == data
+
+
+def test_compressed_chunks_zstd_failure(tmp_path):
+    if not shutil.which("zstd"):
+        pytest.skip("zstd is not installed")
+
+    with pytest.raises(IOError, match="zstd failed"):
+        b"".join(transfer.compressed_chunks(tmp_path / "missing.rpm", "zstd"))
+
+
+def test_chunk_digests_command(tmp_path):
+    path = tmp_path / "a.part"
+    assert sh(transfer.chunk_digests_command(str(path), 4)).stdout == ""
+
+    path.write_bytes(b"abcdefghij")
+    p = sh(transfer.chunk_digests_command(str(path), 4))
+
+    assert p.stdout.split() == [
+        hashlib.sha256(b"abcd").hexdigest(),
+        hashlib.sha256(b"efgh").hexdigest(),
+    ]
+
+
+class FakeSFTP:
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+
+    def open(self, path, mode):
+        return FakeSFTPFile(open(path, mode), self.fail_after)
+
+    def close(self):
+        pass
+
+
+class FakeSFTPFile:
+    def __init__(self, fd, fail_after):
+        self.fd = fd
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fd.close()
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def write(self, data):
+        if self.fail_after is not None and self.fd.tell() + len(data) > self.fail_after:
+            self.fd.write(data[:self.fail_after - self.fd.tell()])
+            raise EOFError("connection lost")
+        self.fd.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fd, name)
+
+
+@pytest.fixture
+def fake_sftp():
+    with patch("horus_deploy.transfer._open_sftp", lambda transport: transport.sftps.pop(0)):
+        yield
+
+
+class FakeHost:
+    def __init__(self, sftps):
+        self.sftps = sftps
+        self.connection = self
+        self.connects = 0
+        self.writes = []
+        self.commands = []
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return False
+
+    def connect(self, show_errors=True):
+        self.connects += 1
+        self.connection = self
+
+    def run_shell_command(self, command, **kwargs):
+        self.commands.append((command.get_raw_value(), kwargs))
+        p = sh(command)
+        return p.returncode == 0, p.stdout.splitlines(), p.stderr
+
+
+def test_resumable_upload(tmp_path, fake_sftp):
+    src = tmp_path / "src.mender"
+    src.write_bytes(os.urandom(10 * 1024))
+    dest = tmp_path / "dest.mender"
+    host = FakeHost([FakeSFTP(fail_after=5000), FakeSFTP()])
+
+    with patch("horus_deploy.transfer.RESUME_CHUNK_SIZE", 1024), \
+            patch("horus_deploy.transfer._RESUME_RETRY_DELAY", 0), \
+            patch("horus_deploy.transfer._write_from", wraps=transfer._write_from) as write_from:
+        assert transfer._resumable_upload(host, str(src), str(dest))
+
+    assert dest.read_bytes() == src.read_bytes()
+    assert not (tmp_path / "dest.mender.part").exists()
+    assert host.connects == 1
+    assert [c.args[3] for c in write_from.call_args_list] == [0, 4096]
+
+
+def test_resumable_upload_from_earlier_run(tmp_path, fake_sftp):
+    src = tmp_path / "src.mender"
+    src.write_bytes(os.urandom(4 * 1024))
+    dest = tmp_path / "dest.mender"
+    part = tmp_path / "dest.mender.part"
+    part.write_bytes(src.read_bytes()[:2048] + b"x" * 1024)
+
+    with patch("horus_deploy.transfer.RESUME_CHUNK_SIZE", 1024), \
+            patch("horus_deploy.transfer._write_from", wraps=transfer._write_from) as write_from:
+        assert transfer._resumable_upload(FakeHost([FakeSFTP()]), str(src), str(dest))
+
+    assert dest.read_bytes() == src.read_bytes()
+    assert write_from.call_args.args[3] == 2048
+
+
+@pytest.mark.parametrize("size", [0, 1000, 10 * 1024 + 3])
+def test_sftp_put(tmp_path, fake_sftp, size):
+    src = tmp_path / "src.mender"
+    src.write_bytes(os.urandom(size))
+    dest = tmp_path / "dest.mender"
+    dest.write_bytes(b"x" * 20000)
+    host = FakeHost([FakeSFTP() for _ in range(5)])
+
+    with patch("horus_deploy.transfer._SFTP_MIN_RANGE_SIZE", 1024), \
+            patch("horus_deploy.transfer._CHUNK_SIZE", 1000), \
+            patch("horus_deploy.transfer._write_range", wraps=transfer._write_range) as write_range:
+        assert transfer.sftp_put(host, str(src), str(dest), streams=4)
+
+    assert dest.read_bytes() == src.read_bytes()
+    assert write_range.call_count == (max(1, min(4, size // 1024)) if size else 0)
+
+
+def test_sftp_put_failure(tmp_path, fake_sftp):
+    src = tmp_path / "src.mender"
+    src.write_bytes(os.urandom(4096))
+    host = FakeHost([FakeSFTP(), FakeSFTP(), FakeSFTP(fail_after=3000)])
+
+    with patch("horus_deploy.transfer._SFTP_MIN_RANGE_SIZE", 1024):
+        assert not transfer.sftp_put(host, str(src), str(tmp_path / "dest"), streams=2)
+
+
+def test_write_from_rate_limit(tmp_path, fake_sftp):
+    src = tmp_path / "src.mender"
+    src.write_bytes(os.urandom(4096))
+    part = tmp_path / "dest.mender.part"
+
+    start = time.monotonic()
+    with patch("horus_deploy.transfer._CHUNK_SIZE", 1024):
+        transfer._write_from(FakeHost([FakeSFTP()]), str(src), str(part), 0, rate_limit=8192)
+
+    assert time.monotonic() - start >= 0.4
+    assert part.read_bytes() == src.read_bytes()
+
+
+class FakeState:
+    def __init__(self, temp_dir):
+        self.temp_dir = temp_dir
+
+    def get_temp_filename(self, hash_key):
+        return str(self.temp_dir / ("pyinfra-" + hashlib.sha1(hash_key.encode()).hexdigest()))
+
+
+def fake_put_file(host, src, dest, *args, basis=None):
+    shutil.copy(src, dest)
+    return True
+
+
+def test_put_file_sudo(tmp_path):
+    src = tmp_path / "src.mender"
+    src.write_bytes(b"artifact")
+    dest = tmp_path / "dest.mender"
+    host = FakeHost([])
+
+    with patch("horus_deploy.transfer._put_file", wraps=fake_put_file) as put:
+        assert transfer.put_file(
+            FakeState(tmp_path), host, str(src), str(dest), delta=True,
+            executor_kwargs={"sudo": True},
+        )
+
+    temp = put.call_args.args[2]
+    assert temp != str(dest)
+    assert put.call_args.kwargs["basis"] == str(dest)
+    assert dest.read_bytes() == b"artifact"
+    assert not os.path.exists(temp)
+    assert host.commands[0] == (f"mv {temp} {dest}", {"sudo": True})
+
+
+def test_put_file_sudo_user(tmp_path):
+    src = tmp_path / "src.mender"
+    src.write_bytes(b"artifact")
+    host = FakeHost([])
+    executor_kwargs = {"sudo": True, "sudo_user": "mender"}
+
+    with patch("horus_deploy.transfer._put_file", wraps=fake_put_file) as put, \
+            patch.object(host, "run_shell_command", return_value=(True, [], [])) as run:
+        assert transfer.put_file(
+            FakeState(tmp_path), host, str(src), "/data/dest.mender",
+            executor_kwargs=executor_kwargs,
+        )
+
+    temp = put.call_args.args[2]
+    assert [(c.args[0].get_raw_value(), c.kwargs) for c in run.call_args_list] == [
+        (f"setfacl -m u:mender:r {temp}", {}),
+        (f"cp {temp} /data/dest.mender", executor_kwargs),
+        (f"rm -f {temp}", {}),
+    ]
+
+
+def test_put_file_without_sudo(tmp_path):
+    src = tmp_path / "src.mender"
+    src.write_bytes(b"artifact")
+    dest = tmp_path / "dest.mender"
+
+    with patch("horus_deploy.transfer._put_file", wraps=fake_put_file) as put:
+        assert transfer.put_file(FakeState(tmp_path), FakeHost([]), str(src), str(dest))
+
+    assert put.call_args.args[2] == str(dest)
@@ -0,0 +1,164 @@
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+
+import pytest
+
+from horus_deploy.url_cache import UrlCache, is_cacheable
+
+
+class Upstream:
+    """An HTTP server with files that have an ETag, counting downloads.
+
+    A file that is an ``HTTPStatus`` is answered with that error.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.downloads = []
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = upstream.files.get(self.path)
+                if body is None:
+                    body = HTTPStatus.NOT_FOUND
+                if isinstance(body, HTTPStatus):
+                    self.send_error(body)
+                    return
+                etag = f'"{hash(body)}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(HTTPStatus.NOT_MODIFIED)
+                    self.end_headers()
+                    return
+                upstream.downloads.append(self.path)
+                self.send_response(HTTPStatus.OK)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+
+@pytest.fixture
+def upstream():
+    upstream = Upstream()
+    thread = threading.Thread(target=upstream.server.serve_forever, daemon=True)
+    thread.start()
+    yield upstream
+    upstream.server.shutdown()
+    upstream.server.server_close()
+
+
+def test_get(upstream, tmp_path):
+    upstream.files["/a.mender"] = b"a" * 10
+    url = upstream.url("/a.mender")
+
+    cache = UrlCache(tmp_path)
+    threads = [threading.Thread(target=cache.get, args=(url,)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert cache.get(url).read_bytes() == b"a" * 10
+    assert upstream.downloads == ["/a.mender"]
+
+    # Revalidated by a next run, and downloaded again when it changed.
+    assert UrlCache(tmp_path).get(url).read_bytes() == b"a" * 10
+    assert upstream.downloads == ["/a.mender"]
+
+    upstream.files["/a.mender"] = b"b" * 10
+    assert UrlCache(tmp_path).get(url).read_bytes() == b"b" * 10
+    assert upstream.downloads == ["/a.mender"] * 2
+
+
+def test_get_error(upstream, tmp_path):
+    with pytest.raises(HTTPError):
+        UrlCache(tmp_path).get(upstream.url("/missing"))
+
+
+def test_get_offline(upstream, tmp_path):
+    upstream.files["/a"] = b"a"
+    url = upstream.url("/a")
+    UrlCache(tmp_path).get(url)
+
+    upstream.server.shutdown()
+    upstream.server.server_close()
+    assert UrlCache(tmp_path).get(url).read_bytes() == b"a"
+
+
+def test_get_upstream_error(upstream, tmp_path):
+    upstream.files["/a"] = b"a"
+    url = upstream.url("/a")
+    UrlCache(tmp_path).get(url)
+
+    upstream.files["/a"] = HTTPStatus.SERVICE_UNAVAILABLE
+    assert UrlCache(tmp_path).get(url).read_bytes() == b"a"
+
+
+def test_get_evicted_meanwhile(upstream, tmp_path):
+    upstream.files["/a"] = b"a" * 10
+    upstream.files["/b"] = b"b" * 10
+    cache = UrlCache(tmp_path, max_size=15)
+    fetch = cache._fetch
+
+    def fetch_then_fetch_b(url):
+        # Another thread fetches /b between the fetch of /a and its use,
+        # evicting /a.
+        fetch(url)
+        if url.endswith("/a") and upstream.downloads == ["/a"]:
+            thread = threading.Thread(target=cache.get, args=(upstream.url("/b"),))
+            thread.start()
+            thread.join()
+
+    cache._fetch = fetch_then_fetch_b
+    assert cache.get(upstream.url("/a")).read_bytes() == b"a" * 10
+    assert upstream.downloads == ["/a", "/b", "/a"]
+
+
+def test_evict(upstream, tmp_path):
+    for name in "abc":
+        upstream.files[f"/{name}"] = name.encode() * 10
+    upstream.files["/a-copy"] = b"a" * 10
+
+    cache = UrlCache(tmp_path, max_size=25)
+    a = cache.get(upstream.url("/a"))
+    cache.get(upstream.url("/a-copy"))
+    b = cache.get(upstream.url("/b"))
+    cache.get(upstream.url("/a"))
+    c = cache.get(upstream.url("/c"))
+
+    assert a.exists() and c.exists()
+    assert not b.exists()
+
+    # The least recently used URL is evicted, unless its file is used
+    # by another URL.
+    cache.get(upstream.url("/a-copy"))
+    cache.get(upstream.url("/b"))
+    assert a.exists() and b.exists()
+    assert not c.exists()
+    assert sorted(p.name for p in (tmp_path / "objects").iterdir()) == sorted([a.name, b.name])
+
+
+@pytest.mark.parametrize("url,expected", [
+    ("https://example.com/image.mender", True),
+    ("http://93.184.216.34/a.rpm", True),
+    ("http://127.0.0.1:8080/health", False),
+    ("http://localhost/health", False),
+    ("http://192.168.1.10/a.rpm", False),
+    ("http://[fe80::1]/a.rpm", False),
+    ("http://som-4F2D7.local/a.rpm", False),
+    ("ftp://example.com/a.rpm", False),
+    ("image.mender", False),
+])
+def test_is_cacheable(url, expected):
+    assert is_cacheable(url) == expected
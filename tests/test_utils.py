@@ -1,3 +1,4 @@
+import pstats
 from pathlib import Path
 
 import click
@@ -8,6 +9,7 @@ from horus_deploy.utils import (
     interpret_value,
     IdentifierOrKeyValue,
     multi_choice_prompt,
+    profiled,
     single_choice_prompt,
     temp_python_files,
 )
@@ -127,3 +129,13 @@ def test_single_choice_prompt(choice, output, expected):
     result = runner.invoke(prompt, input=choice)
     assert not result.exception
     assert result.output == output
+
+
+def test_profiled(tmp_path):
+    path = tmp_path / "out.pstats"
+
+    with profiled(path):
+        sum(range(100))
+
+    stats = pstats.Stats(str(path))
+    assert stats.total_calls > 0